@@ -1,76 +1,83 @@
 import logging
 import os
 import time
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
+from urllib.parse import parse_qs, urlparse
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from course_catalog import resolve_targets
+from moodle_automation import AdaptiveWait, Task, get_attachments, read_file, read_lines, register_task, run_task
 
-logging.basicConfig(filename="logs/moodle_announcement_log.txt", level=logging.INFO,
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+_forum_instances = {}  # Forum URL -> forum instance id, read from its 'Add discussion topic' link
 
-CHROMEDRIVER_PATH = os.path.join(os.getcwd(), 'chromedriver.exe')
 
+def read_announcements(batch_dir, shared_attachments_dir):
+    """Reads a batch of announcements, one sub-folder each, in name order.
 
-def read_file(file_path):
-    """Reads the content of a file."""
+    Every sub-folder holds subject.txt, message.txt and an optional attachments/
+    folder. Files in the shared attachments folder are added to every post.
+    """
+    shared = get_attachments(shared_attachments_dir)
+    announcements = []
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            content = file.read().strip()
-            return content
+        folders = sorted(f for f in os.listdir(batch_dir)
+                         if os.path.isdir(os.path.join(batch_dir, f)))
     except FileNotFoundError:
-        logging.error(f"File '{file_path}' not found.")
-        return None
-
-
-def read_lines(file_path):
-    """Reads multiple lines from a file."""
-    try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            content = file.readlines()
-            return [line.strip() for line in content]
-    except FileNotFoundError:
-        logging.error(f"File '{file_path}' not found.")
         return []
-
-
-def get_attachments(attachments_dir):
-    """Returns a list of attachments from a directory."""
-    try:
-        files = os.listdir(attachments_dir)
-        if not files:
-            logging.info("No attachments found. Skipping attachments.")
-            return []
-        logging.info(f"Attachments found: {files}")
-        return [os.path.abspath(os.path.join(attachments_dir, f)) for f in files]
-    except FileNotFoundError:
-        logging.error(f"Attachments folder '{attachments_dir}' not found.")
-        return []
-
-
-def log_in_to_moodle(driver):
-    """Logs in to Moodle manually."""
-    driver.get("https://moodle.nu.edu.eg/")
-    input("Press Enter after you have logged in manually...")
-    logging.info("User logged in manually.")
-
-
-def post_announcement(driver, forum_url, subject, message, attachments):
-    """Posts an announcement with attachments on the specified forum."""
-    driver.get(forum_url)
-    time.sleep(3)
+    for folder in folders:
+        path = os.path.join(batch_dir, folder)
+        subject = read_file(os.path.join(path, "subject.txt"))
+        message = read_file(os.path.join(path, "message.txt"))
+        if not subject or not message:
+            logging.error(f"Announcement '{folder}' is missing its subject or message. Skipping.")
+            continue
+        attachments = get_attachments(os.path.join(path, "attachments"))
+        announcements.append({"subject": subject, "message": message,
+                              "attachments": shared + attachments})
+    return announcements
+
+
+def on_forum(current_url, forum_url):
+    """True if the browser shows the forum's discussion list.
+
+    Forum links use the module id (view.php?id=<cmid>); after a post Moodle
+    redirects to view.php?f=<instance id>. Ids are compared exactly.
+    """
+    current, target = urlparse(current_url), urlparse(forum_url)
+    if current.netloc != target.netloc or current.path != target.path:
+        return False
+    query = parse_qs(current.query)
+    cmid = parse_qs(target.query).get("id")
+    if cmid and query.get("id") == cmid:
+        return True
+    instance = _forum_instances.get(forum_url)
+    return instance is not None and query.get("f") == [instance]
+
+
+def post_announcement(driver, forum_url, subject, message, attachments, posted_files=None):
+    """Posts an announcement with attachments on the specified forum.
+
+    The forum is only loaded if the browser is not already on it, so several
+    announcements can be posted back-to-back in one visit. Files listed in
+    `posted_files` are already on Moodle and are picked from 'Recent files'
+    instead of being uploaded again.
+    """
+    if not on_forum(driver.current_url, forum_url):
+        driver.get(forum_url)
+        time.sleep(3)
 
     # Click the 'Add discussion topic' button
     try:
         new_announcement_btn = driver.find_element(
             By.CSS_SELECTOR, "a.btn.btn-primary")
+        instance = parse_qs(urlparse(new_announcement_btn.get_attribute("href") or "").query).get("forum")
+        if instance:
+            _forum_instances[forum_url] = instance[0]
         new_announcement_btn.click()
         logging.info(f"Clicked 'Add discussion topic' on forum: {forum_url}")
     except Exception as e:
         logging.error(
             f"Failed to find 'Add discussion topic' button on forum: {forum_url} - Error: {e}")
-        return
+        raise
 
     time.sleep(3)  # Wait for the form to load
 
@@ -82,7 +89,7 @@ def post_announcement(driver, forum_url, subject, message, attachments):
     except Exception as e:
         logging.error(
             f"Failed to find the subject input on forum: {forum_url} - Error: {e}")
-        return
+        raise
 
     # Enter the message
     try:
@@ -93,11 +100,11 @@ def post_announcement(driver, forum_url, subject, message, attachments):
     except Exception as e:
         logging.error(
             f"Failed to find the message input on forum: {forum_url} - Error: {e}")
-        return
+        raise
 
     # Handle attachments(if any)
     if attachments:
-        upload_attachments(driver, attachments)
+        upload_attachments(driver, attachments, posted_files)
 
     # Scroll to the submit button and ensure it's clickable
     try:
@@ -108,7 +115,7 @@ def post_announcement(driver, forum_url, subject, message, attachments):
         time.sleep(2)  # Let the scroll action take effect
 
         # Ensure no modal or overlay is blocking the click
-        WebDriverWait(driver, 10).until(
+        AdaptiveWait(driver, 10, key="announcer.submit").until(
             EC.element_to_be_clickable((By.ID, "id_submitbutton"))
         )
 
@@ -116,14 +123,48 @@ def post_announcement(driver, forum_url, subject, message, attachments):
         driver.execute_script("arguments[0].click();", submit_button)
         logging.info(f"Submitted the form on forum: {forum_url}")
         print(f"Submitted the form on forum: {forum_url}")
+        if posted_files is not None:
+            posted_files.update(attachments)
 
     except Exception as e:
         logging.error(
             f"Failed to submit the form on forum: {forum_url} - Error: {e}")
         print(f"Failed to submit the form on forum: {forum_url} - Error: {e}")
-
-
-def upload_attachments(driver, attachments):
+        raise
+
+
+def open_file_repository(driver, repository_name):
+    """Switches the open file picker to the named repository, if it is listed."""
+    repositories = driver.find_elements(
+        By.XPATH, f"//span[contains(@class, 'fp-repo-name') and text()='{repository_name}']")
+    if repositories:
+        driver.execute_script("arguments[0].click();", repositories[0])
+        time.sleep(1)
+    return bool(repositories)
+
+
+def select_recent_file(driver, attachment):
+    """Picks an already posted file from 'Recent files' so its bytes are not sent again."""
+    filename = os.path.basename(attachment)
+    if not open_file_repository(driver, "Recent files"):
+        return False
+    files = AdaptiveWait(driver, 10, key="announcer.picker_files").until(
+        EC.presence_of_all_elements_located((By.CSS_SELECTOR, "div.fp-filename")))
+    for file_label in files:
+        if file_label.text == filename:
+            driver.execute_script("arguments[0].click();", file_label)
+            select_button = AdaptiveWait(driver, 10, key="announcer.picker_select").until(
+                EC.element_to_be_clickable((By.CSS_SELECTOR, "button.fp-select-confirm")))
+            select_button.click()
+            AdaptiveWait(driver, 30, key="announcer.picker_upload").until(
+                EC.invisibility_of_element((By.CSS_SELECTOR, 'div.fp-uploadinprogress')))
+            logging.info(f"Attached recent file: {filename}")
+            print(f"Attached recent file: {filename}")
+            return True
+    return False
+
+
+def upload_attachments(driver, attachments, posted_files=None):
     """Uploads attachments one by one, ensuring each is uploaded before proceeding."""
     try:
         # Click the "Advanced" button
@@ -143,6 +184,11 @@ def upload_attachments(driver, attachments):
                 logging.info("Clicked the 'Add file' button.")
                 time.sleep(2)
 
+                if posted_files and attachment in posted_files and select_recent_file(driver, attachment):
+                    time.sleep(2)
+                    continue
+                open_file_repository(driver, "Upload a file")
+
                 # Find the file input element and send the file path
                 file_upload_element = driver.find_element(
                     By.CSS_SELECTOR, 'input[name="repo_upload_file"]')
@@ -156,7 +202,8 @@ def upload_attachments(driver, attachments):
                 logging.info(f"Clicked 'Upload this file' for {attachment}")
 
                 # Wait for the file to finish uploading
-                WebDriverWait(driver, 30).until(
+                AdaptiveWait(driver, 30, size_bytes=os.path.getsize(attachment),
+                             key="announcer.attachment_upload").until(
                     EC.invisibility_of_element((By.CSS_SELECTOR, 'div.fp-uploadinprogress')))
                 logging.info(f"File upload finished: {attachment}")
                 print(f"File upload finished: {attachment}")
@@ -167,49 +214,42 @@ def upload_attachments(driver, attachments):
             except Exception as e:
                 logging.error(
                     f"Failed to upload attachment: {attachment} - Error: {e}")
-                continue
+                raise
 
     except Exception as e:
         logging.error(f"Failed to upload attachment(s) - Error: {e}")
-
-
-def main():
-    # Read files
-    links_file = "input/links.txt"
-    subject_file = "input/subject.txt"
-    message_file = "input/message.txt"
-    attachments_dir = "input/attachments"
-
-    FORUM_URLS = read_lines(links_file)
-    ANNOUNCEMENT_SUBJECT = read_file(subject_file)
-    ANNOUNCEMENT_MESSAGE = read_file(message_file)
-    attachments = get_attachments(attachments_dir)
-
-    if not FORUM_URLS:
-        logging.error("No URLs found in links.txt. Exiting script.")
-        return
-
-    if not ANNOUNCEMENT_SUBJECT or not ANNOUNCEMENT_MESSAGE:
-        logging.error("Subject or message is missing. Exiting script.")
-        return
-
-    # Set up WebDriver
-    service = Service(executable_path=CHROMEDRIVER_PATH)
-    driver = webdriver.Chrome(service=service)
-    driver.maximize_window()
-
-    # Log in to Moodle manually
-    log_in_to_moodle(driver)
-
-    # Loop through each forum URL to post the announcement
-    for forum_url in FORUM_URLS:
-        post_announcement(driver, forum_url, ANNOUNCEMENT_SUBJECT,
-                          ANNOUNCEMENT_MESSAGE, attachments)
-
-    # Close the browser once all announcements are posted
-    driver.quit()
-    logging.info("Browser closed. Script completed.")
+        raise
+
+
+@register_task
+class AnnouncementTask(Task):
+    name = "announce"
+    description = "Post announcements to Moodle forums."
+    log_file = "moodle_announcement_log.txt"
+    login = "prompt"
+    target_kind = "forum"
+
+    def load_inputs(self, args):
+        attachments_dir = "input/attachments"
+        announcements = read_announcements("input/announcements", attachments_dir)
+        if not announcements:
+            subject = read_file("input/subject.txt")
+            message = read_file("input/message.txt")
+            if not subject or not message:
+                logging.error("Subject or message is missing.")
+                return None
+            announcements = [{"subject": subject, "message": message,
+                              "attachments": get_attachments(attachments_dir)}]
+        return {"targets": resolve_targets(read_lines("input/links.txt"), self.target_kind),
+                "announcements": announcements, "posted_files": set()}
+
+    def run_course(self, driver, forum_url, inputs, retries):
+        # Visit each forum once and post every announcement back-to-back
+        for announcement in inputs["announcements"]:
+            retries.run(forum_url, f"post '{announcement['subject']}'", post_announcement, driver,
+                        forum_url, announcement["subject"], announcement["message"],
+                        announcement["attachments"], inputs["posted_files"])
 
 
 if __name__ == "__main__":
-    main()
+    run_task(AnnouncementTask())
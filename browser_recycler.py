@@ -0,0 +1,154 @@
+import csv
+import logging
+import os
+import time
+import psutil
+from moodle_automation import MOODLE_URL, start_chrome
+
+MAX_COURSES = 25
+MAX_RSS_MB = 1500
+TIMELINE_PATH = os.path.join("logs", "memory_timeline.csv")
+
+
+def browser_rss_mb(driver):
+    """Returns the resident memory of chromedriver and every Chrome process under it, in MB."""
+    try:
+        root = psutil.Process(driver.service.process.pid)
+        processes = [root] + root.children(recursive=True)
+    except (AttributeError, psutil.Error):
+        return None
+    total = 0
+    for process in processes:
+        try:
+            total += process.memory_info().rss
+        except psutil.Error:
+            continue  # tabs and renderers come and go while we sample
+    return total / 2 ** 20
+
+
+class RecyclingDriver:
+    """A WebDriver stand-in that swaps in a fresh browser during long runs.
+
+    Everything not defined here is forwarded to the current browser, so the
+    scripts, the retry queue and any deferred steps keep working across a
+    swap. Call course_done() after each course: it samples memory, and
+    recycles the browser after `max_courses` courses, above `max_rss_mb`, or
+    when Chrome has died. The session is restored from the cookies saved at
+    the last course; `login(driver)` is only used if they no longer work.
+    `stop_browser(driver)` ends the old browser; by default it is quit.
+    """
+
+    def __init__(self, start_browser=start_chrome, login=None, cookies=None,
+                 max_courses=MAX_COURSES, max_rss_mb=MAX_RSS_MB, stop_browser=None):
+        self._start_browser = start_browser
+        self._stop_browser = stop_browser
+        self._login = login
+        self._cookies = cookies
+        self._max_courses = max_courses
+        self._max_rss_mb = max_rss_mb
+        self._courses = 0
+        self._total_courses = 0
+        self._recycles = 0
+        self._timeline = []
+        self._started = time.time()
+        self._driver = start_browser()
+        if cookies:
+            self._restore_session()
+
+    def __getattr__(self, name):
+        return getattr(self._driver, name)
+
+    def _alive(self):
+        try:
+            return self._driver.current_url
+        except Exception:
+            return None
+
+    def _restore_session(self):
+        from course_shards import restore_session_cookies
+        if self._cookies:
+            restore_session_cookies(self._driver, self._cookies)
+        self._driver.get(MOODLE_URL)
+        if "login" in self._driver.current_url and self._login is not None:
+            logging.warning("Saved cookies no longer log in. Logging in again.")
+            self._login(self._driver)
+
+    def _sample(self, event, course_url=None):
+        rss = browser_rss_mb(self._driver)
+        try:
+            heap = self._driver.execute_script(
+                "return performance.memory ? performance.memory.usedJSHeapSize : null;")
+        except Exception:
+            heap = None
+        self._timeline.append({
+            "seconds": round(time.time() - self._started, 1),
+            "course": self._total_courses,
+            "event": event,
+            "url": course_url or "",
+            "rss_mb": round(rss, 1) if rss is not None else "",
+            "js_heap_mb": round(heap / 2 ** 20, 1) if heap else "",
+        })
+        return rss
+
+    def recycle(self, reason):
+        """Quits the current browser and continues in a new one with the saved session."""
+        logging.info(f"Recycling the browser after {self._courses} course(s): {reason}")
+        print(f"Recycling the browser after {self._courses} course(s): {reason}")
+        try:
+            if self._stop_browser is not None:
+                self._stop_browser(self._driver)
+            else:
+                self._driver.quit()
+        except Exception as e:
+            logging.warning(f"Old browser did not quit cleanly - Error: {e}")
+        self._driver = self._start_browser()
+        self._restore_session()
+        self._courses = 0
+        self._recycles += 1
+        self._sample(f"recycled ({reason})")
+
+    def revive(self):
+        """Starts a new browser if Chrome has died. Returns True if it had."""
+        if self._alive() is not None:
+            return False
+        self.recycle("browser died")
+        return True
+
+    def course_done(self, course_url=None):
+        """Records one finished course and recycles the browser if a limit is reached."""
+        self._courses += 1
+        self._total_courses += 1
+        url = self._alive()
+        if url is None:
+            self.recycle("browser died")
+            return
+        if url.startswith(MOODLE_URL):
+            # Keep the latest cookies so a crash later on can still be recovered
+            self._cookies = self._driver.get_cookies()
+        rss = self._sample("course", course_url)
+        if self._courses >= self._max_courses:
+            self.recycle(f"{self._max_courses} courses")
+        elif rss is not None and rss > self._max_rss_mb:
+            self.recycle(f"{rss:.0f} MB above {self._max_rss_mb} MB")
+
+    def memory_report(self, output_path=TIMELINE_PATH):
+        """Prints the memory range of the run and writes the full timeline as CSV."""
+        samples = [row["rss_mb"] for row in self._timeline if row["rss_mb"] != ""]
+        if not samples:
+            return
+        summary = (f"Browser memory over {self._total_courses} course(s): "
+                   f"{min(samples):.0f}-{max(samples):.0f} MB, {self._recycles} recycle(s)")
+        print(summary)
+        logging.info(summary)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        with open(output_path, 'w', encoding='utf-8', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=list(self._timeline[0]))
+            writer.writeheader()
+            writer.writerows(self._timeline)
+        print(f"Memory timeline written to {output_path}.")
+
+
+def course_done(driver, course_url=None):
+    """Calls course_done() on a RecyclingDriver; plain drivers are left alone."""
+    if isinstance(driver, RecyclingDriver):
+        driver.course_done(course_url)
@@ -0,0 +1,263 @@
+import argparse
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from moodle_automation import MOODLE_URL, setup_logging
+from moodle_http import course_id_from_url, login_session
+from page_cache import get_page
+
+CATALOG_DB_PATH = "course_catalog.db"
+COURSES_LINKS_PATH = "courses_links.txt"
+MAX_AGE_HOURS = 24
+FETCH_WORKERS = 8
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS courses (
+    course_id INTEGER PRIMARY KEY,
+    group_name TEXT,
+    announcement_cmid INTEGER,
+    fetched_at REAL
+);
+CREATE TABLE IF NOT EXISTS sections (
+    course_id INTEGER,
+    section_number INTEGER,
+    name TEXT,
+    PRIMARY KEY (course_id, section_number)
+);
+"""
+
+
+def course_url(course_id):
+    return f"{MOODLE_URL}/course/view.php?id={course_id}"
+
+
+def gradebook_setup_url(course_id):
+    return f"{MOODLE_URL}/grade/edit/tree/index.php?id={course_id}"
+
+
+def grader_report_url(course_id):
+    return f"{MOODLE_URL}/grade/report/grader/index.php?id={course_id}"
+
+
+def forum_url(cmid):
+    return f"{MOODLE_URL}/mod/forum/view.php?id={cmid}"
+
+
+def read_course_groups(file_path=COURSES_LINKS_PATH):
+    """Reads course ids grouped under '#NAME' headers. Non-course links are ignored."""
+    groups = {}
+    group = None
+    try:
+        with open(file_path, 'r', encoding='utf-8') as file:
+            for line in file:
+                line = line.strip()
+                if line.startswith("#"):
+                    group = line[1:].strip()
+                elif "course/view.php" in line and group:
+                    groups.setdefault(group, []).append(course_id_from_url(line))
+    except FileNotFoundError:
+        logging.error(f"File '{file_path}' not found.")
+    return groups
+
+
+class CoursePageParser(HTMLParser):
+    """Picks the announcement forum and the section list out of a course page."""
+
+    def __init__(self):
+        super().__init__()
+        self.sections = {}
+        self.forums = []
+        self._forum_href = None
+        self._forum_text = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        element_id = attrs.get("id") or ""
+        if tag == "li" and element_id.startswith("section-") and element_id[8:].isdigit():
+            name = attrs.get("data-sectionname") or attrs.get("aria-label") or ""
+            self.sections[int(element_id[8:])] = name
+        elif tag == "a" and "/mod/forum/view.php?id=" in (attrs.get("href") or ""):
+            self._forum_href = attrs["href"]
+            self._forum_text = []
+
+    def handle_data(self, data):
+        if self._forum_href is not None:
+            self._forum_text.append(data)
+
+    def handle_endtag(self, tag):
+        if tag == "a" and self._forum_href is not None:
+            self.forums.append((course_id_from_url(self._forum_href),
+                                " ".join("".join(self._forum_text).split())))
+            self._forum_href = None
+
+    def announcement_cmid(self):
+        # The news forum is named 'Announcements' and sits first in section 0
+        for cmid, text in self.forums:
+            if "announcement" in text.lower():
+                return cmid
+        return self.forums[0][0] if self.forums else None
+
+
+def connect(db_path=CATALOG_DB_PATH):
+    connection = sqlite3.connect(db_path)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def parse_course_page(html):
+    parser = CoursePageParser()
+    parser.feed(html)
+    return parser.announcement_cmid(), parser.sections
+
+
+def fetch_course(session, course_id):
+    """Downloads one course page and returns (announcement cmid, {section: name})."""
+    return get_page(session, course_url(course_id), parse_course_page, timeout=30)
+
+
+def stale_course_ids(connection, course_ids, max_age_hours):
+    cutoff = time.time() - max_age_hours * 3600
+    fresh = {row[0] for row in connection.execute(
+        "SELECT course_id FROM courses WHERE fetched_at >= ?", (cutoff,))}
+    return [course_id for course_id in course_ids if course_id not in fresh]
+
+
+def refresh_catalog(session, groups, db_path=CATALOG_DB_PATH, max_age_hours=MAX_AGE_HOURS, force=False):
+    """Fetches every course that is missing or older than `max_age_hours` and stores it."""
+    connection = connect(db_path)
+    group_of = {cid: group for group, ids in groups.items() for cid in ids}
+    todo = list(group_of) if force else stale_course_ids(
+        connection, list(group_of), max_age_hours)
+    print(f"Refreshing {len(todo)} of {len(group_of)} course(s).")
+
+    def fetch(course_id):
+        try:
+            return course_id, fetch_course(session, course_id), None
+        except Exception as e:
+            return course_id, None, e
+
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        for course_id, found, error in executor.map(fetch, todo):
+            if error is not None:
+                logging.error(f"Failed to index course {course_id} - Error: {error}")
+                print(f"Failed to index course {course_id} - Error: {error}")
+                continue
+            cmid, sections = found
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO courses VALUES (?, ?, ?, ?)",
+                    (course_id, group_of[course_id], cmid, time.time()))
+                connection.execute(
+                    "DELETE FROM sections WHERE course_id = ?", (course_id,))
+                connection.executemany(
+                    "INSERT INTO sections VALUES (?, ?, ?)",
+                    [(course_id, number, name) for number, name in sections.items()])
+            logging.info(f"Indexed course {course_id}: forum {cmid}, {len(sections)} section(s)")
+    connection.close()
+
+
+def lookup_courses(group=None, db_path=CATALOG_DB_PATH):
+    """Returns (course_id, announcement_cmid) rows, optionally for one group."""
+    if not os.path.exists(db_path):
+        return []
+    connection = connect(db_path)
+    if group is None:
+        rows = connection.execute(
+            "SELECT course_id, announcement_cmid FROM courses ORDER BY group_name, course_id")
+    else:
+        rows = connection.execute(
+            "SELECT course_id, announcement_cmid FROM courses WHERE group_name = ? ORDER BY course_id",
+            (group,))
+    rows = rows.fetchall()
+    connection.close()
+    return rows
+
+
+def course_sections(course_id, db_path=CATALOG_DB_PATH):
+    """Returns [(section_number, name)] for an indexed course."""
+    if not os.path.exists(db_path):
+        return []
+    connection = connect(db_path)
+    rows = connection.execute(
+        "SELECT section_number, name FROM sections WHERE course_id = ? ORDER BY section_number",
+        (course_id,)).fetchall()
+    connection.close()
+    return rows
+
+
+def resolve_targets(lines, kind, db_path=CATALOG_DB_PATH):
+    """Turns links-file lines into target URLs of the given kind.
+
+    A line may be a full URL, a bare course id, or '#GROUP' for every indexed
+    course of that group. Kinds: 'course', 'forum' (announcement forum) and
+    'gradebook' (gradebook setup).
+    """
+    targets = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("#"):
+            rows = lookup_courses(line[1:].strip(), db_path)
+            if not rows:
+                logging.error(f"Group '{line}' is not in the course catalog.")
+            targets.extend(_target_url(kind, cid, cmid) for cid, cmid in rows)
+        elif kind == "forum" and "mod/forum/view.php" in line:
+            targets.append(line)
+        else:
+            course_id = int(line) if line.isdigit() else course_id_from_url(line)
+            targets.append(line if course_id is None
+                           else _target_for_course(kind, course_id, db_path))
+    return [target for target in targets if target]
+
+
+def _target_for_course(kind, course_id, db_path):
+    if kind != "forum":
+        return _target_url(kind, course_id, None)
+    for cid, cmid in lookup_courses(None, db_path):
+        if cid == course_id:
+            return _target_url(kind, cid, cmid)
+    logging.error(f"Course {course_id} has no announcement forum in the catalog.")
+    return None
+
+
+def _target_url(kind, course_id, cmid):
+    if kind == "forum":
+        return forum_url(cmid) if cmid else None
+    if kind == "gradebook":
+        return gradebook_setup_url(course_id)
+    return course_url(course_id)
+
+
+def main():
+    setup_logging("course_catalog_log.txt")
+    parser = argparse.ArgumentParser(
+        description="Index announcement forums and sections of every course in courses_links.txt.")
+    parser.add_argument("--links", default=COURSES_LINKS_PATH,
+                        help="course list grouped under '#NAME' headers")
+    parser.add_argument("--max-age", type=float, default=MAX_AGE_HOURS,
+                        help="re-fetch courses indexed more than this many hours ago")
+    parser.add_argument("--refresh", action="store_true",
+                        help="re-fetch every course")
+    args = parser.parse_args()
+
+    groups = read_course_groups(args.links)
+    if not groups:
+        print("No courses found. Exiting.")
+        return
+    session = login_session()
+    if session is None:
+        print("Login failed. Exiting.")
+        return
+    refresh_catalog(session, groups, max_age_hours=args.max_age, force=args.refresh)
+    for group in groups:
+        for course_id, cmid in lookup_courses(group):
+            numbers = [number for number, _ in course_sections(course_id)]
+            print(f"{group:<10} course {course_id}  forum {cmid}  sections {numbers}")
+
+
+if __name__ == "__main__":
+    main()
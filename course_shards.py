@@ -0,0 +1,167 @@
+import atexit
+import importlib
+import logging
+import multiprocessing
+import os
+import queue
+import time
+from browser_recycler import RecyclingDriver, course_done
+from driver_profiler import report
+from network_profiler import HAR_OUTPUT_PATH, SUMMARY_OUTPUT_PATH, report as network_report
+from moodle_automation import MOODLE_URL, save_history, setup_logging
+from progress_dashboard import attach_worker, emit, worker_queue
+from retry_queue import RetryQueue
+
+
+def export_session_cookies(driver):
+    """Returns the Moodle cookies of a logged-in browser so workers can reuse the session."""
+    driver.get(f"{MOODLE_URL}/")
+    return driver.get_cookies()
+
+
+def restore_session_cookies(driver, cookies):
+    """Loads exported cookies into a fresh browser without a login round trip."""
+    for cookie in cookies:
+        params = {
+            "name": cookie["name"],
+            "value": cookie["value"],
+            "domain": cookie["domain"],
+            "path": cookie.get("path", "/"),
+            "secure": cookie.get("secure", False),
+            "httpOnly": cookie.get("httpOnly", False),
+        }
+        if "expiry" in cookie:
+            params["expires"] = cookie["expiry"]
+        driver.execute_cdp_cmd("Network.setCookie", params)
+
+
+def write_worker_reports(worker_id):
+    """Writes a worker process's WebDriver and network profiles under its own names, and its wait timings.
+
+    Spawned workers (the default on Windows) run atexit hooks when they exit,
+    and the profilers' hooks would overwrite the parent's reports with this
+    worker's, so they are unregistered here.
+    """
+    report(output_path=os.path.join("logs", f"webdriver_profile_worker{worker_id}.folded"))
+    network_report(har_path=HAR_OUTPUT_PATH.replace(".har.json", f"_worker{worker_id}.har.json"),
+                   summary_path=SUMMARY_OUTPUT_PATH.replace(".txt", f"_worker{worker_id}.txt"))
+    atexit.unregister(report)
+    atexit.unregister(network_report)
+    save_history()
+
+
+def worker_main(worker_id, module_name, function_name, extra_args, cookies, tasks, results, events=None):
+    """Runs courses from the task queue in one browser until it receives None."""
+    # Worker processes do not run the script's main(), so give each its own log file
+    setup_logging(f"{module_name}_worker{worker_id}_log.txt")
+    attach_worker(events, worker_id)
+    module = importlib.import_module(module_name)
+    course_func = getattr(module, function_name)
+
+    driver = RecyclingDriver(cookies=cookies)
+    logging.info(f"Worker {worker_id} started with the shared session.")
+
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            index, course_url = task
+            start_time = time.time()
+            result = {"index": index, "course": course_url, "worker": worker_id}
+            emit("course_start", course_url)
+            try:
+                # Failed steps are retried at the end of their own course
+                retries = RetryQueue(driver)
+                course_func(driver, course_url, *extra_args, retries=retries)
+                retries.retry_deferred()
+                if retries.failed:
+                    result.update(status="failed", error="; ".join(
+                        f"{entry['step']}: {entry['error']}" for entry in retries.failed))
+                else:
+                    result["status"] = "ok"
+            except Exception as e:
+                logging.error(f"Worker {worker_id} failed on course: {course_url} - Error: {e}")
+                result.update(status="failed", error=str(e))
+            course_done(driver, course_url)
+            result["duration"] = round(time.time() - start_time, 2)
+            emit("course_end", course_url, value=result["status"])
+            results.put(result)
+    finally:
+        driver.memory_report(os.path.join("logs", f"memory_timeline_worker{worker_id}.csv"))
+        driver.quit()
+        write_worker_reports(worker_id)
+
+
+def run_sharded(driver, course_links, module_name, function_name, extra_args=(), jobs=2, deterministic=False):
+    """Runs `module_name.function_name(driver, course_url, *extra_args, retries=...)` for every course
+    across `jobs` worker processes that share the session of the logged-in `driver`.
+
+    Workers normally pull the next course from a shared queue as soon as they are
+    free. With `deterministic`, course i always goes to worker i % jobs in list order.
+    Returns one result per course, in the order of `course_links`.
+    """
+    cookies = export_session_cookies(driver)
+    jobs = max(1, min(jobs, len(course_links)))
+
+    if deterministic:
+        task_queues = [multiprocessing.Queue() for _ in range(jobs)]
+        for index, course_url in enumerate(course_links):
+            task_queues[index % jobs].put((index, course_url))
+    else:
+        shared = multiprocessing.Queue()
+        for task in enumerate(course_links):
+            shared.put(task)
+        task_queues = [shared] * jobs
+    for task_queue in task_queues:
+        task_queue.put(None)
+
+    results = multiprocessing.Queue()
+    events = worker_queue()
+    workers = [
+        multiprocessing.Process(
+            target=worker_main,
+            args=(worker_id, module_name, function_name, extra_args,
+                  cookies, task_queues[worker_id - 1], results, events))
+        for worker_id in range(1, jobs + 1)
+    ]
+    for worker in workers:
+        worker.start()
+
+    collected = {}
+    while len(collected) < len(course_links) and any(w.is_alive() for w in workers):
+        try:
+            result = results.get(timeout=5)
+        except queue.Empty:
+            continue
+        collected[result["index"]] = result
+        print(f"[worker {result['worker']}] {result['course']}: {result['status']} "
+              f"(Time taken: {result['duration']:.2f} seconds)")
+    while not results.empty():
+        result = results.get()
+        collected[result["index"]] = result
+    for worker in workers:
+        worker.join()
+
+    return [collected.get(index, {"index": index, "course": course_url, "worker": None,
+                                  "status": "not run", "duration": 0})
+            for index, course_url in enumerate(course_links)]
+
+
+def print_result_table(results):
+    """Prints and logs the merged per-course result table."""
+    width = max([len(r["course"]) for r in results] + [len("Course")])
+    lines = [f"{'Course':<{width}}  {'Status':<8}  {'Worker':<6}  Time (s)"]
+    for r in results:
+        worker = r["worker"] if r["worker"] is not None else "-"
+        lines.append(f"{r['course']:<{width}}  {r['status']:<8}  {worker!s:<6}  {r['duration']:.2f}")
+    table = "\n".join(lines)
+    print(table)
+    logging.info(f"Per-course results:\n{table}")
+
+
+def add_shard_arguments(parser):
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="number of worker processes (each with its own browser)")
+    parser.add_argument("--deterministic", action="store_true",
+                        help="assign course i to worker i %% jobs in list order, for debugging")
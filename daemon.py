@@ -0,0 +1,242 @@
+import argparse
+import contextlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from browser_recycler import course_done
+from course_catalog import resolve_targets
+from moodle_automation import TASK_MODULES, load_task, login_function, open_browser, setup_logging
+from progress_dashboard import Dashboard, emit, expect, stop_dashboard
+from retry_queue import RetryQueue
+
+QUEUE_FILE_PATH = "queue/jobs.jsonl"
+RESULTS_FILE_PATH = "queue/results.jsonl"
+POLL_INTERVAL = 2
+
+# Section renaming types through pyautogui into whichever window has focus,
+# so only one upload_section job that adds sections may drive the desktop at a time.
+_DESKTOP_LOCK = threading.Lock()
+_RESULTS_LOCK = threading.Lock()
+
+
+def load_job_inputs(task, params):
+    """Reads a task's inputs the way its script does, then applies the job's options and targets.
+
+    `options` sets the task's command-line options by name (e.g.
+    create_new_section). `targets` replaces the links file and is resolved
+    the same way: links, course ids or '#GROUP' names.
+    """
+    parser = argparse.ArgumentParser()
+    task.add_arguments(parser)
+    args = parser.parse_args([])
+    for name, value in params.get("options", {}).items():
+        setattr(args, name, value)
+    inputs = task.load_inputs(args)
+    if inputs and params.get("targets"):
+        inputs["targets"] = resolve_targets(params["targets"], task.target_kind)
+    return inputs
+
+
+def run_operation(driver, operation, params, retries, worker=None):
+    """Runs a registered task over a job's targets in one browser and retries its failed steps."""
+    task = load_task(operation)
+    inputs = load_job_inputs(task, params)
+    if not inputs or not inputs.get("targets"):
+        raise ValueError("Missing required data. Please check the input files.")
+    expect(len(inputs["targets"]))
+    desktop = task.name == "upload_section" and inputs["create_new_section"]
+    with _DESKTOP_LOCK if desktop else contextlib.nullcontext():
+        for target in inputs["targets"]:
+            emit("course_start", target, worker=worker)
+            try:
+                task.run_course(driver, target, inputs, retries)
+            except Exception:
+                emit("course_end", target, value="failed")
+                raise
+            course_done(driver, target)
+            emit("course_end", target, value=retries.course_status(target))
+        deferred_courses = dict.fromkeys(entry["course"] for entry in retries.deferred)
+        retries.retry_deferred()
+        for target in deferred_courses:
+            emit("course_end", target, value=retries.course_status(target))
+
+
+def start_browser_pool(size, login):
+    """Starts and logs in `size` recycling browsers and returns them in a checkout queue."""
+    pool = queue.Queue()
+    for index in range(size):
+        driver = open_browser(login)
+        if driver is None:
+            logging.error(f"Browser {index + 1} failed to log in.")
+            print(f"Browser {index + 1} failed to log in.")
+            continue
+        pool.put(driver)
+        logging.info(f"Browser {index + 1} of {size} is warm.")
+        print(f"Browser {index + 1} of {size} is warm.")
+    return pool
+
+
+def checked_browser(driver, login):
+    """Returns the browser if it still works (restarting a dead Chrome), or a new one in its place."""
+    try:
+        driver.revive()
+        return driver
+    except Exception as e:
+        logging.error(f"Browser could not be restarted - Error: {e}. Starting a new one.")
+        try:
+            driver.quit()
+        except Exception:
+            pass
+        return open_browser(login)
+
+
+def read_new_jobs(queue_file, offset):
+    """Returns jobs appended to the queue file since `offset` and the new offset."""
+    jobs = []
+    try:
+        with open(queue_file, 'r', encoding='utf-8') as file:
+            file.seek(offset)
+            while True:
+                line = file.readline()
+                # A line without its newline is still being written
+                if not line or not line.endswith("\n"):
+                    break
+                offset = file.tell()
+                if not line.strip():
+                    continue
+                try:
+                    jobs.append(json.loads(line))
+                except json.JSONDecodeError as e:
+                    logging.error(f"Skipping malformed job line: {line.strip()} - {e}")
+    except FileNotFoundError:
+        pass
+    return jobs, offset
+
+
+def read_finished_job_ids(results_file):
+    """Returns the ids of jobs that already have a result line."""
+    finished = set()
+    try:
+        with open(results_file, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    finished.add(json.loads(line)["job_id"])
+                except (json.JSONDecodeError, KeyError):
+                    continue
+    except FileNotFoundError:
+        pass
+    return finished
+
+
+def write_result(results_file, result):
+    with _RESULTS_LOCK:
+        with open(results_file, 'a', encoding='utf-8') as file:
+            file.write(json.dumps(result) + "\n")
+
+
+def run_job(pool, job, results_file, login):
+    """Runs one job on a browser checked out from the pool and records the result."""
+    operation = job.get("operation")
+    result = {"job_id": job["job_id"], "operation": operation}
+    if operation not in TASK_MODULES:
+        result.update(status="failed", error=f"Unknown operation '{operation}'")
+        write_result(results_file, result)
+        return
+
+    driver = pool.get()
+    start_time = time.time()
+    try:
+        logging.info(f"Starting job {job['job_id']} ({operation})")
+        print(f"Starting job {job['job_id']} ({operation})")
+        retries = RetryQueue(driver, relogin=lambda: login(driver))
+        run_operation(driver, operation, job.get("params", {}), retries,
+                      worker=threading.current_thread().name)
+        if retries.failed:
+            result["status"] = "failed"
+            result["failed_steps"] = [
+                {"course": entry["course"], "step": entry["step"],
+                 "failure": entry["failure"], "error": entry["error"]}
+                for entry in retries.failed]
+        else:
+            result["status"] = "done"
+    except Exception as e:
+        logging.error(f"Job {job['job_id']} ({operation}) failed - Error: {e}")
+        result.update(status="failed", error=str(e))
+    finally:
+        # A browser that crashed mid-job must not fail every job after it
+        driver = checked_browser(driver, login)
+        if driver is not None:
+            pool.put(driver)
+        else:
+            logging.error("A replacement browser could not log in; the pool is one browser smaller.")
+    result["duration"] = round(time.time() - start_time, 2)
+    write_result(results_file, result)
+    print(f"Finished job {job['job_id']} ({operation}): {result['status']} "
+          f"(Time taken: {result['duration']:.2f} seconds)")
+
+
+def serve(pool, size, queue_file, results_file, login):
+    """Watches the queue file and runs new jobs until interrupted."""
+    finished = read_finished_job_ids(results_file)
+    offset = 0
+    line_number = 0
+    with ThreadPoolExecutor(max_workers=size, thread_name_prefix="browser") as executor:
+        while True:
+            jobs, offset = read_new_jobs(queue_file, offset)
+            for job in jobs:
+                line_number += 1
+                job.setdefault("job_id", f"line-{line_number}")
+                if job["job_id"] in finished:
+                    continue
+                finished.add(job["job_id"])
+                executor.submit(run_job, pool, job, results_file, login)
+            time.sleep(POLL_INTERVAL)
+
+
+def main():
+    setup_logging("daemon_log.txt")
+    parser = argparse.ArgumentParser(
+        description="Keep logged-in browsers warm and run jobs from a JSONL queue.")
+    parser.add_argument("--browsers", type=int, default=2,
+                        help="number of logged-in browsers to keep open")
+    parser.add_argument("--queue", default=QUEUE_FILE_PATH,
+                        help="JSONL file to watch for jobs")
+    parser.add_argument("--results", default=RESULTS_FILE_PATH,
+                        help="JSONL file job results are appended to")
+    parser.add_argument("--dashboard", action="store_true",
+                        help="show live progress of the courses in the jobs run so far")
+    args = parser.parse_args()
+
+    login = login_function("auto")
+    if login is None:
+        print("Missing credentials. Exiting daemon.")
+        return
+
+    os.makedirs(os.path.dirname(args.results) or ".", exist_ok=True)
+    pool = start_browser_pool(args.browsers, login)
+    size = pool.qsize()
+    if not size:
+        print("No browser could log in. Exiting daemon.")
+        return
+
+    print(f"Watching {args.queue} with {size} browser(s). Press Ctrl+C to stop.")
+    if args.dashboard:
+        # Jobs add their courses to the total as they start
+        Dashboard([]).start()
+    try:
+        serve(pool, size, args.queue, args.results, login)
+    except KeyboardInterrupt:
+        print("Stopping daemon.")
+    finally:
+        stop_dashboard()
+        while not pool.empty():
+            pool.get().quit()
+        logging.info("Browsers closed. Daemon stopped.")
+
+
+if __name__ == "__main__":
+    main()
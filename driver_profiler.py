@@ -0,0 +1,103 @@
+import atexit
+import logging
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+
+# Set MOODLE_PROFILE=1 to count every WebDriver command and report where they come from.
+PROFILE_ENV_VAR = "MOODLE_PROFILE"
+PROFILE_OUTPUT_PATH = os.path.join("logs", "webdriver_profile.folded")
+TOP_N = 15
+
+REPO_PATH = os.path.dirname(os.path.abspath(__file__))
+
+_lock = threading.Lock()
+_by_function = defaultdict(lambda: [0, 0.0])   # function -> [commands, seconds]
+_by_command = defaultdict(lambda: [0, 0.0])    # (function, command) -> [commands, seconds]
+_by_stack = defaultdict(lambda: [0, 0.0])      # folded stack -> [commands, seconds]
+_report_registered = False
+
+
+def _caller_stack():
+    """Returns the names of the repo functions on the stack, outermost first."""
+    names = []
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if filename.startswith(REPO_PATH) and filename != os.path.abspath(__file__):
+            module = os.path.splitext(os.path.basename(filename))[0]
+            names.append(f"{module}.{frame.f_code.co_name}")
+        frame = frame.f_back
+    names.reverse()
+    return names
+
+
+def _record(command, seconds):
+    stack = _caller_stack()
+    function = stack[-1] if stack else "<unknown>"
+    folded = ";".join(stack + [command])
+    with _lock:
+        for table, key in ((_by_function, function), (_by_command, (function, command)),
+                           (_by_stack, folded)):
+            table[key][0] += 1
+            table[key][1] += seconds
+
+
+def profile_driver(driver):
+    """Wraps the driver's command executor so every WebDriver round trip is timed."""
+    global _report_registered
+    executor = driver.command_executor
+    original_execute = executor.execute
+
+    def timed_execute(command, params):
+        start_time = time.perf_counter()
+        try:
+            return original_execute(command, params)
+        finally:
+            _record(command, time.perf_counter() - start_time)
+
+    executor.execute = timed_execute
+    if not _report_registered:
+        atexit.register(report)
+        _report_registered = True
+    logging.info("WebDriver command profiling enabled.")
+    return driver
+
+
+def maybe_profile(driver):
+    """Turns on profiling if the MOODLE_PROFILE environment variable is set."""
+    if os.environ.get(PROFILE_ENV_VAR):
+        profile_driver(driver)
+    return driver
+
+
+def report(top_n=TOP_N, output_path=PROFILE_OUTPUT_PATH):
+    """Prints the top functions by WebDriver time and writes folded stacks for flamegraph.pl."""
+    with _lock:
+        by_function = sorted(_by_function.items(), key=lambda item: -item[1][1])
+        by_command = dict(_by_command)
+        by_stack = dict(_by_stack)
+    if not by_function:
+        return
+
+    total_commands = sum(count for count, _ in dict(by_function).values())
+    total_seconds = sum(seconds for _, seconds in dict(by_function).values())
+    lines = [f"WebDriver commands: {total_commands} in {total_seconds:.2f} seconds",
+             f"{'Function':<50} {'Calls':>7} {'Seconds':>9} {'Avg ms':>8}  Top commands"]
+    for function, (count, seconds) in by_function[:top_n]:
+        commands = sorted(((c, v) for (f, c), v in by_command.items() if f == function),
+                          key=lambda item: -item[1][1])[:3]
+        detail = ", ".join(f"{c} x{v[0]}" for c, v in commands)
+        lines.append(f"{function:<50} {count:>7} {seconds:>9.2f} {seconds / count * 1000:>8.1f}  {detail}")
+    text = "\n".join(lines)
+    print(text)
+    logging.info(f"WebDriver profile:\n{text}")
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as file:
+        for stack, (_, seconds) in sorted(by_stack.items()):
+            # flamegraph.pl expects integer sample counts; use milliseconds
+            file.write(f"{stack} {max(1, round(seconds * 1000))}\n")
+    print(f"Folded stacks written to {output_path} (render with flamegraph.pl).")
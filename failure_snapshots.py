@@ -0,0 +1,88 @@
+import collections
+import gzip
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+# The last RING_SIZE steps are kept in memory. Nothing is written unless a step fails.
+RING_SIZE = 20
+MAX_SNAPSHOTS = 50
+SNAPSHOTS_PATH = os.path.join("logs", "snapshots")
+RUN_ID = time.strftime("%Y%m%d-%H%M%S")
+
+_ring = collections.deque(maxlen=RING_SIZE)
+_lock = threading.Lock()
+_snapshot_count = 0
+
+
+def record_step(course_url, step_name, started, seconds, outcome):
+    """Adds a finished step to the ring. Costs one tuple append; no browser calls."""
+    _ring.append((started, course_url, step_name, seconds, outcome))
+
+
+def recent_steps():
+    return [{"started": time.strftime("%H:%M:%S", time.localtime(started)), "course": course,
+             "step": step, "seconds": round(seconds, 3), "outcome": outcome}
+            for started, course, step, seconds, outcome in list(_ring)]
+
+
+def _safe(name):
+    return re.sub(r"[^\w.-]+", "_", name)[:60]
+
+
+def _capture(folder, name, capture):
+    try:
+        capture(os.path.join(folder, name))
+    except Exception as e:
+        logging.warning(f"Snapshot could not capture {name} - Error: {e}")
+
+
+def dump_failure(driver, course_url, step_name, error):
+    """Writes a screenshot, the gzipped DOM, browser logs and the recent steps for a failed step.
+
+    Returns the snapshot folder, or None if there is no browser or the run's limit was reached.
+    """
+    global _snapshot_count
+    if driver is None:
+        return None
+    with _lock:
+        if _snapshot_count >= MAX_SNAPSHOTS:
+            return None
+        _snapshot_count += 1
+        number = _snapshot_count
+    folder = os.path.join(SNAPSHOTS_PATH, RUN_ID, f"{number:03d}-{_safe(step_name)}")
+    os.makedirs(folder, exist_ok=True)
+
+    def write_dom(path):
+        with gzip.open(path, 'wt', encoding='utf-8') as file:
+            file.write(driver.page_source)
+
+    def write_console(path):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(driver.get_log("browser"), file, indent=2)
+
+    def write_network(path):
+        # Resource timings of the current page; no capture has to be running beforehand
+        entries = driver.execute_script(
+            "return performance.getEntriesByType('navigation').concat("
+            "performance.getEntriesByType('resource')).map(e => e.toJSON());")
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(entries, file, indent=2)
+
+    _capture(folder, "screenshot.png", driver.save_screenshot)
+    _capture(folder, "dom.html.gz", write_dom)
+    _capture(folder, "console.json", write_console)
+    _capture(folder, "network.json", write_network)
+    try:
+        page_url = driver.current_url
+    except Exception:
+        page_url = None
+    with open(os.path.join(folder, "context.json"), 'w', encoding='utf-8') as file:
+        json.dump({"course": course_url, "step": step_name, "error": repr(error),
+                   "page_url": page_url, "recent_steps": recent_steps()}, file, indent=2)
+    logging.info(f"Failure snapshot for '{step_name}' saved to {folder}")
+    print(f"Failure snapshot saved to {folder}")
+    return folder
@@ -1,81 +1,34 @@
 import logging
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 import time
-import os
-
-# Set up logging in the logs/ folder
-LOGS_PATH = os.path.join(os.getcwd(), 'logs')
-os.makedirs(LOGS_PATH, exist_ok=True)
-logging.basicConfig(filename=os.path.join(LOGS_PATH, "delete_gradebook_log.txt"), level=logging.INFO,
-                    format='%(asctime)s - %(message)s')
-
-CHROMEDRIVER_PATH = os.path.join(os.getcwd(), 'chromedriver.exe')
-
-# Function to read file lines
-
-
-def read_lines(file_path):
-    try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            return [line.strip() for line in file.readlines()]
-    except FileNotFoundError:
-        logging.error(f"File '{file_path}' not found.")
-        return []
-
-# Function to scroll and click using JavaScript
-
-
-def js_click(driver, element):
-    driver.execute_script("arguments[0].scrollIntoView(true);", element)
-    time.sleep(1)
-    driver.execute_script("arguments[0].click();", element)
+from course_catalog import gradebook_setup_url, resolve_targets
+from moodle_automation import AdaptiveWait, Task, js_click, open_page, read_lines, register_task, run_task
+from moodle_http import course_id_from_url
+from retry_queue import run_step
 
 # Function to navigate to 'Gradebook setup'
 
 
 def navigate_to_gradebook_setup(driver, course_url):
     try:
-        driver.get(course_url)
-        time.sleep(3)
+        # Load 'Gradebook setup' directly instead of clicking through the Grades menus
+        open_page(driver, gradebook_setup_url(course_id_from_url(course_url)), settle=0)
 
-        # Click on 'Grades' button
-        grades_button = WebDriverWait(driver, 10).until(
-            EC.element_to_be_clickable(
-                (By.XPATH, "//a[contains(@href, 'grade/report/index.php')]"))
-        )
-        grades_button.click()
-        logging.info(f"Clicked 'Grades' button for course: {course_url}")
-        print(f"Clicked 'Grades' button for course: {course_url}")
-
-        # Click on 'Grader report' dropdown
-        grader_report_dropdown = WebDriverWait(driver, 10).until(
-            EC.element_to_be_clickable(
-                (By.CSS_SELECTOR, "div[role='combobox']"))
-        )
-        grader_report_dropdown.click()
-        logging.info(
-            f"Clicked 'Grader Report' dropdown for course: {course_url}")
-        print(f"Clicked 'Grader Report' dropdown for course: {course_url}")
-
-        # Select 'Gradebook setup' from the dropdown
-        gradebook_setup_option = WebDriverWait(driver, 10).until(
-            EC.element_to_be_clickable(
-                (By.XPATH, "//li[contains(@data-value, 'grade/edit/tree/index.php')]"))
+        AdaptiveWait(driver, 10, key="grade_book_reset.setup_table").until(
+            EC.presence_of_element_located(
+                (By.XPATH, "//table[@id='grade_edit_tree_table']"))
         )
-        js_click(driver, gradebook_setup_option)
-        logging.info(f"Clicked 'Gradebook setup' for course: {course_url}")
-        print(f"Clicked 'Gradebook setup' for course: {course_url}")
+        logging.info(f"Opened 'Gradebook setup' for course: {course_url}")
+        print(f"Opened 'Gradebook setup' for course: {course_url}")
 
     except Exception as e:
         logging.error(
             f"Failed to navigate to Gradebook Setup for course: {course_url} - Error: {e}")
         print(
             f"Failed to navigate to Gradebook Setup for course: {course_url} - Error: {e}")
-        return False
+        raise
     return True
 
 # Function to delete items or categories
@@ -85,7 +38,7 @@ def delete_item_or_category(driver):
     try:
         while True:
             # Fetch all action buttons
-            action_buttons = WebDriverWait(driver, 10).until(
+            action_buttons = AdaptiveWait(driver, 10, key="grade_book_reset.action_menus").until(
                 EC.presence_of_all_elements_located(
                     (By.CSS_SELECTOR, "button.btn-icon.cellmenubtn"))
             )
@@ -95,7 +48,7 @@ def delete_item_or_category(driver):
                 for button_index in range(1, len(action_buttons) - 1):
                     try:
                         # Re-fetch action buttons after each deletion
-                        action_buttons = WebDriverWait(driver, 10).until(
+                        action_buttons = AdaptiveWait(driver, 10, key="grade_book_reset.action_menus").until(
                             EC.presence_of_all_elements_located(
                                 (By.CSS_SELECTOR, "button.btn-icon.cellmenubtn"))
                         )
@@ -106,7 +59,7 @@ def delete_item_or_category(driver):
                         time.sleep(1)
 
                         # Look for any delete button in the dropdown and click it
-                        delete_option = WebDriverWait(driver, 10).until(
+                        delete_option = AdaptiveWait(driver, 10, key="grade_book_reset.delete_option").until(
                             EC.element_to_be_clickable(
                                 (By.XPATH, "//a[contains(@data-modal, 'confirmation') and contains(text(), 'Delete')]"))
                         )
@@ -117,7 +70,7 @@ def delete_item_or_category(driver):
                         time.sleep(1)
 
                         # Confirm deletion in the dialog
-                        confirm_button = WebDriverWait(driver, 10).until(
+                        confirm_button = AdaptiveWait(driver, 10, key="grade_book_reset.confirm").until(
                             EC.element_to_be_clickable(
                                 (By.XPATH, "//button[@data-action='save']"))
                         )
@@ -160,54 +113,55 @@ def delete_item_or_category(driver):
     except Exception as e:
         logging.error(f"Failed to retrieve action buttons - Error: {e}")
         print(f"Failed to retrieve action buttons - Error: {e}")
+        raise
+
+# Function to delete every item and category in one course
 
-# Function to check if user is logged in by detecting any greeting like 'Hi,'
 
+def reset_gradebook(driver, course_url, retries=None):
+    def reopen():
+        navigate_to_gradebook_setup(driver, course_url)
 
-def wait_for_login(driver):
     try:
-        # Wait for the 'Hi,' greeting which is common for all users
-        WebDriverWait(driver, 300).until(
-            EC.presence_of_element_located(
-                (By.XPATH, "//h2[contains(text(), 'Hi,')]"))
-        )
-        print("Login successful.")
-        logging.info("User logged in successfully.")
-        return True
+        navigate_to_gradebook_setup(driver, course_url)
     except Exception as e:
-        logging.error(
-            f"Login not detected within the timeout period - Error: {e}")
-        print(f"Login not detected - Error: {e}")
+        if retries is None:
+            raise
+        retries.defer(course_url, "delete items and categories",
+                      delete_item_or_category, (driver,), reopen, e)
         return False
+    print(f"Deleting items and categories for course: {course_url}")
+    run_step(retries, course_url, "delete items and categories",
+             delete_item_or_category, driver, prepare=reopen)
+    return True
 
-# Main execution
+def reset_gradebook_http(client):
+    """Deletes every item and category of one course over HTTP (--http)."""
+    deleted = client.delete_all()
+    logging.info(f"Deleted {deleted} items and categories in course {client.course_id}")
+    print(f"Deleted {deleted} items and categories in course {client.course_id}")
 
+# Task definition for the shared runner
 
-def main():
-    course_links_file = "grade_book/links.txt"
-    COURSE_LINKS = read_lines(course_links_file)
 
-    service = Service(executable_path=CHROMEDRIVER_PATH)
-    driver = webdriver.Chrome(service=service)
-    driver.maximize_window()
+@register_task
+class GradebookResetTask(Task):
+    name = "gradebook_reset"
+    description = "Delete all Moodle gradebook items and categories."
+    log_file = "delete_gradebook_log.txt"
+    login = "detect"
+    shard_function = "reset_gradebook"
+    http_function = "reset_gradebook_http"
 
-    # Open Moodle login page and wait for successful login detection
-    driver.get("https://moodle.nu.edu.eg/")
-    print("Waiting for login...")
-    if not wait_for_login(driver):
-        print("Login failed or not detected. Exiting...")
-        return
+    def load_inputs(self, args):
+        return {"targets": resolve_targets(read_lines("grade_book/links.txt"), self.target_kind)}
 
-    # Loop through each course link and navigate to the gradebook setup
-    for course_url in COURSE_LINKS:
-        if navigate_to_gradebook_setup(driver, course_url):
-            print(f"Deleting items and categories for course: {course_url}")
-            delete_item_or_category(driver)
+    def page_url(self, course_url):
+        return gradebook_setup_url(course_id_from_url(course_url))
 
-    driver.quit()
-    logging.info("Browser closed. Script completed.")
-    print("Browser closed. Script completed.")
+    def run_course(self, driver, course_url, inputs, retries):
+        reset_gradebook(driver, course_url, retries)
 
 
 if __name__ == "__main__":
-    main()
+    run_task(GradebookResetTask())
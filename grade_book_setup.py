@@ -1,46 +1,11 @@
 import logging
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 import time
-import os
-import json
-
-LOGS_PATH = os.path.join(os.getcwd(), 'logs')
-os.makedirs(LOGS_PATH, exist_ok=True)
-logging.basicConfig(filename=os.path.join(LOGS_PATH, "grade_book_setup_log.txt"), level=logging.INFO,
-                    format='%(asctime)s - %(message)s')
-
-CHROMEDRIVER_PATH = os.path.join(os.getcwd(), 'chromedriver.exe')
-
-
-def read_lines(file_path):
-    try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            return [line.strip() for line in file.readlines()]
-    except FileNotFoundError:
-        logging.error(f"File '{file_path}' not found.")
-        return []
-
-
-def read_json(file_path):
-    try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            return json.load(file)
-    except FileNotFoundError:
-        logging.error(f"File '{file_path}' not found.")
-        return {}
-    except json.JSONDecodeError as e:
-        logging.error(f"Error parsing JSON file '{file_path}' - {e}")
-        return {}
-
-
-def js_click(driver, element):
-    driver.execute_script("arguments[0].scrollIntoView(true);", element)
-    time.sleep(1)
-    driver.execute_script("arguments[0].click();", element)
+from course_catalog import resolve_targets
+from moodle_automation import AdaptiveWait, Task, js_click, open_page, read_json, read_lines, register_task, run_task
+from retry_queue import run_step
 
 
 def handle_recalculation_page(driver):
@@ -51,13 +16,13 @@ def handle_recalculation_page(driver):
                 (By.TAG_NAME, "body"), recalculation_text)
         )
         print("Detected recalculation page. Waiting for recalculation to complete.")
-        continue_button = WebDriverWait(driver, 20).until(
+        continue_button = AdaptiveWait(driver, 20, key="grade_book_setup.recalculate_continue").until(
             EC.element_to_be_clickable(
                 (By.XPATH, "//button[contains(text(), 'Continue')]"))
         )
         js_click(driver, continue_button)
         print("Clicked 'Continue' on recalculation page.")
-        WebDriverWait(driver, 20).until(
+        AdaptiveWait(driver, 20, key="grade_book_setup.recalculated").until(
             EC.url_contains('grade/edit/tree/index.php')
         )
         print("Recalculation completed and returned to grade setup.")
@@ -77,14 +42,15 @@ def category_exists(driver, category_name):
         return False
 
 
+def setup_page_url(course_url):
+    return course_url.replace("course/view.php", "grade/edit/tree/index.php")
+
+
 def navigate_to_gradebook_setup(driver, course_url):
     try:
-        gradebook_setup_url = course_url.replace(
-            "course/view.php", "grade/edit/tree/index.php")
-        driver.get(gradebook_setup_url)
-        time.sleep(3)
+        open_page(driver, setup_page_url(course_url))
 
-        WebDriverWait(driver, 10).until(
+        AdaptiveWait(driver, 10, key="grade_book_setup.setup_table").until(
             EC.presence_of_element_located(
                 (By.XPATH, "//table[@id='grade_edit_tree_table']"))
         )
@@ -98,19 +64,19 @@ def navigate_to_gradebook_setup(driver, course_url):
             f"Failed to navigate to Gradebook Setup for course: {course_url} - Error: {e}")
         print(
             f"Failed to navigate to Gradebook Setup for course: {course_url} - Error: {e}")
-        return False
+        raise
 
 
 def create_category(driver, category_name, weight, course_url):
     try:
         print(f"Creating category: {category_name} with weight: {weight}")
-        add_menu_button = WebDriverWait(driver, 10).until(
+        add_menu_button = AdaptiveWait(driver, 10, key="grade_book_setup.add_menu").until(
             EC.element_to_be_clickable(
                 (By.XPATH, "//a[contains(@id, 'action-menu-toggle')]"))
         )
         js_click(driver, add_menu_button)
 
-        add_category_button = WebDriverWait(driver, 10).until(
+        add_category_button = AdaptiveWait(driver, 10, key="grade_book_setup.add_category").until(
             EC.element_to_be_clickable(
                 (By.XPATH, "//a[contains(@data-trigger, 'add-category-form')]"))
         )
@@ -118,7 +84,7 @@ def create_category(driver, category_name, weight, course_url):
 
         time.sleep(3)
 
-        category_name_input = WebDriverWait(driver, 10).until(
+        category_name_input = AdaptiveWait(driver, 10, key="grade_book_setup.category_name").until(
             EC.presence_of_element_located(
                 (By.XPATH, "//input[@name='fullname']"))
         )
@@ -129,7 +95,7 @@ def create_category(driver, category_name, weight, course_url):
         weight_input.clear()
         weight_input.send_keys(str(weight))
 
-        save_button = WebDriverWait(driver, 10).until(
+        save_button = AdaptiveWait(driver, 10, key="grade_book_setup.save_category").until(
             EC.element_to_be_clickable(
                 (By.XPATH, "//button[@data-action='save']"))
         )
@@ -146,19 +112,20 @@ def create_category(driver, category_name, weight, course_url):
             f"Failed to create category '{category_name}' for course: {course_url} - Error: {e}")
         print(
             f"Failed to create category '{category_name}' for course: {course_url} - Error: {e}")
+        raise
 
 
 def create_grade_item(driver, item_name, item_grade, category_name, course_url):
     try:
         print(
             f"Creating grade item: {item_name} with grade: {item_grade} in category: {category_name or 'None'}")
-        add_menu_button = WebDriverWait(driver, 10).until(
+        add_menu_button = AdaptiveWait(driver, 10, key="grade_book_setup.add_menu").until(
             EC.element_to_be_clickable(
                 (By.XPATH, "//a[contains(@id, 'action-menu-toggle')]"))
         )
         js_click(driver, add_menu_button)
 
-        add_grade_item_button = WebDriverWait(driver, 10).until(
+        add_grade_item_button = AdaptiveWait(driver, 10, key="grade_book_setup.add_item").until(
             EC.element_to_be_clickable(
                 (By.XPATH, "//a[contains(@data-trigger, 'add-item-form')]"))
         )
@@ -166,7 +133,7 @@ def create_grade_item(driver, item_name, item_grade, category_name, course_url):
 
         time.sleep(3)
 
-        item_name_input = WebDriverWait(driver, 10).until(
+        item_name_input = AdaptiveWait(driver, 10, key="grade_book_setup.item_name").until(
             EC.presence_of_element_located(
                 (By.XPATH, "//input[@name='itemname']"))
         )
@@ -178,13 +145,13 @@ def create_grade_item(driver, item_name, item_grade, category_name, course_url):
         grade_input.send_keys(str(item_grade))
 
         if category_name:
-            category_dropdown = WebDriverWait(driver, 10).until(
+            category_dropdown = AdaptiveWait(driver, 10, key="grade_book_setup.parent_category").until(
                 EC.presence_of_element_located(
                     (By.XPATH, "//select[@name='parentcategory']"))
             )
             category_dropdown.send_keys(category_name)
 
-        save_button = WebDriverWait(driver, 10).until(
+        save_button = AdaptiveWait(driver, 10, key="grade_book_setup.save_item").until(
             EC.element_to_be_clickable(
                 (By.XPATH, "//button[@data-action='save']"))
         )
@@ -202,140 +169,119 @@ def create_grade_item(driver, item_name, item_grade, category_name, course_url):
             f"Failed to create grade item '{item_name}' for course: {course_url} - Error: {e}")
         print(
             f"Failed to create grade item '{item_name}' for course: {course_url} - Error: {e}")
+        raise
 
 
-def auto_login(driver, email, password):
-    try:
-        # Step 1: Go to the Moodle login page
-        driver.get("https://moodle.nu.edu.eg/")
-        time.sleep(3)
+def grade_item_exists(driver, item_name):
+    """Checks the gradebook tree for a category or item with this name."""
+    return len(driver.find_elements(
+        By.XPATH, f"//span[@title='{item_name}']")) > 0
 
-        # Step 2: Enter email for SSO login
-        try:
-            email_input = WebDriverWait(driver, 10).until(
-                EC.presence_of_element_located((By.ID, "i0116"))
-            )
-            email_input.clear()  # Ensure the field is empty before typing
-            email_input.send_keys(email)
-            next_button = driver.find_element(By.ID, "idSIButton9")
-            js_click(driver, next_button)
-            logging.info("Entered email and clicked next for SSO.")
-        except Exception as e:
-            logging.error(f"Failed to enter email - Error: {e}")
-            print(f"Failed to enter email - Error: {e}")
-            return False
-
-        # Step 3: Wait for password field and enter the password
-        try:
-            # Adding retries in case of a stale element reference
-            retries = 3
-            for attempt in range(retries):
-                try:
-                    password_input = WebDriverWait(driver, 10).until(
-                        EC.presence_of_element_located((By.ID, "i0118"))
-                    )
-                    password_input.clear()  # Ensure the field is empty
-                    password_input.send_keys(password)
-                    sign_in_button = driver.find_element(By.ID, "idSIButton9")
-                    js_click(driver, sign_in_button)
-                    logging.info(
-                        "Entered password and clicked sign in for SSO.")
-                    break  # Break out of retry loop if successful
-                except Exception as e:
-                    if attempt < retries - 1:
-                        logging.warning(
-                            f"Retry {attempt + 1} for password entry due to error: {e}")
-                        print(
-                            f"Retry {attempt + 1} for password entry due to error: {e}")
-                        time.sleep(2)  # Brief wait before retrying
-                    else:
-                        raise e  # Reraise the last exception if all retries fail
-        except Exception as e:
-            logging.error(f"Failed to enter password - Error: {e}")
-            print(f"Failed to enter password - Error: {e}")
-            return False
-
-        # Step 4: Handle "Stay signed in?" prompt
-        try:
-            stay_signed_in_button = WebDriverWait(driver, 10).until(
-                EC.element_to_be_clickable((By.ID, "idSIButton9"))
-            )
-            js_click(driver, stay_signed_in_button)
-            logging.info("Clicked 'Yes' for staying signed in.")
-        except Exception as e:
-            logging.error(f"Failed to click 'Stay signed in' - Error: {e}")
-            print(f"Failed to click 'Stay signed in' - Error: {e}")
-            return False
-
-        # Step 5: Wait for Moodle homepage to confirm successful login
-        try:
-            WebDriverWait(driver, 20).until(
-                EC.presence_of_element_located(
-                    (By.XPATH, "//h2[contains(text(), 'Hi,')]"))
-            )
-            logging.info("Login successful.")
-            print("Login successful.")
-            return True
-        except Exception as e:
-            logging.error(f"Failed to confirm login - Error: {e}")
-            print(f"Failed to confirm login - Error: {e}")
-            return False
 
-    except Exception as e:
-        logging.error(f"Login process failed - Error: {e}")
-        print(f"Login process failed - Error: {e}")
-        return False
+def create_category_with_items(driver, category, details, course_url):
+    """Creates a category and its grade items, skipping any that already exist."""
+    if not grade_item_exists(driver, category):
+        create_category(driver, category, details['weight'], course_url)
+    for item_name, item_grade in details.items():
+        if item_name != 'weight' and not grade_item_exists(driver, item_name):
+            create_grade_item(
+                driver, item_name, item_grade, category, course_url)
+
 
+def create_top_level_item(driver, item_name, item_grade, course_url):
+    if not grade_item_exists(driver, item_name):
+        create_grade_item(driver, item_name, item_grade, None, course_url)
 
-def main():
-    course_links_file = "grade_book/links.txt"
-    gradebook_json_file = "grade_book/gradebook.json"
-    creds_file = "creds.txt"
 
-    COURSE_LINKS = read_lines(course_links_file)
-    GRADEBOOK_STRUCTURE = read_json(gradebook_json_file)
+def setup_gradebook(driver, course_url, structure, retries=None):
+    """Creates every category and grade item from the structure in one course.
+
+    Each category (with its items) and each top-level item is one step of the
+    retry queue; steps skip what already exists, so retrying them is safe.
+    """
+    steps = []
+    for category, details in structure.items():
+        if isinstance(details, dict):
+            steps.append((f"category {category}", create_category_with_items,
+                          (driver, category, details, course_url)))
+        else:
+            steps.append((f"item {category}", create_top_level_item,
+                          (driver, category, details, course_url)))
+
+    def reopen():
+        navigate_to_gradebook_setup(driver, course_url)
 
-    # Read credentials from creds.txt
     try:
-        with open(creds_file, 'r', encoding='utf-8') as file:
-            creds = {line.split(":")[0]: line.split(
-                ":")[1].strip() for line in file}
-            email = creds.get("email")
-            password = creds.get("password")
-    except FileNotFoundError:
-        logging.error(f"File '{creds_file}' not found.")
-        print("Credentials file not found.")
-        return
+        navigate_to_gradebook_setup(driver, course_url)
+    except Exception as e:
+        if retries is None:
+            raise
+        for step_name, func, args in steps:
+            retries.defer(course_url, step_name, func, args, reopen, e)
+        return False
 
-    service = Service(executable_path=CHROMEDRIVER_PATH)
-    driver = webdriver.Chrome(service=service)
-    driver.maximize_window()
+    for step_name, func, args in steps:
+        run_step(retries, course_url, step_name, func, *args, prepare=reopen)
+    return True
 
-    # Automatic login
-    print("Attempting automatic login...")
-    if not auto_login(driver, email, password):
-        print("Automatic login failed. Exiting...")
-        driver.quit()
-        return
 
-    for course_url in COURSE_LINKS:
-        if navigate_to_gradebook_setup(driver, course_url):
-            for category, details in GRADEBOOK_STRUCTURE.items():
-                if isinstance(details, dict):
-                    create_category(driver, category,
-                                    details['weight'], course_url)
-                    for item_name, item_grade in details.items():
-                        if item_name != 'weight':
-                            create_grade_item(
-                                driver, item_name, item_grade, category, course_url)
-                else:
-                    create_grade_item(driver, category,
-                                      details, None, course_url)
-
-    driver.quit()
-    logging.info("Browser closed. Script completed.")
-    print("Browser closed. Script completed.")
+def create_items_http(client, items, category=None):
+    """Creates (name, grade) items in one category together, sharing web service requests."""
+    if not items:
+        return
+    client.add_items(items, category)
+    for item_name, _ in items:
+        logging.info(f"Created grade item '{item_name}' in course {client.course_id}")
+
+
+def setup_gradebook_http(client, structure):
+    """Creates the missing categories and grade items of one course over HTTP (--http).
+
+    A category's new items are created together, and so is each run of new
+    top-level items, so the gradebook keeps the structure's order.
+    """
+    existing = client.names()
+    top_level = []
+    for category, details in structure.items():
+        if not isinstance(details, dict):
+            if category not in existing:
+                top_level.append((category, details))
+            continue
+        create_items_http(client, top_level)
+        top_level = []
+        if category not in existing:
+            client.add_category(category, details['weight'])
+            logging.info(f"Created category '{category}' in course {client.course_id}")
+        create_items_http(client, [(item_name, item_grade) for item_name, item_grade in details.items()
+                                   if item_name != 'weight' and item_name not in existing], category)
+    create_items_http(client, top_level)
+    print(f"Gradebook set up over HTTP for course {client.course_id}")
+
+
+@register_task
+class GradebookSetupTask(Task):
+    name = "gradebook_setup"
+    description = "Set up Moodle gradebooks."
+    log_file = "grade_book_setup_log.txt"
+    shard_function = "setup_gradebook"
+    http_function = "setup_gradebook_http"
+
+    def load_inputs(self, args):
+        structure = read_json("grade_book/gradebook.json")
+        if not structure:
+            return None
+        return {"targets": resolve_targets(read_lines("grade_book/links.txt"), self.target_kind),
+                "structure": structure}
+
+    def page_url(self, course_url):
+        return setup_page_url(course_url)
+
+    def run_course(self, driver, course_url, inputs, retries):
+        setup_gradebook(driver, course_url, inputs["structure"], retries)
+
+    def shard_args(self, inputs):
+        return (inputs["structure"],)
 
 
 if __name__ == "__main__":
-    main()
+    run_task(GradebookSetupTask())
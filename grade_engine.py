@@ -0,0 +1,297 @@
+import argparse
+import csv
+import glob
+import logging
+import os
+import re
+import time
+import numpy as np
+from moodle_automation import read_json, setup_logging
+
+GRADEBOOK_PATH = os.path.join("grade_book", "gradebook.json")
+MODIFY_PATH = os.path.join("grade_book", "modify.json")
+EXPORTS_PATH = os.path.join("grade_book", "exports")
+TOTALS_PATH = os.path.join("logs", "grade_totals.csv")
+AGGREGATIONS = ("natural", "mean", "simple_weighted_mean")
+# Moodle rounds exported grades to 2 decimals
+CHECK_TOLERANCE = 0.01
+
+# Export headers look like "Tutorial2 (Real)", "Quiz: quiz1 (Real)" or "Tutorials total (Real)"
+HEADER_PATTERN = re.compile(r"^(?:[^:]+: )?(.*?) \((?:Real|Percentage|Letter)\)$")
+
+
+class Gradebook:
+    """gradebook.json compiled into arrays for the vectorized aggregation.
+
+    Items are numbered in file order. `membership` is an items x categories
+    0/1 matrix, so one matrix product sums every student's grades in every
+    category at once. Top-level entries (categories and items such as
+    Midterm) are the children of the course total.
+    """
+
+    def __init__(self, structure, renames=None, aggregation="simple_weighted_mean",
+                 course_aggregation="natural", extra_credit=()):
+        renames = renames or {}
+        self.aggregation = aggregation
+        self.course_aggregation = course_aggregation
+        self.items = []
+        self.item_max = []
+        self.item_category = []
+        self.categories = []
+        self.category_max = []
+        self.top_level = []  # ('category', k) or ('item', i), in file order
+        self.aliases = {}    # Name as Moodle shows it -> item index
+        for name, details in structure.items():
+            if isinstance(details, dict):
+                k = len(self.categories)
+                self.categories.append(name)
+                members = {item: grade for item, grade in details.items() if item != 'weight'}
+                for item_name, item_grade in members.items():
+                    self._add_item(item_name, item_grade, k, renames.get(name, {}).get(item_name))
+                weight = float(details.get('weight', 0))
+                if weight <= 0 and name in extra_credit:
+                    # A bonus category only counts as extra credit, worth its items' points
+                    weight = float(sum(members.values()))
+                self.category_max.append(weight)
+                self.top_level.append(("category", k))
+            else:
+                self.top_level.append(("item", self._add_item(name, details, None, None)))
+        self.item_max = np.array(self.item_max, dtype=float)
+        self.category_max = np.array(self.category_max, dtype=float)
+        self.item_extra = np.array([self._item_is_extra(i, extra_credit) for i in range(len(self.items))])
+        self.top_extra = np.array([(self.categories[index] if kind == "category" else self.items[index])
+                                   in extra_credit for kind, index in self.top_level])
+        top_max = [self.category_max[index] if kind == "category" else self.item_max[index]
+                   for kind, index in self.top_level]
+        self.course_max = float(np.sum(np.array(top_max)[~self.top_extra])) if top_max else 0.0
+        self.membership = np.zeros((len(self.items), len(self.categories)))
+        for i, k in enumerate(self.item_category):
+            if k is not None:
+                self.membership[i, k] = 1
+
+    def _add_item(self, name, grade, category, renamed):
+        index = len(self.items)
+        self.items.append(name)
+        self.item_max.append(float(grade))
+        self.item_category.append(category)
+        self.aliases[name] = index
+        if renamed:
+            self.aliases[renamed] = index
+        return index
+
+    def _item_is_extra(self, index, extra_credit):
+        return self.item_category[index] is not None and self.items[index] in extra_credit
+
+
+def aggregate(values, maxes, extra, membership, method, group_max=None, exclude_empty=True):
+    """Aggregates students x children grades into students x groups totals.
+
+    Follows Moodle's aggregation: 'natural' sums points and the group maximum
+    is the sum of the counted children's maxima; 'mean' and
+    'simple_weighted_mean' average grades normalized by their grademax (with
+    equal weights, or weighted by grademax) and scale the result to
+    `group_max`. Extra credit children add to the numerator only. Empty
+    grades are left out when `exclude_empty`, otherwise they count as 0.
+    Returns (totals, maxima); a group with nothing to count is NaN.
+    """
+    maxes = np.broadcast_to(maxes, values.shape)
+    graded = ~np.isnan(values)
+    if not exclude_empty:
+        graded = np.ones_like(graded)
+    points = np.where(graded, np.nan_to_num(values), 0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        normalized = np.where(maxes > 0, points / maxes, 0.0)
+        weights = (maxes > 0).astype(float) if method == "mean" else maxes
+        counted = graded * weights
+        numerator = (normalized * counted) @ membership
+        denominator = (counted * ~extra) @ membership
+        if method == "natural":
+            totals = np.where(denominator > 0, np.minimum(numerator, denominator), np.nan)
+            return totals, denominator
+        ratio = np.where(denominator > 0, numerator / denominator, np.nan)
+    group_max = np.broadcast_to(group_max, ratio.shape)
+    return np.clip(ratio, 0, 1) * group_max, group_max
+
+
+def compute_totals(book, grades, exclude_empty=True):
+    """Returns (students x categories totals, course totals, course maxima) for a grade matrix."""
+    category_totals, category_maxes = aggregate(
+        grades, book.item_max, book.item_extra, book.membership, book.aggregation,
+        book.category_max, exclude_empty)
+    # The course total aggregates the top-level categories and items the same way
+    columns, maxes = [], []
+    for kind, index in book.top_level:
+        if kind == "category":
+            columns.append(category_totals[:, index])
+            maxes.append(category_maxes[:, index])
+        else:
+            columns.append(grades[:, index])
+            maxes.append(np.full(len(grades), book.item_max[index]))
+    children = np.column_stack(columns) if columns else np.empty((len(grades), 0))
+    child_maxes = np.column_stack(maxes) if maxes else children
+    course_totals, course_maxes = aggregate(
+        children, child_maxes, book.top_extra, np.ones((children.shape[1], 1)),
+        book.course_aggregation, book.course_max, exclude_empty)
+    return category_totals, course_totals[:, 0], course_maxes[:, 0]
+
+
+def parse_grade(value):
+    value = value.strip()
+    if value in ("", "-"):
+        return np.nan
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+
+def load_exports(paths, book):
+    """Reads Moodle grade exports (plain text, comma separated) into one students x items matrix.
+
+    Returns (students, grades, moodle_totals): student identity columns per
+    row, the grade matrix (NaN where empty or not exported) and the category
+    and course totals Moodle itself exported, for checking.
+    """
+    students, rows, moodle_totals = [], [], {}
+    for path in paths:
+        with open(path, 'r', encoding='utf-8-sig', newline='') as file:
+            reader = csv.reader(file)
+            header = next(reader, [])
+            columns = {}  # Item index, or total name -> CSV position
+            identity = []
+            for position, title in enumerate(header):
+                match = HEADER_PATTERN.match(title)
+                if not match:
+                    if title != "Last downloaded from this course":
+                        identity.append((position, title))
+                    continue
+                name = match.group(1)
+                if name in book.aliases:
+                    columns[book.aliases[name]] = position
+                elif name.endswith(" total"):
+                    columns[name] = position
+            for record in reader:
+                if not record:
+                    continue
+                student = {title: record[position] for position, title in identity}
+                student["Export"] = os.path.basename(path)
+                students.append(student)
+                row = np.full(len(book.items), np.nan)
+                for key, position in columns.items():
+                    value = parse_grade(record[position]) if position < len(record) else np.nan
+                    if isinstance(key, int):
+                        row[key] = value
+                    else:
+                        moodle_totals.setdefault(key, {})[len(students) - 1] = value
+                rows.append(row)
+    grades = np.array(rows) if rows else np.empty((0, len(book.items)))
+    totals = {}
+    for name, values in moodle_totals.items():
+        column = np.full(len(students), np.nan)
+        column[list(values)] = list(values.values())
+        totals[name] = column
+    return students, grades, totals
+
+
+def apply_what_if(book, grades, assignments):
+    """Fills empty grades of an item for every student, e.g. 'Final=20'."""
+    for assignment in assignments:
+        name, _, value = assignment.partition("=")
+        if name not in book.aliases:
+            raise ValueError(f"Unknown grade item '{name}'")
+        column = grades[:, book.aliases[name]]
+        column[np.isnan(column)] = float(value)
+    return grades
+
+
+def check_against_moodle(book, category_totals, course_totals, moodle_totals):
+    """Compares the computed totals with the ones in the exports. Returns the mismatch count."""
+    computed = {"Course total": course_totals}
+    for k, name in enumerate(book.categories):
+        computed[f"{name} total"] = category_totals[:, k]
+    mismatches = 0
+    for name, expected in moodle_totals.items():
+        if name not in computed:
+            continue
+        actual = np.round(computed[name], 2)
+        both = ~np.isnan(expected) & ~np.isnan(actual)
+        differ = (both & (np.abs(actual - expected) > CHECK_TOLERANCE)) | (np.isnan(expected) != np.isnan(actual))
+        count = int(np.count_nonzero(differ))
+        mismatches += count
+        status = "matches" if count == 0 else f"{count} mismatches"
+        print(f"{name:<25} {status}")
+        if count:
+            for row in np.flatnonzero(differ)[:5]:
+                logging.warning(f"{name} differs on row {row}: Moodle {expected[row]}, computed {actual[row]}")
+    return mismatches
+
+
+def write_totals(book, students, category_totals, course_totals, course_maxes, output_path=TOTALS_PATH):
+    identity = list(dict.fromkeys(key for student in students for key in student))
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(identity + [f"{name} total" for name in book.categories]
+                        + ["Course total", "Course max"])
+        for row, student in enumerate(students):
+            totals = [("" if np.isnan(value) else f"{value:.2f}") for value in category_totals[row]]
+            writer.writerow([student.get(key, "") for key in identity] + totals
+                            + [("" if np.isnan(course_totals[row]) else f"{course_totals[row]:.2f}"),
+                               f"{course_maxes[row]:.2f}"])
+
+
+def main():
+    setup_logging("grade_engine_log.txt")
+    parser = argparse.ArgumentParser(
+        description="Compute category and course totals offline from Moodle grade exports.")
+    parser.add_argument("exports", nargs="*",
+                        help=f"exported grade CSVs (default: every CSV in {EXPORTS_PATH}/)")
+    parser.add_argument("--aggregation", choices=AGGREGATIONS, default="simple_weighted_mean",
+                        help="aggregation of the categories in gradebook.json")
+    parser.add_argument("--course-aggregation", choices=AGGREGATIONS, default="natural",
+                        help="aggregation of the course total")
+    parser.add_argument("--extra-credit", action="append", default=[],
+                        help="category or item that only adds to its total (repeatable)")
+    parser.add_argument("--include-empty", action="store_true",
+                        help="count empty grades as 0 instead of leaving them out")
+    parser.add_argument("--what-if", action="append", default=[], metavar="ITEM=GRADE",
+                        help="give every student without a grade for ITEM this grade (repeatable)")
+    parser.add_argument("--output", default=TOTALS_PATH)
+    args = parser.parse_args()
+
+    structure = read_json(GRADEBOOK_PATH)
+    if not structure:
+        print(f"{GRADEBOOK_PATH} not found. Exiting.")
+        return
+    renames = {category: names for category, names in read_json(MODIFY_PATH).items()
+               if isinstance(names, dict)}
+    book = Gradebook(structure, renames, args.aggregation, args.course_aggregation,
+                     set(args.extra_credit))
+    paths = args.exports or sorted(glob.glob(os.path.join(EXPORTS_PATH, "*.csv")))
+    if not paths:
+        print("No grade exports found. Exiting.")
+        return
+
+    students, grades, moodle_totals = load_exports(paths, book)
+    try:
+        grades = apply_what_if(book, grades, args.what_if)
+    except ValueError as e:
+        print(f"{e}. Exiting.")
+        return
+    start_time = time.perf_counter()
+    category_totals, course_totals, course_maxes = compute_totals(book, grades, not args.include_empty)
+    elapsed = time.perf_counter() - start_time
+    print(f"Computed totals for {len(students)} students x {len(book.items)} items "
+          f"in {elapsed * 1000:.2f} ms")
+    logging.info(f"Computed totals for {len(students)} students from {len(paths)} exports "
+                 f"in {elapsed * 1000:.2f} ms")
+
+    # Without what-if changes the exports' own totals must be reproduced
+    if moodle_totals and not args.what_if:
+        check_against_moodle(book, category_totals, course_totals, moodle_totals)
+    write_totals(book, students, category_totals, course_totals, course_maxes, args.output)
+    print(f"Totals written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
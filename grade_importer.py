@@ -0,0 +1,243 @@
+import argparse
+import csv
+import io
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from course_catalog import resolve_targets
+from moodle_automation import MOODLE_URL, read_json, read_lines, setup_logging
+from moodle_http import course_id_from_url, find_sesskey, is_login_page, login_sessions, per_thread
+from page_cache import get_page, invalidate
+
+MARKS_PATH = os.path.join("grade_book", "marks.csv")
+IMPORTS_PATH = os.path.join("grade_book", "imports")
+ID_COLUMN = "Email address"
+IMPORT_WORKERS = 4   # Each worker logs in its own session
+# 'Paste from spreadsheet' takes the data in a text box; the CSV importer only takes an uploaded file
+IMPORT_URL = f"{MOODLE_URL}/grade/import/direct/index.php"
+EMAIL_PATTERN = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+
+
+class ImportFormParser(HTMLParser):
+    """Collects the fields of Moodle's 'Paste from spreadsheet' forms: hidden values and select options."""
+
+    def __init__(self):
+        super().__init__()
+        self.hidden = {}
+        self.selects = {}  # name -> [(value, text)]
+        self._in_form = False
+        self._select = None
+        self._option = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "form" and "grade/import/direct" in (attrs.get("action") or ""):
+            self._in_form = True
+        elif not self._in_form:
+            return
+        elif tag == "input" and attrs.get("type") == "hidden" and attrs.get("name"):
+            self.hidden[attrs["name"]] = attrs.get("value", "")
+        elif tag == "select":
+            self._select = attrs.get("name")
+            self.selects[self._select] = []
+        elif tag == "option" and self._select:
+            self._option = [attrs.get("value", ""), ""]
+
+    def handle_endtag(self, tag):
+        if tag == "form":
+            self._in_form = False
+        elif tag == "option" and self._option is not None:
+            self.selects[self._select].append((self._option[0], self._option[1].strip()))
+            self._option = None
+        elif tag == "select":
+            self._select = None
+
+    def handle_data(self, data):
+        if self._option is not None:
+            self._option[1] += data
+
+
+def parse_import_form(html):
+    parser = ImportFormParser()
+    parser.feed(html)
+    return parser
+
+
+def item_candidates(structure, renames):
+    """Maps every spreadsheet header an item may have to the names it may have in Moodle.
+
+    An item can be given by its gradebook.json name or its modify.json name,
+    and the course may or may not have been renamed yet, so both are tried.
+    """
+    candidates = {}
+    for name, details in structure.items():
+        if isinstance(details, dict):
+            for item in details:
+                if item != "weight":
+                    names = [renames.get(name, {}).get(item), item]
+                    names = [n for n in names if n]
+                    for n in names:
+                        candidates[n] = names
+        else:
+            candidates[name] = [name]
+    return candidates
+
+
+def read_marks(file_path, id_column):
+    """Reads the master marks sheet, keyed by the lower-cased student id."""
+    try:
+        with open(file_path, 'r', encoding='utf-8-sig', newline='') as file:
+            reader = csv.DictReader(file)
+            rows = [row for row in reader if (row.get(id_column) or "").strip()]
+            return reader.fieldnames or [], {row[id_column].strip().lower(): row for row in rows}
+    except FileNotFoundError:
+        logging.error(f"File '{file_path}' not found.")
+        return [], {}
+
+
+def page_emails(html):
+    return {email.lower() for email in EMAIL_PATTERN.findall(html)}
+
+
+def enrolled_emails(session, course_id):
+    """Returns the email addresses shown on the course's participants page."""
+    return get_page(session, f"{MOODLE_URL}/user/index.php?id={course_id}&perpage=5000", page_emails)
+
+
+def course_csv(columns, rows, id_column, delimiter=","):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=delimiter)
+    writer.writerow([id_column] + columns)
+    for row in rows:
+        writer.writerow([row[id_column].strip()] + [(row.get(column) or "").strip() for column in columns])
+    return buffer.getvalue()
+
+
+def map_columns(form, header, id_column, candidates):
+    """Fills the mapping form: the id column identifies users by email, the rest map to grade items.
+
+    Returns (fields, unmapped column names).
+    """
+    fields = dict(form.hidden)
+    fields["mapfrom"] = str(header.index(id_column))
+    fields["mapto"] = "useremail"
+    unmapped = []
+    for position, column in enumerate(header):
+        select = f"mapping_{position}"
+        if column == id_column or select not in form.selects:
+            continue
+        # Grade item options have the item id as value; feedback ones start with 'feedback_'
+        items = {text: value for value, text in form.selects[select] if value.isdigit() and value != "0"}
+        match = next((items[name] for name in candidates.get(column, [column]) if name in items), None)
+        if match is None:
+            unmapped.append(column)
+        fields[select] = match or "0"
+    fields["submitbutton"] = "Upload grades"
+    return fields, unmapped
+
+
+def import_course(session, course_url, columns, marks, id_column, candidates, dry_run=False):
+    """Imports the enrolled students' marks into one course. Returns (status, detail)."""
+    course_id = course_id_from_url(course_url)
+    enrolled = enrolled_emails(session, course_id)
+    rows = [row for key, row in marks.items() if key in enrolled]
+    if not rows:
+        return "skipped", "no enrolled students in the marks sheet"
+    os.makedirs(IMPORTS_PATH, exist_ok=True)
+    with open(os.path.join(IMPORTS_PATH, f"{course_id}.csv"), 'w', encoding='utf-8', newline='') as file:
+        file.write(course_csv(columns, rows, id_column))
+    if dry_run:
+        return "written", f"{len(rows)} students"
+
+    import_url = f"{IMPORT_URL}?id={course_id}"
+    page = session.get(import_url, timeout=60)
+    page.raise_for_status()
+    if is_login_page(page):
+        raise RuntimeError("Moodle session expired")
+    upload_fields = dict(parse_import_form(page.text).hidden)
+    upload_fields.setdefault("sesskey", find_sesskey(page.text))
+    # Spreadsheet paste is tab-separated, as copied from Excel
+    upload_fields.update({"userdata": course_csv(columns, rows, id_column, delimiter="\t"),
+                          "encoding": "UTF-8", "previewrows": "10", "submitbutton": "Upload grades"})
+    preview = session.post(import_url, data=upload_fields, timeout=120)
+    preview.raise_for_status()
+    form = parse_import_form(preview.text)
+    if "mapfrom" not in form.selects:
+        raise RuntimeError("Moodle did not show the column mapping form")
+
+    fields, unmapped = map_columns(form, [id_column] + columns, id_column, candidates)
+    result = session.post(IMPORT_URL, data=fields, timeout=300)
+    result.raise_for_status()
+    invalidate(course_id)
+    errors = re.findall(r'class="[^"]*alert-danger[^"]*"[^>]*>(.*?)</div>', result.text, re.S)
+    if errors:
+        raise RuntimeError(re.sub(r"<[^>]+>", " ", errors[0]).strip())
+    detail = f"{len(rows)} students"
+    if unmapped:
+        detail += f", not in this course: {', '.join(unmapped)}"
+    return "imported", detail
+
+
+def import_all(sessions, courses, columns, marks, id_column, candidates, dry_run=False):
+    """Runs the course imports one worker per session. Returns {course_url: (status, detail)}."""
+    # Moodle serves one request per session at a time; a shared login would import one course at a time
+    session_for = per_thread(sessions)
+
+    def run(course_url):
+        try:
+            return course_url, import_course(session_for(), course_url, columns, marks, id_column,
+                                             candidates, dry_run)
+        except Exception as e:
+            logging.error(f"Grade import failed for course: {course_url} - Error: {e}")
+            return course_url, ("failed", str(e))
+
+    with ThreadPoolExecutor(max_workers=len(sessions)) as executor:
+        return dict(executor.map(run, courses))
+
+
+def main():
+    setup_logging("grade_importer_log.txt")
+    parser = argparse.ArgumentParser(
+        description="Split a master marks sheet by course and import it into each gradebook.")
+    parser.add_argument("--marks", default=MARKS_PATH, help="master marks sheet (CSV)")
+    parser.add_argument("--id-column", default=ID_COLUMN,
+                        help="column with the students' Moodle email addresses")
+    parser.add_argument("--dry-run", action="store_true",
+                        help=f"only write the per-course CSVs to {IMPORTS_PATH}/")
+    args = parser.parse_args()
+
+    header, marks = read_marks(args.marks, args.id_column)
+    if args.id_column not in header or not marks:
+        print(f"No marks with a '{args.id_column}' column found in {args.marks}. Exiting.")
+        return
+    renames = {category: names for category, names in read_json("grade_book/modify.json").items()
+               if isinstance(names, dict)}
+    candidates = item_candidates(read_json("grade_book/gradebook.json"), renames)
+    columns = [column for column in header if column != args.id_column]
+    unknown = [column for column in columns if column not in candidates]
+    if unknown:
+        print(f"Columns not in gradebook.json or modify.json (matched by name): {', '.join(unknown)}")
+    courses = resolve_targets(read_lines("grade_book/links.txt"), "course")
+    if not courses:
+        print("No courses found. Exiting.")
+        return
+
+    sessions = login_sessions(IMPORT_WORKERS)
+    if not sessions:
+        print("Login failed. Exiting.")
+        return
+    start_time = time.time()
+    results = import_all(sessions, courses, columns, marks, args.id_column, candidates, args.dry_run)
+    for course_url in courses:
+        status, detail = results[course_url]
+        print(f"{course_id_from_url(course_url)!s:<8} {status:<9} {detail}")
+        logging.info(f"{course_url}: {status} {detail}")
+    failed = sum(1 for status, _ in results.values() if status == "failed")
+    print(f"Processed {len(courses)} course(s) in {time.time() - start_time:.2f} seconds, {failed} failed.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+import html
+import importlib
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from urllib.parse import urlencode
+from course_catalog import gradebook_setup_url
+from gradebook_mirror import GradeTreeParser
+from moodle_ajax import AjaxBatcher
+from moodle_http import course_id_from_url, find_sesskey, login_sessions, per_thread
+from page_cache import get_page, invalidate
+from progress_dashboard import emit
+
+HTTP_WORKERS = 4
+ADD_ITEM_FORM = "core_grades\\form\\add_item"
+ADD_CATEGORY_FORM = "core_grades\\form\\add_category"
+MAX_DELETE_ROUNDS = 5
+
+
+class FormFieldsParser(HTMLParser):
+    """Collects the values a browser would submit for a form, and each select's options."""
+
+    def __init__(self):
+        super().__init__()
+        self.fields = {}
+        self.options = {}  # select name -> {option text: value}
+        self._select = None
+        self._selected = None
+        self._option = None
+        self._textarea = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        name = attrs.get("name")
+        if tag == "input" and name:
+            kind = attrs.get("type", "text")
+            if kind in ("checkbox", "radio") and "checked" not in attrs:
+                return
+            if kind not in ("submit", "button", "file"):
+                self.fields[name] = attrs.get("value", "")
+        elif tag == "select" and name:
+            self._select = name
+            self._selected = None
+            self.options[name] = {}
+        elif tag == "option" and self._select:
+            self._option = [attrs.get("value", ""), ""]
+            if "selected" in attrs:
+                self._selected = attrs.get("value", "")
+        elif tag == "textarea" and name:
+            self._textarea = name
+            self.fields[name] = ""
+
+    def handle_data(self, data):
+        if self._option is not None:
+            self._option[1] += data
+        elif self._textarea is not None:
+            self.fields[self._textarea] += data
+
+    def handle_endtag(self, tag):
+        if tag == "option" and self._option is not None:
+            value, text = self._option
+            self.options[self._select][" ".join(text.split())] = value
+            self._option = None
+        elif tag == "select" and self._select:
+            options = list(self.options[self._select].values())
+            selected = self._selected if self._selected is not None else (options[0] if options else "")
+            self.fields[self._select] = selected
+            self._select = None
+        elif tag == "textarea":
+            self._textarea = None
+
+
+def parse_setup_page(text):
+    """Returns the sesskey, the grade tree rows and the delete links of a 'Gradebook setup' page."""
+    parser = GradeTreeParser()
+    parser.feed(text)
+    links = re.findall(r'href="([^"]*grade/edit/tree/index\.php[^"]*action=delete[^"]*)"', text)
+    return find_sesskey(text), parser.rows, list(dict.fromkeys(html.unescape(link) for link in links))
+
+
+class GradebookClient:
+    """Edits one course's gradebook over HTTP instead of through the setup page's modals.
+
+    Creating and editing go through the same core_form_dynamic_form web
+    service the modal forms use: the form is loaded once to get its fields
+    and defaults, then submitted with the changed values. Deleting follows
+    the tree page's own delete links. Web service calls go through `ajax`;
+    the forms of many items are loaded and submitted together, so they share
+    service.php requests.
+    """
+
+    def __init__(self, session, course_id, ajax=None):
+        self.session = session
+        self.course_id = course_id
+        self.ajax = ajax or AjaxBatcher(session, window=0)
+        self.sesskey = None
+        self.rows = []
+        self._delete_links = []
+        self._forms = {}  # Blank forms by (class, args); new items and categories reuse one load
+
+    def open(self):
+        """Loads 'Gradebook setup' for the sesskey and the current tree. Returns the rows."""
+        self.sesskey, self.rows, self._delete_links = get_page(
+            self.session, gradebook_setup_url(self.course_id), parse_setup_page)
+        if not self.sesskey:
+            raise RuntimeError("No sesskey on the Gradebook setup page")
+        if self.ajax.sesskey is None:
+            self.ajax.sesskey = self.sesskey
+        return self.rows
+
+    def names(self):
+        return {row["name"] for row in self.rows if row["name"]}
+
+    def find(self, name):
+        return next((row for row in self.rows if row["name"] == name and row["kind"] in ("item", "category")),
+                    None)
+
+    def call(self, methodname, args):
+        """Calls one Moodle web service function through lib/ajax/service.php."""
+        return self.ajax.call(methodname, args)
+
+    def load_forms(self, form_class, args_list):
+        """Loads several dynamic forms of one class in as few requests as possible."""
+        pages = self.ajax.map("core_form_dynamic_form",
+                              [{"form": form_class, "formdata": urlencode(args)} for args in args_list])
+        forms = []
+        for data in pages:
+            parser = FormFieldsParser()
+            parser.feed(data["html"])
+            forms.append(parser)
+        return forms
+
+    def submit_forms(self, form_class, entries, reuse=False):
+        """Fills in and submits several dynamic forms of one class. Returns the results in order.
+
+        Each entry is (args, values, choices): `values` are set as given and
+        `choices` pick select options by text (select name -> option text).
+        The forms are loaded together, then submitted together. With `reuse`
+        loaded forms are kept, so creating many items loads their form once.
+        """
+        if not entries:
+            return []
+        keys = [(form_class, urlencode(args)) for args, _, _ in entries]
+        forms = {key: self._forms[key] for key in keys if reuse and key in self._forms}
+        missing = {}
+        for key, (args, _, _) in zip(keys, entries):
+            if key not in forms:
+                missing.setdefault(key, args)
+        if missing:
+            forms.update(zip(missing, self.load_forms(form_class, list(missing.values()))))
+        if reuse:
+            self._forms.update(forms)
+
+        submissions = []
+        for key, (_, values, choices) in zip(keys, entries):
+            fields = dict(forms[key].fields)
+            fields.update({name: str(value) for name, value in values.items()})
+            for name, text in (choices or {}).items():
+                if text not in forms[key].options.get(name, {}):
+                    raise RuntimeError(f"'{text}' is not an option of '{name}'")
+                fields[name] = forms[key].options[name][text]
+            submissions.append({"form": form_class, "formdata": urlencode(fields)})
+        try:
+            results = self.ajax.map("core_form_dynamic_form", submissions)
+        finally:
+            invalidate(self.course_id)
+
+        rejected = []
+        for data in results:
+            if not data.get("submitted"):
+                errors = re.findall(r'class="[^"]*invalid-feedback[^"]*"[^>]*>([^<]+)<', data.get("html", ""))
+                rejected.append("; ".join(error.strip() for error in errors if error.strip()) or "validation failed")
+        if rejected:
+            raise RuntimeError(f"Moodle rejected {len(rejected)} form(s): {'; '.join(rejected)}")
+        return results
+
+    def submit_form(self, form_class, args, values, choices=None, reuse=False):
+        """Loads a dynamic form, sets `values` and `choices` and submits it."""
+        return self.submit_forms(form_class, [(args, values, choices)], reuse)[0]
+
+    def add_category(self, name, grademax):
+        self.submit_form(ADD_CATEGORY_FORM, {"courseid": self.course_id, "category": -1, "gpr_plugin": "tree"},
+                         {"fullname": name, "grade_item_grademax": grademax}, reuse=True)
+        # Forms loaded before this do not list the new category as a parent
+        self._forms = {key: form for key, form in self._forms.items() if key[0] != ADD_ITEM_FORM}
+
+    def add_items(self, items, category=None):
+        """Creates grade items from (name, grademax) pairs, all in one category, in one round of requests."""
+        args = {"courseid": self.course_id, "itemid": -1, "gpr_plugin": "tree"}
+        choices = {"parentcategory": category} if category else None
+        self.submit_forms(ADD_ITEM_FORM, [(args, {"itemname": name, "grademax": grademax}, choices)
+                                          for name, grademax in items], reuse=True)
+
+    def rename_items(self, renames):
+        """Renames grade items from (itemid, new name) pairs; their forms are loaded and submitted together."""
+        self.submit_forms(ADD_ITEM_FORM, [({"courseid": self.course_id, "itemid": itemid, "gpr_plugin": "tree"},
+                                           {"itemname": new_name}, None) for itemid, new_name in renames])
+
+    def delete_links(self):
+        return self._delete_links
+
+    def delete_all(self):
+        """Deletes every category and item. Moodle moves a deleted category's children up, so
+        the page is re-read until nothing deletable is left. Returns the number deleted."""
+        deleted = 0
+        for _ in range(MAX_DELETE_ROUNDS):
+            self.open()
+            links = self.delete_links()
+            if not links:
+                return deleted
+            for link in links:
+                response = self.session.get(link + ("" if "confirm=" in link else "&confirm=1"), timeout=60)
+                response.raise_for_status()
+                deleted += 1
+            invalidate(self.course_id)
+        self.open()
+        if self.delete_links():
+            raise RuntimeError("Items are left after deleting")
+        return deleted
+
+
+def run_http(module_name, function_name, targets, extra_args, workers=HTTP_WORKERS):
+    """Runs a task's HTTP function over all courses, `workers` at a time. Returns result dicts."""
+    from course_shards import print_result_table
+
+    # Moodle serves one request per session at a time, so each worker logs in its own session.
+    # A batcher belongs to one session (its sesskey), and batches that worker's calls.
+    sessions = login_sessions(workers)
+    if not sessions:
+        print("Login failed. Exiting.")
+        return []
+    course_func = getattr(importlib.import_module(module_name), function_name)
+    # A worker's calls only overlap where a client submits them together, so no window is waited for
+    batchers = [AjaxBatcher(session, window=0) for session in sessions]
+    worker_session = per_thread(list(zip(sessions, batchers)))
+
+    def run(indexed):
+        index, course_url = indexed
+        start_time = time.time()
+        result = {"index": index, "course": course_url, "worker": None}
+        emit("course_start", course_url, worker=threading.current_thread().name)
+        try:
+            session, ajax = worker_session()
+            client = GradebookClient(session, course_id_from_url(course_url), ajax)
+            client.open()
+            course_func(client, *extra_args)
+            result["status"] = "ok"
+        except Exception as e:
+            logging.error(f"HTTP run failed on course: {course_url} - Error: {e}")
+            result.update(status="failed", error=str(e))
+        result["duration"] = round(time.time() - start_time, 2)
+        emit("course_end", course_url, value=result["status"])
+        return result
+
+    with ThreadPoolExecutor(max_workers=len(sessions), thread_name_prefix="http") as executor:
+        results = list(executor.map(run, enumerate(targets)))
+    for index, ajax in enumerate(batchers, 1):
+        ajax.close()
+        logging.info(f"Session {index} made {ajax.stats()}.")
+    calls = sum(ajax.calls_sent for ajax in batchers)
+    requests_sent = sum(ajax.requests_sent for ajax in batchers)
+    stats = (f"{calls} web service call(s) in {requests_sent} request(s) over {len(sessions)} session(s), "
+             f"{calls / max(requests_sent, 1):.1f} calls per request")
+    logging.info(f"HTTP run made {stats}.")
+    print_result_table(results)
+    print(f"Made {stats}.")
+    return results
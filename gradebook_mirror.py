@@ -0,0 +1,353 @@
+import argparse
+import csv
+import logging
+import os
+import re
+import sqlite3
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from course_catalog import gradebook_setup_url, resolve_targets
+from moodle_automation import read_json, read_lines, setup_logging
+from moodle_http import course_id_from_url, login_sessions, per_thread
+from page_cache import get_page
+
+MIRROR_DB_PATH = "gradebook_mirror.db"
+DRIFT_PATH = os.path.join("logs", "gradebook_drift.csv")
+MAX_AGE_HOURS = 24
+FETCH_WORKERS = 4   # Each worker logs in its own session
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS courses (
+    course_id INTEGER PRIMARY KEY,
+    fetched_at REAL,
+    changed_at REAL
+);
+CREATE TABLE IF NOT EXISTS grade_items (
+    course_id INTEGER,
+    itemid INTEGER,
+    kind TEXT,
+    name TEXT,
+    category TEXT,
+    grademax REAL,
+    weight REAL,
+    position INTEGER,
+    PRIMARY KEY (course_id, itemid)
+);
+"""
+
+
+class GradeTreeParser(HTMLParser):
+    """Reads the rows of the 'Gradebook setup' table (grade_edit_tree_table).
+
+    Every row with a data-itemid becomes {itemid, kind, name, category,
+    grademax, weight}. The parent category is taken from the row's 'levelN'
+    class: a row belongs to the closest category row above it with a lower
+    level.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.rows = []
+        self._in_table = False
+        self._row = None
+        self._cell = None
+        self._text = []
+        self._categories = []  # (level, name) of the open categories
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "table" and attrs.get("id") == "grade_edit_tree_table":
+            self._in_table = True
+        elif not self._in_table:
+            return
+        elif tag == "tr" and attrs.get("data-itemid"):
+            classes = attrs.get("class") or ""
+            level = re.search(r"\blevel(\d+)", classes)
+            self._row = {"itemid": int(attrs["data-itemid"]), "classes": classes,
+                         "level": int(level.group(1)) if level else None,
+                         "name": None, "grademax": None, "weight": None}
+        elif self._row is None:
+            return
+        elif tag == "td" or tag == "th":
+            classes = attrs.get("class") or ""
+            if self._row["level"] is None:
+                level = re.search(r"\blevel(\d+)", classes)
+                self._row["level"] = int(level.group(1)) if level else None
+            self._cell = ("weight" if "column-weight" in classes
+                          else "range" if "column-range" in classes
+                          else "name" if "column-name" in classes else None)
+            self._text = []
+        elif tag == "span" and attrs.get("title") and self._row["name"] is None:
+            self._row["name"] = attrs["title"].strip()
+        elif tag == "input" and self._cell == "weight" and attrs.get("value"):
+            self._row["weight"] = _number(attrs["value"])
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._text.append(data)
+
+    def handle_endtag(self, tag):
+        if not self._in_table:
+            return
+        if tag in ("td", "th") and self._row is not None and self._cell is not None:
+            text = " ".join("".join(self._text).split())
+            if self._cell == "range":
+                self._row["grademax"] = _number(text, last=True)
+            elif self._cell == "weight" and self._row["weight"] is None:
+                self._row["weight"] = _number(text)
+            elif self._cell == "name" and self._row["name"] is None:
+                self._row["name"] = text or None
+            self._cell = None
+        elif tag == "tr" and self._row is not None:
+            self._finish_row()
+        elif tag == "table":
+            self._in_table = False
+
+    def _finish_row(self):
+        row, self._row = self._row, None
+        classes = row.pop("classes")
+        level = row.pop("level")
+        if "courseitem" in classes or (level == 1 and "category" in classes):
+            row["kind"] = "course"
+        elif "categoryitem" in classes:
+            row["kind"] = "total"
+        elif "category" in classes:
+            row["kind"] = "category"
+        else:
+            row["kind"] = "item"
+        if level is not None:
+            while self._categories and self._categories[-1][0] >= level:
+                self._categories.pop()
+        row["category"] = self._categories[-1][1] if self._categories else None
+        if row["kind"] == "total":
+            # A category's maximum grade is shown on its total row
+            for category in reversed(self.rows):
+                if category["kind"] == "category" and category["name"] == row["category"]:
+                    if category["grademax"] is None:
+                        category["grademax"] = row["grademax"]
+                    break
+        if row["kind"] == "category" and level is not None:
+            self._categories.append((level, row["name"]))
+        self.rows.append(row)
+
+
+def _number(text, last=False):
+    numbers = re.findall(r"-?\d+(?:\.\d+)?", (text or "").replace(",", ""))
+    if not numbers:
+        return None
+    return float(numbers[-1] if last else numbers[0])
+
+
+def connect(db_path=MIRROR_DB_PATH):
+    connection = sqlite3.connect(db_path)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def parse_grade_tree(html):
+    parser = GradeTreeParser()
+    parser.feed(html)
+    return parser.rows
+
+
+def fetch_grade_tree(session, course_id):
+    """Downloads one course's 'Gradebook setup' page and returns its rows."""
+    rows = get_page(session, gradebook_setup_url(course_id), parse_grade_tree)
+    if not rows:
+        raise RuntimeError("no grade tree on the Gradebook setup page")
+    return rows
+
+
+def stale_course_ids(connection, course_ids, max_age_hours):
+    cutoff = time.time() - max_age_hours * 3600
+    fresh = {row[0] for row in connection.execute(
+        "SELECT course_id FROM courses WHERE fetched_at >= ?", (cutoff,))}
+    return [course_id for course_id in course_ids if course_id not in fresh]
+
+
+def stored_rows(connection, course_id):
+    return [tuple(row) for row in connection.execute(
+        "SELECT itemid, kind, name, category, grademax, weight, position FROM grade_items "
+        "WHERE course_id = ? ORDER BY position", (course_id,))]
+
+
+def snapshot(sessions, course_ids, db_path=MIRROR_DB_PATH, max_age_hours=MAX_AGE_HOURS, force=False):
+    """Fetches the grade tree of every course missing or older than `max_age_hours`, one worker per session."""
+    connection = connect(db_path)
+    todo = list(course_ids) if force else stale_course_ids(connection, course_ids, max_age_hours)
+    print(f"Refreshing {len(todo)} of {len(course_ids)} course(s).")
+    session_for = per_thread(sessions)
+
+    def fetch(course_id):
+        try:
+            return course_id, fetch_grade_tree(session_for(), course_id), None
+        except Exception as e:
+            return course_id, None, e
+
+    changed = 0
+    with ThreadPoolExecutor(max_workers=len(sessions)) as executor:
+        for course_id, rows, error in executor.map(fetch, todo):
+            if error is not None:
+                logging.error(f"Failed to snapshot gradebook of course {course_id} - Error: {error}")
+                print(f"Failed to snapshot gradebook of course {course_id} - Error: {error}")
+                continue
+            new_rows = [(row["itemid"], row["kind"], row["name"], row["category"], row["grademax"],
+                         row["weight"], position) for position, row in enumerate(rows)]
+            now = time.time()
+            with connection:
+                if new_rows == stored_rows(connection, course_id):
+                    # Unchanged since the last snapshot; only the fetch time moves
+                    connection.execute(
+                        "INSERT INTO courses VALUES (?, ?, ?) ON CONFLICT(course_id) "
+                        "DO UPDATE SET fetched_at = excluded.fetched_at", (course_id, now, now))
+                    continue
+                changed += 1
+                connection.execute("INSERT OR REPLACE INTO courses VALUES (?, ?, ?)",
+                                   (course_id, now, now))
+                connection.execute("DELETE FROM grade_items WHERE course_id = ?", (course_id,))
+                connection.executemany("INSERT INTO grade_items VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                       [(course_id,) + row for row in new_rows])
+            logging.info(f"Gradebook of course {course_id} changed: {len(new_rows)} row(s)")
+    connection.close()
+    print(f"{changed} gradebook(s) changed since the last snapshot.")
+
+
+def mirrored_trees(course_ids, db_path=MIRROR_DB_PATH):
+    """Returns {course_id: {name: row}} of the categories and items in the mirror."""
+    if not os.path.exists(db_path):
+        return {}
+    connection = connect(db_path)
+    trees = {}
+    for course_id in course_ids:
+        rows = connection.execute(
+            "SELECT kind, name, category, grademax, weight, itemid FROM grade_items "
+            "WHERE course_id = ? AND kind IN ('category', 'item') ORDER BY position",
+            (course_id,)).fetchall()
+        if rows:
+            trees[course_id] = {name: {"kind": kind, "category": category, "grademax": grademax,
+                                       "weight": weight, "itemid": itemid}
+                                for kind, name, category, grademax, weight, itemid in rows}
+    connection.close()
+    return trees
+
+
+def desired_structure(structure, renames):
+    """Returns {name: (kind, category, grademax, old name)} as setup and modify leave a course."""
+    desired = {}
+    for name, details in structure.items():
+        if isinstance(details, dict):
+            desired[name] = ("category", None, float(details.get("weight", 0)), None)
+            for item, grade in details.items():
+                if item != "weight":
+                    new_name = renames.get(name, {}).get(item, item)
+                    desired[new_name] = ("item", name, float(grade), item if new_name != item else None)
+        else:
+            desired[name] = ("item", None, float(details), None)
+    return desired
+
+
+def drift_against_config(trees, desired):
+    """Compares each mirrored course with gradebook.json + modify.json. Returns issue rows."""
+    issues = []
+    for course_id, tree in trees.items():
+        for name, (kind, category, grademax, old_name) in desired.items():
+            row = tree.get(name)
+            if row is None and old_name and old_name in tree:
+                issues.append((course_id, kind, name, name, old_name, "not renamed"))
+                row = tree[old_name]
+            if row is None:
+                issues.append((course_id, kind, name, "present", "missing", "missing"))
+                continue
+            if row["grademax"] is not None and abs(row["grademax"] - grademax) > 0.001:
+                issues.append((course_id, kind, name, grademax, row["grademax"], "grademax differs"))
+            if kind == "item" and (row["category"] or None) != category and row["category"] is not None:
+                issues.append((course_id, kind, name, category or "(course)", row["category"],
+                               "wrong category"))
+        known = set(desired) | {old for _, _, _, old in desired.values() if old}
+        for name, row in tree.items():
+            if name not in known:
+                issues.append((course_id, row["kind"], name, "absent", "present", "not in config"))
+    return issues
+
+
+def drift_between_courses(trees):
+    """Compares the courses with each other: names most courses have, and their usual grademax."""
+    issues = []
+    if len(trees) < 2:
+        return issues
+    names = Counter(name for tree in trees.values() for name in tree)
+    for name, count in names.items():
+        usual = Counter(tree[name]["grademax"] for tree in trees.values() if name in tree).most_common(1)[0][0]
+        for course_id, tree in trees.items():
+            if name not in tree:
+                if count > len(trees) / 2:
+                    issues.append((course_id, "", name, f"in {count} courses", "missing", "differs from others"))
+            elif tree[name]["grademax"] != usual:
+                issues.append((course_id, tree[name]["kind"], name, usual, tree[name]["grademax"],
+                               "grademax differs from others"))
+    return issues
+
+
+def write_drift(issues, output_path=DRIFT_PATH):
+    counts = Counter(course_id for course_id, *_ in issues)
+    for course_id, count in sorted(counts.items()):
+        print(f"{course_id!s:<8} {count} difference(s)")
+    for course_id, kind, name, expected, actual, issue in issues[:40]:
+        print(f"  {course_id!s:<8} {issue:<30} {kind:<9} {name}: expected {expected}, found {actual}")
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["course", "kind", "name", "expected", "actual", "issue"])
+        writer.writerows(issues)
+    print(f"{len(issues)} difference(s) written to {output_path}.")
+
+
+def configured_course_ids():
+    """Courses named in grade_book/links.txt and modify.json."""
+    lines = read_lines("grade_book/links.txt") + read_json("grade_book/modify.json").get("courses", [])
+    return sorted({course_id_from_url(url) for url in resolve_targets(lines, "gradebook")} - {None})
+
+
+def main():
+    setup_logging("gradebook_mirror_log.txt")
+    parser = argparse.ArgumentParser(
+        description="Mirror every course's gradebook structure locally and report drift.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    snapshot_parser = subparsers.add_parser("snapshot", help="fetch the grade trees into the mirror")
+    snapshot_parser.add_argument("--max-age", type=float, default=MAX_AGE_HOURS,
+                                 help="re-fetch courses snapshotted more than this many hours ago")
+    snapshot_parser.add_argument("--refresh", action="store_true", help="re-fetch every course")
+    snapshot_parser.add_argument("--db", default=MIRROR_DB_PATH)
+    drift_parser = subparsers.add_parser("drift", help="compare the mirror with the config and across courses")
+    drift_parser.add_argument("--db", default=MIRROR_DB_PATH)
+    args = parser.parse_args()
+
+    course_ids = configured_course_ids()
+    if not course_ids:
+        print("No courses found. Exiting.")
+        return
+    if args.command == "snapshot":
+        sessions = login_sessions(FETCH_WORKERS)
+        if not sessions:
+            print("Login failed. Exiting.")
+            return
+        start_time = time.time()
+        snapshot(sessions, course_ids, args.db, args.max_age, args.refresh)
+        print(f"Snapshot took {time.time() - start_time:.2f} seconds.")
+        return
+
+    trees = mirrored_trees(course_ids, args.db)
+    if not trees:
+        print("The mirror is empty. Run 'python gradebook_mirror.py snapshot' first.")
+        return
+    renames = {category: names for category, names in read_json("grade_book/modify.json").items()
+               if isinstance(names, dict)}
+    desired = desired_structure(read_json("grade_book/gradebook.json"), renames)
+    issues = drift_against_config(trees, desired) + drift_between_courses(trees)
+    write_drift(issues)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,119 +1,13 @@
-import urllib.parse
-import json
-import requests
-import os
 import time
 import logging
-from selenium import webdriver
 from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from course_catalog import resolve_targets
+from moodle_automation import AdaptiveWait, Task, ensure_edit_mode, open_page, read_json, register_task, run_task
+from retry_queue import RetryQueue, StepValidationError
 
 # Configurations
-CHROMEDRIVER_PATH = os.path.join(os.getcwd(), 'chromedriver.exe')
 CONFIG_FILE_PATH = "grade_book/modify.json"
-CREDS_FILE_PATH = "creds.txt"
-
-# Logging setup
-logging.basicConfig(filename="logs/gradebook_modifier_log.txt", level=logging.INFO,
-                    format='%(asctime)s - %(levelname)s - %(message)s')
-
-
-def read_json(file_path):
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        logging.error(f"File not found: {file_path}")
-        return None
-
-
-def read_creds(file_path):
-    creds = {}
-    try:
-        with open(file_path, 'r') as f:
-            for line in f:
-                key, value = line.strip().split(':')
-                creds[key] = value
-        return creds.get('email'), creds.get('password')
-    except Exception as e:
-        logging.error(f"Error reading credentials: {e}")
-        return None, None
-
-
-def js_click(driver, element):
-    """Clicks an element using JavaScript to avoid interception issues."""
-    driver.execute_script("arguments[0].click();", element)
-
-
-def auto_login(driver, email, password):
-    """Logs into Moodle using SSO with email and password."""
-    try:
-        driver.get("https://moodle.nu.edu.eg/")
-        time.sleep(3)
-
-        email_input = WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.ID, "i0116"))
-        )
-        email_input.clear()
-        email_input.send_keys(email)
-        next_button = driver.find_element(By.ID, "idSIButton9")
-        js_click(driver, next_button)
-        logging.info("Entered email and clicked next for SSO.")
-
-        retries = 3
-        for attempt in range(retries):
-            try:
-                password_input = WebDriverWait(driver, 10).until(
-                    EC.presence_of_element_located((By.ID, "i0118"))
-                )
-                password_input.clear()
-                password_input.send_keys(password)
-                sign_in_button = driver.find_element(By.ID, "idSIButton9")
-                js_click(driver, sign_in_button)
-                logging.info("Entered password and clicked sign in for SSO.")
-                break
-            except Exception as e:
-                if attempt < retries - 1:
-                    logging.warning(
-                        f"Retry {attempt + 1} for password entry due to error: {e}")
-                    time.sleep(2)
-                else:
-                    raise e
-
-        stay_signed_in_button = WebDriverWait(driver, 10).until(
-            EC.element_to_be_clickable((By.ID, "idSIButton9"))
-        )
-        js_click(driver, stay_signed_in_button)
-        logging.info("Clicked 'Yes' for staying signed in.")
-
-        WebDriverWait(driver, 20).until(
-            EC.presence_of_element_located(
-                (By.XPATH, "//h2[contains(text(), 'Hi,')]"))
-        )
-        logging.info("Login successful.")
-        print("Login successful.")
-        return True
-    except Exception as e:
-        logging.error(f"Login process failed - Error: {e}")
-        print(f"Login process failed - Error: {e}")
-        return False
-
-
-def enable_edit_mode(driver):
-    try:
-        edit_mode_checkbox = WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located(
-                (By.XPATH, "//input[@name='setmode' and @class='custom-control-input']"))
-        )
-        if not edit_mode_checkbox.is_selected():
-            js_click(driver, edit_mode_checkbox)
-            logging.info("Edit mode enabled.")
-        else:
-            logging.info("Edit mode already enabled.")
-    except Exception as e:
-        logging.error(f"Failed to enable edit mode: {e}")
 
 
 def retrieve_sesskey(driver):
@@ -150,7 +44,7 @@ def retrieve_moodle_session_cookie(driver):
 def modify_grade_item_name(driver, old_name, new_name, category):
     """
     Modifies the grade item name by injecting a button in place of the 3-dotted button and interacting with it.
-    Skips the item if it cannot be found.
+    Raises StepValidationError if the item cannot be found, so it is not retried.
     """
     try:
         print(f"Looking for grade item '{
@@ -167,14 +61,14 @@ def modify_grade_item_name(driver, old_name, new_name, category):
             print(f"Grade item '{old_name}' not found. Skipping...")
             logging.warning(f"Grade item '{old_name}' not found in category '{
                             category}'. Skipping...")
-            return False
+            raise StepValidationError(f"Grade item '{old_name}' not found")
 
         if not data_itemid:
             print(
                 f"Could not find data-itemid for grade item '{old_name}'. Skipping...")
             logging.warning(
                 f"Could not find data-itemid for grade item '{old_name}'. Skipping...")
-            return False
+            raise StepValidationError(f"No data-itemid for grade item '{old_name}'")
 
         print(
             f"Found data-itemid '{data_itemid}' for grade item '{old_name}'.")
@@ -221,11 +115,11 @@ def modify_grade_item_name(driver, old_name, new_name, category):
                   old_name}': {e}")
             logging.error(f"Failed to locate or click the injected button for grade item '{
                           old_name}': {e}")
-            return False
+            raise
 
         # Wait for the edit modal to load
         try:
-            WebDriverWait(driver, 3).until(
+            AdaptiveWait(driver, 3, key="gradebook_modifier.item_name").until(
                 EC.presence_of_element_located(
                     (By.XPATH, "//input[@name='itemname']"))
             )
@@ -234,7 +128,7 @@ def modify_grade_item_name(driver, old_name, new_name, category):
         except Exception as e:
             print(f"Failed to wait for the edit form: {e}")
             logging.error(f"Failed to wait for the edit form: {e}")
-            return False
+            raise
 
         # Locate the item name input and update its value
         try:
@@ -250,7 +144,7 @@ def modify_grade_item_name(driver, old_name, new_name, category):
                 f"Failed to locate or interact with the item name input: {e}")
             logging.error(
                 f"Failed to locate or interact with the item name input: {e}")
-            return False
+            raise
 
         # Save the changes
         try:
@@ -265,80 +159,104 @@ def modify_grade_item_name(driver, old_name, new_name, category):
         except Exception as e:
             print(f"Failed to locate or click the save button: {e}")
             logging.error(f"Failed to locate or click the save button: {e}")
-            return False
+            raise
 
     except Exception as e:
         print(f"Failed to modify '{old_name}' to '{new_name}': {e}")
         logging.error(f"Failed to modify '{old_name}' to '{new_name}': {e}")
-        return False
-
+        raise
 
-def modify_gradebook(driver, config):
-    """Modify grade items in each course according to the provided configuration."""
-    for course_url in config["courses"]:
-        driver.get(course_url)
-        time.sleep(3)
-        logging.info(f"Accessed course gradebook: {course_url}")
-
-        # Enable edit mode if not already enabled
-        enable_edit_mode(driver)
-
-        # Modify Tutorials category grade items
-        if "Tutorials" in config:
-            for old_name, new_name in config["Tutorials"].items():
-                logging.info(
-                    f"Attempting to change {old_name} to {new_name} in category Tutorials")
-                success = modify_grade_item_name(
-                    driver, old_name, new_name, "Tutorials")
-                if success:
-                    logging.info(
-                        f"Successfully changed {old_name} to {new_name} in Tutorials category.")
-                else:
-                    logging.error(
-                        f"Failed to change {old_name} to {new_name} in Tutorials category.")
-
-        # Modify Labs category grade items
-        if "Labs" in config:
-            for old_name, new_name in config["Labs"].items():
-                logging.info(
-                    f"Attempting to change {old_name} to {new_name} in category Labs")
-                success = modify_grade_item_name(
-                    driver, old_name, new_name, "Labs")
-                if success:
-                    logging.info(
-                        f"Successfully changed {old_name} to {new_name} in Labs category.")
-                else:
-                    logging.error(
-                        f"Failed to change {old_name} to {new_name} in Labs category.")
 
+def modify_gradebook(driver, config, retries=None):
+    """Modify grade items in each course according to the provided configuration.
 
-def main():
-    # Load configuration and credentials
-    config = read_json(CONFIG_FILE_PATH)
-    email, password = read_creds(CREDS_FILE_PATH)
-
-    if not config or not email or not password:
-        logging.error("Missing configuration or credentials. Exiting script.")
-        return
+    Failed renames go on the retry queue. Without a queue one is created and
+    retried before returning.
+    """
+    own_retries = retries is None
+    if own_retries:
+        retries = RetryQueue(driver)
 
-    # Set up WebDriver
-    service = Service(executable_path=CHROMEDRIVER_PATH)
-    driver = webdriver.Chrome(service=service)
-    driver.maximize_window()
+    for course_url in config["courses"]:
+        def reopen(course_url=course_url):
+            open_page(driver, course_url)
+            # Enable edit mode if not already enabled
+            ensure_edit_mode(driver)
 
-    # Login to Moodle
-    if not auto_login(driver, email, password):
-        logging.error("Exiting script due to login failure.")
-        driver.quit()
-        return
+        # Modify Tutorials and Labs category grade items
+        renames = [(old_name, new_name, category) for category in ("Tutorials", "Labs")
+                   for old_name, new_name in config.get(category, {}).items()]
 
-    # Process each course URL
-    modify_gradebook(driver, config)
+        try:
+            reopen()
+        except Exception as e:
+            for old_name, new_name, category in renames:
+                retries.defer(course_url, f"rename {old_name}", modify_grade_item_name,
+                              (driver, old_name, new_name, category), reopen, e)
+            continue
+        logging.info(f"Accessed course gradebook: {course_url}")
 
-    # Close the driver
-    driver.quit()
-    logging.info("Browser closed. Script completed.")
+        for old_name, new_name, category in renames:
+            logging.info(
+                f"Attempting to change {old_name} to {new_name} in category {category}")
+            failed = retries.run(course_url, f"rename {old_name}", modify_grade_item_name,
+                                 driver, old_name, new_name, category, prepare=reopen)
+            if failed is None:
+                logging.info(
+                    f"Successfully changed {old_name} to {new_name} in {category} category.")
+            else:
+                logging.error(
+                    f"Failed to change {old_name} to {new_name} in {category} category.")
+
+    if own_retries:
+        retries.retry_deferred()
+        retries.summary()
+
+
+def modify_gradebook_http(client, config):
+    """Renames the grade items of one course over HTTP (--http). Raises if any were not found."""
+    missing = []
+    renames = []
+    for category in ("Tutorials", "Labs"):
+        for old_name, new_name in config.get(category, {}).items():
+            row = client.find(old_name)
+            if row is None:
+                if client.find(new_name) is None:
+                    logging.warning(f"Grade item '{old_name}' not found in course {client.course_id}")
+                    missing.append(old_name)
+                continue
+            renames.append((row["itemid"], old_name, new_name))
+    # The renames are independent, so their forms are loaded and submitted together
+    client.rename_items([(itemid, new_name) for itemid, _, new_name in renames])
+    for _, old_name, new_name in renames:
+        logging.info(f"Changed {old_name} to {new_name} in course {client.course_id}")
+    if missing:
+        raise StepValidationError(f"Grade items not found: {', '.join(missing)}")
+    print(f"Grade items renamed over HTTP for course {client.course_id}")
+
+
+@register_task
+class GradebookModifyTask(Task):
+    name = "gradebook_modify"
+    description = "Rename Moodle grade items."
+    log_file = "gradebook_modifier_log.txt"
+    target_kind = "gradebook"
+    http_function = "modify_gradebook_http"
+
+    def load_inputs(self, args):
+        config = read_json(CONFIG_FILE_PATH)
+        if not config:
+            logging.error("Missing configuration.")
+            return None
+        config["courses"] = resolve_targets(config.get("courses", []), self.target_kind)
+        return {"targets": config["courses"], "config": config}
+
+    def http_args(self, inputs):
+        return (inputs["config"],)
+
+    def run_course(self, driver, course_url, inputs, retries):
+        modify_gradebook(driver, {**inputs["config"], "courses": [course_url]}, retries)
 
 
 if __name__ == "__main__":
-    main()
+    run_task(GradebookModifyTask())
@@ -0,0 +1,269 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+from moodle_automation import TASK_MODULES, setup_logging
+from progress_dashboard import Dashboard, attach_worker, stop_dashboard, worker_queue
+
+# Put the queue on a drive every host can reach to spread one run over several machines.
+LEASE_DB_PATH = "queue/lease_queue.db"
+LEASE_SECONDS = 300
+MAX_ATTEMPTS = 3
+POLL_INTERVAL = 5
+# Several workers write to one log file; the process id tells them apart
+LOG_FORMAT = '%(asctime)s - %(process)d - %(levelname)s - %(message)s'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    operation TEXT NOT NULL,
+    target TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    duration REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, lease_expires);
+"""
+
+
+def connect(db_path=LEASE_DB_PATH):
+    # Rollback journal rather than WAL: WAL needs shared memory and breaks on network drives
+    connection = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def enqueue(operation, targets, params=None, db_path=LEASE_DB_PATH):
+    """Adds one job per target and returns how many were queued."""
+    if operation not in TASK_MODULES:
+        raise ValueError(f"Unknown operation '{operation}'")
+    connection = connect(db_path)
+    with connection:
+        connection.execute("BEGIN IMMEDIATE")
+        connection.executemany(
+            "INSERT INTO jobs (operation, target, params) VALUES (?, ?, ?)",
+            [(operation, target, json.dumps(params or {})) for target in targets])
+    connection.close()
+    return len(targets)
+
+
+def claim(connection, worker_id, lease_seconds=LEASE_SECONDS):
+    """Leases the next pending job, or one whose worker stopped heartbeating.
+
+    Returns the job as a dict, or None when nothing can be claimed right now.
+    Jobs whose lease expired MAX_ATTEMPTS times are marked failed instead.
+    """
+    now = time.time()
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        connection.execute(
+            "UPDATE jobs SET status = 'failed', error = 'lease expired ' || attempts || ' time(s)' "
+            "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?", (now, MAX_ATTEMPTS))
+        row = connection.execute(
+            "SELECT job_id, operation, target, params, status, worker FROM jobs "
+            "WHERE status = 'pending' OR (status = 'leased' AND lease_expires < ?) "
+            "ORDER BY job_id LIMIT 1", (now,)).fetchone()
+        if row is None:
+            connection.execute("COMMIT")
+            return None
+        job_id, operation, target, params, status, previous_worker = row
+        connection.execute(
+            "UPDATE jobs SET status = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1 "
+            "WHERE job_id = ?", (worker_id, now + lease_seconds, job_id))
+        connection.execute("COMMIT")
+    except Exception:
+        connection.execute("ROLLBACK")
+        raise
+    if status == "leased":
+        logging.warning(f"Reclaimed job {job_id} from {previous_worker}, whose lease expired.")
+        print(f"Reclaimed job {job_id} from {previous_worker}, whose lease expired.")
+    return {"job_id": job_id, "operation": operation, "target": target, "params": json.loads(params)}
+
+
+def renew_lease(connection, job_id, worker_id, lease_seconds=LEASE_SECONDS):
+    """Extends the lease; returns False if another worker has taken the job over."""
+    cursor = connection.execute(
+        "UPDATE jobs SET lease_expires = ? WHERE job_id = ? AND worker = ? AND status = 'leased'",
+        (time.time() + lease_seconds, job_id, worker_id))
+    return cursor.rowcount == 1
+
+
+def finish(connection, job_id, worker_id, status, error=None, duration=None):
+    """Records the outcome, unless the lease was lost and the job now belongs to another worker."""
+    cursor = connection.execute(
+        "UPDATE jobs SET status = ?, error = ?, duration = ?, lease_expires = NULL "
+        "WHERE job_id = ? AND worker = ? AND status = 'leased'",
+        (status, error, duration, job_id, worker_id))
+    if cursor.rowcount != 1:
+        logging.warning(f"Job {job_id} was reclaimed by another worker; dropping this result.")
+
+
+def remaining_jobs(connection):
+    return connection.execute(
+        "SELECT COUNT(*) FROM jobs WHERE status IN ('pending', 'leased')").fetchone()[0]
+
+
+class Heartbeat(threading.Thread):
+    """Renews a job's lease in the background while the job runs."""
+
+    def __init__(self, db_path, job_id, worker_id, lease_seconds=LEASE_SECONDS):
+        super().__init__(daemon=True)
+        self.db_path = db_path
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.stopped = threading.Event()
+
+    def run(self):
+        connection = connect(self.db_path)
+        try:
+            while not self.stopped.wait(self.lease_seconds / 3):
+                try:
+                    if not renew_lease(connection, self.job_id, self.worker_id, self.lease_seconds):
+                        logging.warning(f"Lost the lease on job {self.job_id}.")
+                        return
+                except sqlite3.OperationalError as e:
+                    # A busy database only delays this beat; the lease has slack for two more
+                    logging.warning(f"Heartbeat for job {self.job_id} failed - Error: {e}")
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def run_claimed_job(driver, job, db_path, worker_id, lease_seconds, login):
+    """Runs one leased job like a daemon job on its single target, while heartbeating."""
+    from daemon import run_operation
+    from retry_queue import RetryQueue
+
+    heartbeat = Heartbeat(db_path, job["job_id"], worker_id, lease_seconds)
+    heartbeat.start()
+    start_time = time.time()
+    try:
+        retries = RetryQueue(driver, relogin=lambda: login(driver))
+        run_operation(driver, job["operation"], {**job["params"], "targets": [job["target"]]}, retries)
+        error = "; ".join(f"{entry['step']}: {entry['error']}" for entry in retries.failed) or None
+    except Exception as e:
+        error = str(e)
+    finally:
+        heartbeat.stop()
+    return ("failed" if error else "done"), error, round(time.time() - start_time, 2)
+
+
+def worker_main(worker_id, db_path=LEASE_DB_PATH, lease_seconds=LEASE_SECONDS, wait=False, events=None):
+    """Claims and runs jobs in one logged-in browser until the queue is drained."""
+    # Spawned processes do not run main()
+    setup_logging("lease_queue_log.txt", LOG_FORMAT)
+    from course_shards import write_worker_reports
+    from moodle_automation import login_function, open_browser
+    attach_worker(events, worker_id)
+
+    login = login_function("auto")
+    driver = open_browser(login) if login is not None else None
+    if driver is None:
+        logging.error(f"Worker {worker_id} could not log in.")
+        print(f"Worker {worker_id} could not log in.")
+        write_worker_reports(worker_id)
+        return
+    connection = connect(db_path)
+    logging.info(f"Worker {worker_id} started.")
+    try:
+        while True:
+            job = claim(connection, worker_id, lease_seconds)
+            if job is None:
+                if not wait and remaining_jobs(connection) == 0:
+                    break
+                # Jobs still leased elsewhere may expire and come back to us
+                time.sleep(POLL_INTERVAL)
+                continue
+            print(f"[{worker_id}] job {job['job_id']}: {job['operation']} {job['target']}")
+            status, error, duration = run_claimed_job(driver, job, db_path, worker_id, lease_seconds, login)
+            finish(connection, job["job_id"], worker_id, status, error, duration)
+            (logging.info if error is None else logging.error)(
+                f"Job {job['job_id']} ({job['operation']} {job['target']}): {status} {error or ''}")
+            print(f"[{worker_id}] job {job['job_id']}: {status} (Time taken: {duration:.2f} seconds)")
+    finally:
+        connection.close()
+        driver.quit()
+        write_worker_reports(worker_id)
+        logging.info(f"Worker {worker_id} stopped.")
+
+
+def work(workers, db_path=LEASE_DB_PATH, lease_seconds=LEASE_SECONDS, wait=False, dashboard=False):
+    """Starts `workers` worker processes on this host, each with its own browser."""
+    if dashboard:
+        connection = connect(db_path)
+        # Counts the jobs not finished yet, including those other hosts will take
+        Dashboard(range(remaining_jobs(connection))).start()
+        connection.close()
+    host = socket.gethostname()
+    processes = [
+        multiprocessing.Process(target=worker_main,
+                                args=(f"{host}-{os.getpid()}-{index}", db_path, lease_seconds, wait,
+                                      worker_queue()))
+        for index in range(1, workers + 1)
+    ]
+    try:
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+    finally:
+        stop_dashboard()
+
+
+def print_status(db_path=LEASE_DB_PATH):
+    connection = connect(db_path)
+    for status, count in connection.execute(
+            "SELECT status, COUNT(*) FROM jobs GROUP BY status ORDER BY status"):
+        print(f"{status:<8} {count}")
+    for job_id, operation, target, worker, error in connection.execute(
+            "SELECT job_id, operation, target, worker, error FROM jobs WHERE status = 'failed'"):
+        print(f"job {job_id} {operation} {target} ({worker}): {error}")
+    connection.close()
+
+
+def main():
+    setup_logging("lease_queue_log.txt", LOG_FORMAT)
+    parser = argparse.ArgumentParser(
+        description="Share per-course jobs between worker processes on one or more hosts.")
+    parser.add_argument("--db", default=LEASE_DB_PATH, help="queue database, on a shared drive for several hosts")
+    sub = parser.add_subparsers(dest="command", required=True)
+    add = sub.add_parser("enqueue", help="queue one job per course")
+    add.add_argument("operation", choices=sorted(TASK_MODULES))
+    add.add_argument("targets", nargs="+", help="course links, ids or '#GROUP' names")
+    add.add_argument("--params", default="{}", help="daemon job params as JSON, e.g. task options")
+    run = sub.add_parser("work", help="run jobs from the queue")
+    run.add_argument("--workers", type=int, default=2, help="worker processes (browsers) on this host")
+    run.add_argument("--lease", type=int, default=LEASE_SECONDS, help="lease length in seconds")
+    run.add_argument("--wait", action="store_true", help="keep polling after the queue is drained")
+    run.add_argument("--dashboard", action="store_true", help="show live progress of this host's workers")
+    sub.add_parser("status", help="show job counts and failures")
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(args.db) or ".", exist_ok=True)
+    if args.command == "enqueue":
+        from course_catalog import resolve_targets
+        from moodle_automation import load_task
+        targets = resolve_targets(args.targets, load_task(args.operation).target_kind)
+        count = enqueue(args.operation, targets, json.loads(args.params), args.db)
+        print(f"Queued {count} {args.operation} job(s).")
+    elif args.command == "work":
+        work(args.workers, args.db, args.lease, args.wait, args.dashboard)
+    else:
+        print_status(args.db)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from moodle_automation import CREDS_FILE_PATH, MOODLE_URL, setup_logging
+from moodle_http import course_id_from_url, find_sesskey, is_login_page, login_sessions, per_thread
+from progress_dashboard import Dashboard, emit, stop_dashboard
+
+MACROS_PATH = "macros"
+REPLAY_WORKERS = 4   # Each worker logs in its own session
+
+# Recorded requests whose URL contains one of these are replayed; page assets,
+# polling and logging calls are dropped.
+REPLAYED_ENDPOINTS = (
+    "modedit.php", "mod/forum/post.php", "repository/repository_ajax.php",
+    "course/edit", "grade/edit", "lib/ajax/service.php", "course/rest.php",
+)
+UPLOAD_ENDPOINT = "repository/repository_ajax.php?action=upload"
+
+
+def collect_requests(driver):
+    """Drains the performance log and returns the Moodle requests the page made."""
+    recorded = []
+    for entry in driver.get_log("performance"):
+        message = json.loads(entry["message"])["message"]
+        if message.get("method") != "Network.requestWillBeSent":
+            continue
+        request = message["params"]["request"]
+        if not request["url"].startswith(MOODLE_URL):
+            continue
+        recorded.append({
+            "method": request["method"],
+            "url": request["url"],
+            "content_type": request.get("headers", {}).get("Content-Type", ""),
+            "body": request.get("postData"),
+        })
+    return recorded
+
+
+def _multipart_fields(body, content_type):
+    """Returns the text fields of a recorded multipart body (file parts are skipped)."""
+    match = re.search(r"boundary=(.+)", content_type)
+    if not body or not match:
+        return {}
+    fields = {}
+    for part in body.split("--" + match.group(1)):
+        header, _, value = part.partition("\r\n\r\n")
+        name = re.search(r'name="([^"]+)"', header)
+        if name and "filename=" not in header:
+            fields[name.group(1)] = value.rstrip("\r\n")
+    return fields
+
+
+def _parameterize(value, variables, key=None):
+    for name, literal in variables.items():
+        # Section numbers are small and would match unrelated fields
+        if name == "section" and key != "section":
+            continue
+        if value == str(literal):
+            return "{" + name + "}"
+    return value
+
+
+def _parameterize_url(url, variables):
+    parts = urllib.parse.urlsplit(url)
+    query = [(key, _parameterize(value, variables, key))
+             for key, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)]
+    # Keep the braces readable in the stored template
+    query_text = "&".join(f"{key}={urllib.parse.quote(value, safe='{}')}" for key, value in query)
+    return urllib.parse.urlunsplit(parts._replace(query=query_text))
+
+
+def build_template(recorded, variables, files_dir=None):
+    """Turns the recorded requests of one course into a parameterized template.
+
+    Values equal to a known variable (course id, sesskey, section, forum, ...)
+    become '{name}'. Each draft area itemid seen in a file upload becomes its
+    own '{draft_N}' variable, so every replay gets fresh draft areas.
+    """
+    variables = {name: value for name, value in variables.items() if value is not None}
+    steps = []
+    drafts = {}
+    for request in recorded:
+        if request["method"] != "POST" or not any(e in request["url"] for e in REPLAYED_ENDPOINTS):
+            continue
+        if UPLOAD_ENDPOINT in request["url"]:
+            fields = _multipart_fields(request["body"], request["content_type"])
+            itemid = fields.get("itemid")
+            if itemid and itemid not in drafts.values():
+                drafts[f"draft_{len(drafts) + 1}"] = itemid
+            name = re.search(r'filename="([^"]+)"', request["body"] or "")
+            fields.pop("repo_upload_file", None)
+            steps.append({"type": "upload", "url": request["url"], "fields": fields,
+                          "file": name.group(1) if name else None})
+            continue
+        if "application/json" in request["content_type"]:
+            steps.append({"type": "json", "url": request["url"], "body": request["body"]})
+            continue
+        steps.append({"type": "form", "url": request["url"],
+                      "fields": urllib.parse.parse_qsl(request["body"] or "", keep_blank_values=True)})
+
+    all_variables = {**variables, **drafts}
+    for step in steps:
+        step["url"] = _parameterize_url(step["url"], all_variables)
+        if step["type"] == "upload":
+            step["fields"] = {k: _parameterize(v, all_variables, k) for k, v in step["fields"].items()}
+        elif step["type"] == "form":
+            step["fields"] = [[k, _parameterize(v, all_variables, k)] for k, v in step["fields"]]
+        elif step["body"]:
+            for name, literal in all_variables.items():
+                if name == "section":
+                    continue
+                step["body"] = step["body"].replace(f'"{literal}"', '"{' + name + '}"')
+                step["body"] = re.sub(rf"(?<![\w.]){re.escape(str(literal))}(?![\w.])",
+                                      "{" + name + "}", step["body"])
+    return {"variables": sorted(all_variables), "files_dir": files_dir, "steps": steps}
+
+
+def resolve_variables(session, course_id, template, section=None):
+    """Looks up this course's values for the template variables."""
+    page = session.get(f"{MOODLE_URL}/course/view.php?id={course_id}", timeout=30)
+    if is_login_page(page):
+        raise RuntimeError("Moodle session expired")
+    values = {"course_id": course_id, "sesskey": find_sesskey(page.text), "section": section}
+    if "forum" in template["variables"]:
+        from course_catalog import lookup_courses
+        cmid = dict(lookup_courses()).get(course_id)
+        forum_page = session.get(f"{MOODLE_URL}/mod/forum/view.php?id={cmid}", timeout=30)
+        match = re.search(r"post\.php\?forum=(\d+)", forum_page.text)
+        values["forum"] = match.group(1) if match else None
+    for name in template["variables"]:
+        if name.startswith("draft_"):
+            values[name] = str(random.randint(100000000, 999999999))
+    missing = [name for name in template["variables"] if values.get(name) is None]
+    if missing:
+        raise ValueError(f"No value for template variable(s) {missing} in course {course_id}")
+    return values
+
+
+def _fill(text, values):
+    return re.sub(r"\{(\w+)\}", lambda m: str(values.get(m.group(1), m.group(0))), text)
+
+
+def verify_response(step, response):
+    """Checks a replayed request landed: no login redirect, no error page, no re-shown form."""
+    if response.status_code >= 400:
+        return f"HTTP {response.status_code}"
+    if is_login_page(response):
+        return "session expired"
+    if step["type"] == "form":
+        if response.url.split("?")[0] == step["url"].split("?")[0] and "is-invalid" in response.text:
+            return "form was shown again with validation errors"
+        if 'class="errorbox' in response.text:
+            return "Moodle error page"
+    elif step["type"] in ("json", "upload"):
+        if '"error"' in response.text or '"exception"' in response.text:
+            return response.text[:200]
+    return None
+
+
+def replay_course(session, template, course_url, section=None):
+    """Replays the template for one course and returns (course_id, error or None)."""
+    course_id = course_id_from_url(course_url)
+    emit("course_start", course_url, worker=threading.current_thread().name)
+    try:
+        values = resolve_variables(session, course_id, template, section)
+        for step in template["steps"]:
+            url = _fill(step["url"], values)
+            step_name = urllib.parse.urlparse(url).path.rsplit("/", 1)[-1]
+            emit("step_start", course_url, step_name)
+            start_time = time.time()
+            if step["type"] == "upload":
+                path = os.path.join(template["files_dir"] or "", step["file"] or "")
+                with open(path, "rb") as file:
+                    response = session.post(
+                        url, data={k: _fill(v, values) for k, v in step["fields"].items()},
+                        files={"repo_upload_file": (step["file"], file)}, timeout=300)
+            elif step["type"] == "json":
+                response = session.post(url, data=_fill(step["body"], values),
+                                        headers={"Content-Type": "application/json"}, timeout=60)
+            else:
+                response = session.post(url, data=[(k, _fill(v, values)) for k, v in step["fields"]],
+                                        timeout=60)
+            error = verify_response(step, response)
+            emit("step_end", course_url, step_name, (time.time() - start_time, "failed" if error else "ok"))
+            if error:
+                emit("course_end", course_url, value="failed")
+                return course_id, f"{url}: {error}"
+        emit("course_end", course_url, value="ok")
+        return course_id, None
+    except Exception as e:
+        emit("course_end", course_url, value="failed")
+        return course_id, str(e)
+
+
+def record(name, course_url, section=None, files_dir=None):
+    """Opens a logged-in browser on the first course and records the workflow done in it."""
+    from moodle_automation import auto_login, read_creds, start_chrome
+    email, password = read_creds(CREDS_FILE_PATH)
+    # CDP network events go to the performance log, where collect_requests() reads them
+    driver = start_chrome(performance_log=True)
+    try:
+        if not auto_login(driver, email, password):
+            print("Automatic login failed. Exiting...")
+            return
+        driver.get(course_url)
+        driver.get_log("performance")  # drop the login and page-load noise
+        input("Do the workflow for this course in the browser, then press Enter...")
+        recorded = collect_requests(driver)
+        sesskey = driver.execute_script("return M.cfg.sesskey;")
+    finally:
+        driver.quit()
+
+    variables = {"course_id": course_id_from_url(course_url), "sesskey": sesskey, "section": section}
+    forum = next((m.group(1) for r in recorded
+                  for m in [re.search(r"[?&]forum=(\d+)", r["url"] + "&" + (r["body"] or ""))] if m), None)
+    if forum:
+        variables["forum"] = forum
+    template = build_template(recorded, variables, files_dir)
+    os.makedirs(MACROS_PATH, exist_ok=True)
+    path = os.path.join(MACROS_PATH, f"{name}.json")
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(template, file, indent=4)
+    print(f"Recorded {len(template['steps'])} request(s) into {path}.")
+    logging.info(f"Recorded macro '{name}' with {len(template['steps'])} request(s).")
+
+
+def replay(name, course_urls, section=None, dashboard=False):
+    """Replays a recorded macro over pooled HTTP for every course and prints a pass/fail list."""
+    with open(os.path.join(MACROS_PATH, f"{name}.json"), 'r', encoding='utf-8') as file:
+        template = json.load(file)
+    # Moodle serves one request per session at a time, so each worker replays with its own login
+    sessions = login_sessions(REPLAY_WORKERS)
+    if not sessions:
+        print("Login failed. Exiting...")
+        return
+    session_for = per_thread(sessions)
+    start_time = time.time()
+    if dashboard:
+        Dashboard(course_urls).start()
+    try:
+        with ThreadPoolExecutor(max_workers=len(sessions), thread_name_prefix="replay") as executor:
+            results = list(executor.map(
+                lambda course_url: replay_course(session_for(), template, course_url, section), course_urls))
+    finally:
+        stop_dashboard()
+    for course_id, error in results:
+        status = "ok" if error is None else f"FAILED - {error}"
+        print(f"course {course_id}: {status}")
+        (logging.info if error is None else logging.error)(f"Replay '{name}' course {course_id}: {status}")
+    print(f"Replayed {len(results)} course(s) in {time.time() - start_time:.2f} seconds.")
+
+
+def main():
+    setup_logging("macro_recorder_log.txt")
+    parser = argparse.ArgumentParser(
+        description="Record a per-course workflow once in the browser and replay it over HTTP.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rec = sub.add_parser("record", help="record the workflow on the first course")
+    rec.add_argument("name")
+    rec.add_argument("course", help="course link of the first course")
+    rec.add_argument("--section", type=int, help="section number used in this course")
+    rec.add_argument("--files", help="folder holding the files uploaded during the workflow")
+    rep = sub.add_parser("replay", help="replay a recorded workflow on other courses")
+    rep.add_argument("name")
+    rep.add_argument("courses", nargs="+", help="course links, ids or '#GROUP' names")
+    rep.add_argument("--section", type=int, help="section number to use in every course")
+    rep.add_argument("--dashboard", action="store_true",
+                     help="show live progress: course status, current step, courses/minute and ETA")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record(args.name, args.course, args.section, args.files)
+    else:
+        from course_catalog import resolve_targets
+        replay(args.name, resolve_targets(args.courses, "course"), args.section, args.dashboard)
+
+
+if __name__ == "__main__":
+    main()
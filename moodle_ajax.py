@@ -0,0 +1,159 @@
+import json
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from moodle_automation import MOODLE_URL
+from moodle_http import is_login_page
+
+MAX_BATCH_CALLS = 50            # Calls per service.php request
+MAX_BATCH_BYTES = 512 * 1024    # Encoded arguments per request
+BATCH_WINDOW = 0.02             # Seconds a call waits for others to share its request
+MAX_IN_FLIGHT = 4               # Batches sent at the same time
+REQUEST_TIMEOUT = 120
+
+
+class AjaxError(RuntimeError):
+    """A web service call that Moodle answered with an exception."""
+
+    def __init__(self, message, errorcode=None):
+        super().__init__(message)
+        self.errorcode = errorcode
+
+
+class AjaxBatcher:
+    """Coalesces Moodle web service calls from any number of threads into batched
+    lib/ajax/service.php requests.
+
+    service.php takes a list of {index, methodname, args} and runs them in
+    order in one request, so calls queued within BATCH_WINDOW of each other
+    share a round trip. submit() returns a Future; call() waits for it.
+    Calls queued together with submit_all() or map() share requests even
+    with no window, so a client whose other calls run one after another can
+    use window=0.
+    Moodle stops at the first call that throws, so the calls after it are
+    put back on the queue and go out with the next batch.
+    """
+
+    def __init__(self, session, sesskey=None, base_url=MOODLE_URL, max_calls=MAX_BATCH_CALLS,
+                 max_bytes=MAX_BATCH_BYTES, window=BATCH_WINDOW, max_in_flight=MAX_IN_FLIGHT):
+        self.session = session
+        self.sesskey = sesskey
+        self.base_url = base_url.rstrip("/")
+        self.max_calls = max_calls
+        self.max_bytes = max_bytes
+        self.window = window
+        self.calls_sent = 0
+        self.requests_sent = 0
+        self._pending = []  # [methodname, args, future, encoded size]
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread = None
+        self._senders = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="ajax")
+
+    def submit(self, methodname, args):
+        """Queues one call and returns a Future for its data."""
+        return self.submit_all([(methodname, args)])[0]
+
+    def submit_all(self, calls):
+        """Queues (methodname, args) calls at once, so they go out together. Returns their Futures."""
+        pending = [(methodname, args, Future(), len(json.dumps(args))) for methodname, args in calls]
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("The web service batcher is closed")
+            self._pending.extend(pending)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._collect, name="ajax-batcher", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return [future for _, _, future, _ in pending]
+
+    def call(self, methodname, args):
+        return self.submit(methodname, args).result()
+
+    def map(self, methodname, args_list):
+        """Runs one function over many argument sets in as few requests as possible. Returns the data in order."""
+        futures = self.submit_all([(methodname, args) for args in args_list])
+        return [future.result() for future in futures]
+
+    def _collect(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                # Give other callers a moment to join this request, unless it is already full
+                deadline = time.monotonic() + self.window
+                while len(self._pending) < self.max_calls and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = self._take_batch()
+            self._senders.submit(self._send, batch)
+
+    def _take_batch(self):
+        batch, size = [], 0
+        for call in self._pending:
+            if batch and (len(batch) >= self.max_calls or size + call[3] > self.max_bytes):
+                break
+            batch.append(call)
+            size += call[3]
+        del self._pending[:len(batch)]
+        return batch
+
+    def _requeue(self, calls):
+        with self._condition:
+            self._pending[:0] = calls
+            self._condition.notify()
+
+    def _send(self, batch):
+        methodnames = list(dict.fromkeys(call[0] for call in batch))
+        payload = [{"index": index, "methodname": methodname, "args": args}
+                   for index, (methodname, args, _, _) in enumerate(batch)]
+        try:
+            response = self.session.post(
+                f"{self.base_url}/lib/ajax/service.php?sesskey={self.sesskey}"
+                f"&info={methodnames[0] if len(methodnames) == 1 else 'batch'}",
+                data=json.dumps(payload), headers={"Content-Type": "application/json"},
+                timeout=REQUEST_TIMEOUT)
+            response.raise_for_status()
+            if is_login_page(response):
+                raise RuntimeError("Moodle session expired")
+            results = response.json()
+            if isinstance(results, dict):
+                # Errors before any call runs (bad sesskey, site in maintenance) come back as one object
+                raise AjaxError(results.get("error") or "web service error", results.get("errorcode"))
+        except Exception as e:
+            logging.error(f"Web service request with {len(batch)} call(s) failed - Error: {e}")
+            for _, _, future, _ in batch:
+                future.set_exception(e)
+            return
+        with self._condition:
+            self.requests_sent += 1
+            self.calls_sent += len(results)
+        for (methodname, _, future, _), result in zip(batch, results):
+            if result.get("error"):
+                exception = result.get("exception") or {}
+                future.set_exception(AjaxError(exception.get("message", f"{methodname} failed"),
+                                               exception.get("errorcode")))
+            else:
+                future.set_result(result.get("data"))
+        if len(results) < len(batch):
+            self._requeue(batch[len(results):])
+
+    def close(self):
+        """Sends whatever is queued and stops the batcher."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+        self._senders.shutdown(wait=True)
+        # A failed call in the last batches may have put calls back after the collector stopped
+        while self._pending:
+            self._send(self._take_batch())
+
+    def stats(self):
+        return f"{self.calls_sent} web service call(s) in {self.requests_sent} request(s)"
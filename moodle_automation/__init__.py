@@ -0,0 +1,50 @@
+"""Shared core of the Moodle automation scripts.
+
+Every name is imported on first use, so `import moodle_automation` stays
+cheap: Selenium is only loaded when a browser helper is used, and task
+modules (and their own dependencies, such as pyautogui) only when a task
+is looked up or run.
+"""
+import importlib
+
+_EXPORTS = {
+    "read_file": "files",
+    "read_lines": "files",
+    "read_json": "files",
+    "get_attachments": "files",
+    "read_creds": "files",
+    "setup_logging": "logs",
+    "MOODLE_URL": "browser",
+    "CHROMEDRIVER_PATH": "browser",
+    "CREDS_FILE_PATH": "browser",
+    "start_chrome": "browser",
+    "js_click": "browser",
+    "auto_login": "browser",
+    "prompt_login": "browser",
+    "wait_for_login": "browser",
+    "detect_login": "browser",
+    "login_function": "browser",
+    "open_browser": "browser",
+    "ensure_edit_mode": "edit_mode",
+    "forget_edit_mode": "edit_mode",
+    "open_page": "prefetch",
+    "Prefetcher": "prefetch",
+    "AdaptiveWait": "timeouts",
+    "step_timeout": "timeouts",
+    "save_history": "timeouts",
+    "Task": "tasks",
+    "TASK_MODULES": "tasks",
+    "register_task": "tasks",
+    "load_task": "tasks",
+    "run_task": "tasks",
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__), name)
+    globals()[name] = value
+    return value
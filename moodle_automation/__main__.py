@@ -0,0 +1,14 @@
+import sys
+from moodle_automation.tasks import TASK_MODULES, load_task, run_task
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in TASK_MODULES:
+        print(f"usage: python -m moodle_automation {{{','.join(TASK_MODULES)}}} [options]")
+        sys.exit(2)
+    name = sys.argv[1]
+    run_task(load_task(name), sys.argv[2:])
+
+
+if __name__ == "__main__":
+    main()
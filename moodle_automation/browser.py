@@ -0,0 +1,163 @@
+import logging
+import os
+import time
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from moodle_automation.files import read_creds
+from moodle_automation.timeouts import AdaptiveWait
+
+MOODLE_URL = "https://moodle.nu.edu.eg"
+CHROMEDRIVER_PATH = os.path.join(os.getcwd(), 'chromedriver.exe')
+CREDS_FILE_PATH = "creds.txt"
+
+
+def start_chrome(options=None, performance_log=False, maximize=True):
+    """Starts Chrome through the shared chromedriver, with the profilers that are switched on.
+
+    With performance_log the caller reads Chrome's performance log itself
+    (the macro recorder), so the network profiler, which drains it, is left off.
+    """
+    from driver_profiler import maybe_profile
+    from network_profiler import chrome_options, maybe_profile_network
+    if performance_log:
+        options = options or Options()
+        options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    else:
+        options = chrome_options(options)
+    driver = webdriver.Chrome(service=Service(executable_path=CHROMEDRIVER_PATH), options=options)
+    maybe_profile(driver)
+    if not performance_log:
+        maybe_profile_network(driver)
+    if maximize:
+        driver.maximize_window()
+    return driver
+
+
+def js_click(driver, element, scroll=True):
+    """Clicks an element with JavaScript to avoid interception, scrolling it into view first."""
+    if scroll:
+        driver.execute_script("arguments[0].scrollIntoView(true);", element)
+        time.sleep(1)
+    driver.execute_script("arguments[0].click();", element)
+
+
+def auto_login(driver, email, password):
+    """Logs into Moodle using SSO with email and password."""
+    try:
+        driver.get(f"{MOODLE_URL}/")
+        time.sleep(3)
+
+        email_input = AdaptiveWait(driver, 10, key="browser.login_email").until(
+            EC.presence_of_element_located((By.ID, "i0116"))
+        )
+        email_input.clear()
+        email_input.send_keys(email)
+        next_button = driver.find_element(By.ID, "idSIButton9")
+        js_click(driver, next_button)
+        logging.info("Entered email and clicked next for SSO.")
+
+        # Retry in case of a stale element reference while the page switches
+        retries = 3
+        for attempt in range(retries):
+            try:
+                password_input = AdaptiveWait(driver, 10, key="browser.login_password").until(
+                    EC.presence_of_element_located((By.ID, "i0118"))
+                )
+                password_input.clear()
+                password_input.send_keys(password)
+                sign_in_button = driver.find_element(By.ID, "idSIButton9")
+                js_click(driver, sign_in_button)
+                logging.info("Entered password and clicked sign in for SSO.")
+                break
+            except Exception as e:
+                if attempt < retries - 1:
+                    logging.warning(
+                        f"Retry {attempt + 1} for password entry due to error: {e}")
+                    time.sleep(2)
+                else:
+                    raise e
+
+        stay_signed_in_button = AdaptiveWait(driver, 10, key="browser.login_stay_signed_in").until(
+            EC.element_to_be_clickable((By.ID, "idSIButton9"))
+        )
+        js_click(driver, stay_signed_in_button)
+        logging.info("Clicked 'Yes' for staying signed in.")
+
+        AdaptiveWait(driver, 20, key="browser.login_dashboard").until(
+            EC.presence_of_element_located(
+                (By.XPATH, "//h2[contains(text(), 'Hi,')]"))
+        )
+        logging.info("Login successful.")
+        print("Login successful.")
+        return True
+    except Exception as e:
+        logging.error(f"Login process failed - Error: {e}")
+        print(f"Login process failed - Error: {e}")
+        return False
+
+
+def prompt_login(driver):
+    """Opens Moodle and waits for the user to log in and press Enter."""
+    driver.get(f"{MOODLE_URL}/")
+    input("Please log in to Moodle, then press Enter to continue...")
+    logging.info("User logged in manually.")
+    print("User logged in manually.")
+    return True
+
+
+def wait_for_login(driver, timeout=300):
+    """Waits for the 'Hi,' greeting every user sees once logged in."""
+    try:
+        WebDriverWait(driver, timeout).until(
+            EC.presence_of_element_located(
+                (By.XPATH, "//h2[contains(text(), 'Hi,')]"))
+        )
+        print("Login successful.")
+        logging.info("User logged in successfully.")
+        return True
+    except Exception as e:
+        logging.error(
+            f"Login not detected within the timeout period - Error: {e}")
+        print(f"Login not detected - Error: {e}")
+        return False
+
+
+def detect_login(driver):
+    """Opens Moodle and waits until the user has logged in, without a key press."""
+    driver.get(f"{MOODLE_URL}/")
+    print("Waiting for login...")
+    return wait_for_login(driver)
+
+
+def login_function(mode, creds_file=CREDS_FILE_PATH):
+    """Returns login(driver) -> bool for a login mode.
+
+    Modes: 'auto' (SSO with creds.txt), 'prompt' (log in by hand, then press
+    Enter) and 'detect' (log in by hand; the greeting is detected). Returns
+    None if 'auto' has no credentials.
+    """
+    if mode == "auto":
+        email, password = read_creds(creds_file)
+        if not email or not password:
+            logging.error("Email or password not found in creds.txt.")
+            return None
+        return lambda driver: auto_login(driver, email, password)
+    if mode == "prompt":
+        return prompt_login
+    if mode == "detect":
+        return detect_login
+    raise ValueError(f"Unknown login mode '{mode}'")
+
+
+def open_browser(login, start_browser=start_chrome):
+    """Starts a recycling browser and logs it in. Returns None if the login fails."""
+    from browser_recycler import RecyclingDriver
+    driver = RecyclingDriver(start_browser, login=login)
+    if not login(driver):
+        driver.quit()
+        return None
+    return driver
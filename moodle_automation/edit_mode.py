@@ -0,0 +1,92 @@
+import logging
+import urllib.parse
+from selenium.webdriver.common.by import By
+from moodle_automation.browser import MOODLE_URL
+from moodle_automation.timeouts import AdaptiveWait
+
+# Moodle stores edit mode as a user preference for the whole session, so once
+# it has been switched on for a browser session it stays on for every course.
+# Sessions are keyed by the WebDriver session id.
+_EDIT_MODE_SESSIONS = set()
+
+
+def page_is_editing(driver):
+    """Returns True if the current page is rendered in edit mode."""
+    try:
+        return bool(driver.execute_script(
+            "return document.body.classList.contains('editing');"))
+    except Exception as e:
+        logging.warning(f"Could not read edit mode state from page: {e}")
+        return False
+
+
+def enable_edit_mode_via_endpoint(driver):
+    """Turns edit mode on through Moodle's editmode.php and returns to the current page."""
+    try:
+        page = driver.execute_script(
+            "return {sesskey: M.cfg.sesskey, context: M.cfg.contextid};")
+        params = urllib.parse.urlencode({
+            "setmode": 1,
+            "sesskey": page["sesskey"],
+            "context": page["context"],
+            "pageurl": driver.current_url,
+        })
+        driver.get(f"{MOODLE_URL}/editmode.php?{params}")
+        return page_is_editing(driver)
+    except Exception as e:
+        logging.warning(f"editmode.php request failed - Error: {e}")
+        return False
+
+
+def enable_edit_mode_via_toggle(driver):
+    """Turns edit mode on by clicking the 'setmode' toggle on the current page."""
+    try:
+        checkboxes = driver.find_elements(
+            By.CSS_SELECTOR, "input[name='setmode']")
+        if not checkboxes:
+            logging.warning("Edit mode toggle not found on page.")
+            return False
+        if not checkboxes[0].is_selected():
+            driver.execute_script("arguments[0].click();", checkboxes[0])
+            # The toggle reloads the page; it has only worked once the page renders in edit mode
+            AdaptiveWait(driver, 10, key="edit_mode.toggle").until(page_is_editing)
+        return page_is_editing(driver)
+    except Exception as e:
+        logging.warning(f"Edit mode toggle failed - Error: {e}")
+        return False
+
+
+def ensure_edit_mode(driver):
+    """Makes sure the current course page is in edit mode.
+
+    The first call in a session switches edit mode on and remembers it. Later
+    calls only confirm the page still shows edit mode and repair it if lost.
+    """
+    session = driver.session_id
+    if session in _EDIT_MODE_SESSIONS:
+        if page_is_editing(driver):
+            return True
+        logging.warning(
+            f"Edit mode was lost on {driver.current_url}. Re-enabling.")
+        print("Edit mode was lost. Re-enabling.")
+        _EDIT_MODE_SESSIONS.discard(session)
+
+    if page_is_editing(driver):
+        _EDIT_MODE_SESSIONS.add(session)
+        logging.info("Edit mode is already enabled.")
+        return True
+
+    if enable_edit_mode_via_endpoint(driver) or enable_edit_mode_via_toggle(driver):
+        _EDIT_MODE_SESSIONS.add(session)
+        logging.info("Edit mode enabled.")
+        print("Edit mode enabled.")
+        return True
+
+    logging.error(f"Failed to enable edit mode on {driver.current_url}")
+    print(f"Failed to enable edit mode on {driver.current_url}")
+    return False
+
+
+def forget_edit_mode(driver):
+    """Drops the remembered edit mode state, e.g. after the session is replaced."""
+    _EDIT_MODE_SESSIONS.discard(driver.session_id)
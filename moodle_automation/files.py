@@ -0,0 +1,69 @@
+import json
+import logging
+import os
+
+
+def read_file(file_path):
+    """Reads the content of a file, or None if it is missing."""
+    try:
+        with open(file_path, 'r', encoding='utf-8') as file:
+            return file.read().strip()
+    except FileNotFoundError:
+        logging.error(f"File '{file_path}' not found.")
+        return None
+
+
+def read_lines(file_path):
+    """Reads the non-empty lines of a file."""
+    try:
+        with open(file_path, 'r', encoding='utf-8') as file:
+            return [line.strip() for line in file if line.strip()]
+    except FileNotFoundError:
+        logging.error(f"File '{file_path}' not found.")
+        return []
+
+
+def read_json(file_path):
+    """Reads and parses a JSON file, or returns {} if it is missing or invalid."""
+    try:
+        with open(file_path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        logging.error(f"File '{file_path}' not found.")
+        return {}
+    except json.JSONDecodeError as e:
+        logging.error(f"Error parsing JSON file '{file_path}' - {e}")
+        return {}
+
+
+def get_attachments(attachments_dir):
+    """Returns the absolute paths of the files in a directory.
+
+    With MOODLE_OPTIMIZE set (--optimize), optimized cached copies are
+    returned instead; see moodle_automation.optimize.
+    """
+    try:
+        files = sorted(os.listdir(attachments_dir))
+    except FileNotFoundError:
+        logging.error(f"Folder '{attachments_dir}' not found.")
+        return []
+    if not files:
+        logging.info(f"No files found in '{attachments_dir}'.")
+        return []
+    logging.info(f"Files found in '{attachments_dir}': {files}")
+    from moodle_automation.optimize import maybe_optimize
+    return maybe_optimize([os.path.abspath(os.path.join(attachments_dir, f)) for f in files])
+
+
+def read_creds(file_path):
+    """Reads 'email:...' and 'password:...' lines and returns (email, password)."""
+    creds = {}
+    try:
+        with open(file_path, 'r', encoding='utf-8') as file:
+            for line in file:
+                if ':' in line:
+                    key, value = line.split(':', 1)
+                    creds[key.strip()] = value.strip()
+    except FileNotFoundError:
+        logging.error(f"Credentials file '{file_path}' not found.")
+    return creds.get('email'), creds.get('password')
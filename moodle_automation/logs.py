@@ -0,0 +1,12 @@
+import logging
+import os
+
+LOGS_PATH = "logs"
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+
+def setup_logging(file_name, log_format=LOG_FORMAT):
+    """Sends this run's log to logs/<file_name>. Called from main(), never at import."""
+    os.makedirs(LOGS_PATH, exist_ok=True)
+    logging.basicConfig(filename=os.path.join(LOGS_PATH, file_name), level=logging.INFO,
+                        format=log_format)
@@ -0,0 +1,293 @@
+import argparse
+import csv
+import hashlib
+import importlib
+import io
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+
+# Set MOODLE_OPTIMIZE=1 (or pass --optimize) to upload optimized copies of attachments.
+OPTIMIZE_ENV_VAR = "MOODLE_OPTIMIZE"
+CACHE_DIR = "attachment_cache"
+REPORT_PATH = os.path.join("logs", "attachment_optimization.csv")
+JPEG_QUALITY = 75
+MIN_IMAGE_BYTES = 32 * 1024   # Smaller embedded images are left alone
+MIN_SAVING = 0.02             # Keep the original unless the copy is at least 2% smaller
+UNCHANGED_MARKER = ".unchanged"
+OFFICE_EXTENSIONS = (".docx", ".pptx", ".xlsx")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+# Author fields of Office core properties, emptied when optimizing
+OFFICE_METADATA = re.compile(rb"<(dc:creator|cp:lastModifiedBy|cp:keywords|dc:description)>.*?</\1>", re.S)
+
+_lock = threading.Lock()
+_missing_warned = set()
+
+
+def enabled():
+    return bool(os.environ.get(OPTIMIZE_ENV_VAR))
+
+
+def _import_optional(name):
+    """Imports pikepdf or PIL, or returns None (warning once) if it is not installed."""
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        with _lock:
+            if name not in _missing_warned:
+                _missing_warned.add(name)
+                logging.warning(f"'{name}' is not installed; those attachments are uploaded unoptimized.")
+        return None
+
+
+def file_hash(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _recompress_image(data, image_format):
+    """Re-encodes JPEG or PNG bytes without EXIF and other metadata. Returns None if Pillow is missing."""
+    image_module = _import_optional("PIL.Image")
+    if image_module is None:
+        return None
+    with image_module.open(io.BytesIO(data)) as image:
+        output = io.BytesIO()
+        if image_format == "JPEG":
+            image.convert("RGB" if image.mode not in ("L", "RGB") else image.mode).save(
+                output, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+        else:
+            image.save(output, "PNG", optimize=True)
+    return output.getvalue()
+
+
+def _smaller(original, candidate):
+    return candidate is not None and len(candidate) < len(original) * (1 - MIN_SAVING)
+
+
+def optimize_pdf(source, target):
+    """Recompresses large 8-bit RGB and grey images as JPEG, drops the document info and XMP
+    metadata, and saves a linearized ('fast web view') file with compressed object streams."""
+    pikepdf = _import_optional("pikepdf")
+    if pikepdf is None:
+        return False
+    image_module = _import_optional("PIL.Image")
+    with pikepdf.open(source) as pdf:
+        if image_module is not None:
+            seen = set()
+            for page in pdf.pages:
+                for image in page.images.values():
+                    if image.objgen in seen:
+                        continue
+                    seen.add(image.objgen)
+                    _recompress_pdf_image(pikepdf, image)
+        for key in list(pdf.docinfo.keys()):
+            del pdf.docinfo[key]
+        if "/Metadata" in pdf.Root:
+            del pdf.Root.Metadata
+        pdf.save(target, linearize=True, compress_streams=True, recompress_flate=True,
+                 object_stream_mode=pikepdf.ObjectStreamMode.generate)
+    return True
+
+
+def _recompress_pdf_image(pikepdf, image):
+    # Masks, palettes, decode arrays and ICC colour spaces would change the picture; skip them
+    if (image.get("/BitsPerComponent") != 8 or "/SMask" in image or "/Mask" in image
+            or "/Decode" in image or image.get("/ColorSpace") not in ("/DeviceRGB", "/DeviceGray")):
+        return
+    raw = image.read_raw_bytes()
+    if len(raw) < MIN_IMAGE_BYTES:
+        return
+    try:
+        pil_image = pikepdf.PdfImage(image).as_pil_image()
+    except Exception as e:
+        logging.warning(f"Could not decode a PDF image - Error: {e}")
+        return
+    output = io.BytesIO()
+    pil_image.save(output, "JPEG", quality=JPEG_QUALITY, optimize=True)
+    if not _smaller(raw, output.getvalue()):
+        return
+    image.write(output.getvalue(), filter=pikepdf.Name.DCTDecode)
+    if "/DecodeParms" in image:
+        del image.DecodeParms
+
+
+def optimize_office(source, target):
+    """Rewrites a .docx/.pptx/.xlsx with maximum deflate, recompressed media and no author metadata."""
+    with zipfile.ZipFile(source) as archive, \
+            zipfile.ZipFile(target, "w", zipfile.ZIP_DEFLATED, compresslevel=9) as output:
+        for info in archive.infolist():
+            data = archive.read(info.filename)
+            name = info.filename.lower()
+            if name == "docprops/core.xml":
+                data = OFFICE_METADATA.sub(rb"<\1></\1>", data)
+            elif "/media/" in name and name.endswith(IMAGE_EXTENSIONS) and len(data) >= MIN_IMAGE_BYTES:
+                try:
+                    smaller = _recompress_image(data, "PNG" if name.endswith(".png") else "JPEG")
+                except Exception as e:
+                    logging.warning(f"Could not recompress '{info.filename}' - Error: {e}")
+                    smaller = None
+                if _smaller(data, smaller):
+                    data = smaller
+            # Entries are written in the original order; [Content_Types].xml stays first
+            output.writestr(info.filename, data)
+    return True
+
+
+def optimize_image(source, target):
+    with open(source, "rb") as file:
+        data = file.read()
+    smaller = _recompress_image(data, "PNG" if source.lower().endswith(".png") else "JPEG")
+    if smaller is None:
+        return False
+    with open(target, "wb") as file:
+        file.write(smaller)
+    return True
+
+
+def _optimizer(file_path):
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == ".pdf":
+        return optimize_pdf
+    if extension in OFFICE_EXTENSIONS:
+        return optimize_office
+    if extension in IMAGE_EXTENSIONS:
+        return optimize_image
+    return None
+
+
+def optimize_file(file_path, cache_dir=CACHE_DIR):
+    """Returns the path to upload for a file, and a report row.
+
+    The optimized copy is kept under `cache_dir`/<content hash>/ with the
+    original file name, so each file is processed once however many courses
+    or runs use it. Files that do not get smaller are uploaded as they are.
+    """
+    optimizer = _optimizer(file_path)
+    original_size = os.path.getsize(file_path)
+    row = {"file": os.path.basename(file_path), "original_bytes": original_size,
+           "optimized_bytes": original_size, "cached": False, "processed": False, "seconds": 0}
+    if optimizer is None:
+        return file_path, row
+
+    entry_dir = os.path.abspath(os.path.join(cache_dir, file_hash(file_path)))
+    cached_path = os.path.join(entry_dir, os.path.basename(file_path))
+    if os.path.exists(cached_path):
+        row.update(optimized_bytes=os.path.getsize(cached_path), cached=True)
+        return cached_path, row
+    if os.path.exists(os.path.join(entry_dir, UNCHANGED_MARKER)):
+        row["cached"] = True
+        return file_path, row
+
+    start_time = time.time()
+    os.makedirs(entry_dir, exist_ok=True)
+    # Work on a temporary file so concurrent workers never upload a half-written copy
+    handle, temp_path = tempfile.mkstemp(dir=entry_dir, suffix=os.path.splitext(file_path)[1])
+    os.close(handle)
+    try:
+        done = optimizer(file_path, temp_path)
+        if not done:
+            return file_path, row
+        optimized_size = os.path.getsize(temp_path)
+        row.update(processed=True, seconds=round(time.time() - start_time, 2))
+        if optimized_size >= original_size * (1 - MIN_SAVING):
+            open(os.path.join(entry_dir, UNCHANGED_MARKER), "w").close()
+            return file_path, row
+        os.replace(temp_path, cached_path)
+        row["optimized_bytes"] = optimized_size
+        return cached_path, row
+    except Exception as e:
+        logging.error(f"Could not optimize '{file_path}', uploading the original - Error: {e}")
+        return file_path, row
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def write_report(rows, report_path=REPORT_PATH):
+    """Appends newly optimized files to the CSV report."""
+    rows = [row for row in rows if row["processed"]]
+    if not rows:
+        return
+    os.makedirs(os.path.dirname(report_path), exist_ok=True)
+    with _lock:
+        is_new = not os.path.exists(report_path)
+        with open(report_path, "a", encoding="utf-8", newline="") as file:
+            writer = csv.writer(file)
+            if is_new:
+                writer.writerow(["date", "file", "original_bytes", "optimized_bytes", "saved_bytes", "seconds"])
+            for row in rows:
+                writer.writerow([time.strftime("%Y-%m-%d %H:%M:%S"), row["file"], row["original_bytes"],
+                                 row["optimized_bytes"], row["original_bytes"] - row["optimized_bytes"],
+                                 row["seconds"]])
+
+
+def summary_line(rows):
+    original = sum(row["original_bytes"] for row in rows)
+    optimized = sum(row["optimized_bytes"] for row in rows)
+    cached = sum(1 for row in rows if row["cached"])
+    return (f"Attachments: {len(rows)} file(s), {original / 1e6:.2f} MB -> {optimized / 1e6:.2f} MB"
+            f" (saved {(original - optimized) / 1e6:.2f} MB per upload, {cached} from cache)")
+
+
+def optimize_files(paths, cache_dir=CACHE_DIR):
+    """Swaps each attachment for its optimized copy. Prints the bytes saved when new files were processed."""
+    optimized, rows = [], []
+    for file_path in paths:
+        path, row = optimize_file(file_path, cache_dir)
+        optimized.append(path)
+        rows.append(row)
+        logging.info(f"Attachment '{row['file']}': {row['original_bytes']} -> {row['optimized_bytes']} bytes"
+                     f"{' (cached)' if row['cached'] else ''}")
+    if rows:
+        write_report(rows)
+        line = summary_line(rows)
+        logging.info(line)
+        if any(row["processed"] for row in rows):
+            print(line)
+    return optimized
+
+
+def maybe_optimize(paths):
+    """Optimizes the attachments if the MOODLE_OPTIMIZE environment variable is set."""
+    return optimize_files(paths) if enabled() and paths else paths
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Optimize attachment folders ahead of an upload and show the bytes saved.")
+    parser.add_argument("folders", nargs="*", default=["section/content", "input/attachments",
+                                                        "assignments/attachments"])
+    parser.add_argument("--clear", action="store_true", help=f"delete {CACHE_DIR}/ first")
+    args = parser.parse_args()
+    from moodle_automation.logs import setup_logging
+
+    setup_logging("optimize_log.txt")
+    if args.clear:
+        shutil.rmtree(CACHE_DIR, ignore_errors=True)
+    rows = []
+    for folder in args.folders:
+        if not os.path.isdir(folder):
+            print(f"Folder '{folder}' not found.")
+            continue
+        for name in sorted(os.listdir(folder)):
+            file_path = os.path.abspath(os.path.join(folder, name))
+            path, row = optimize_file(file_path)
+            rows.append(row)
+            saved = row["original_bytes"] - row["optimized_bytes"]
+            print(f"{row['file'][:50]:<50} {row['original_bytes']:>11} {row['optimized_bytes']:>11}"
+                  f" {saved / max(row['original_bytes'], 1):>6.1%}{'  cached' if row['cached'] else ''}")
+    write_report(rows)
+    if rows:
+        print(summary_line(rows))
+
+
+if __name__ == "__main__":
+    main()
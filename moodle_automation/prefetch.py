@@ -0,0 +1,121 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+PAGE_LOAD_TIMEOUT = 60
+
+# Session id -> URL of the prefetched tab the runner just switched to. The
+# next open_page() for that URL uses it instead of loading the page again.
+_prefetched = {}
+
+
+def open_page(driver, url, settle=3):
+    """Loads a page and waits `settle` seconds, unless a prefetched tab already shows it.
+
+    Only the first call after a switch is served from the prefetched tab, so
+    retries that reopen the page still get a fresh load.
+    """
+    if _prefetched.pop(driver.session_id, None) == url and driver.current_url == url:
+        logging.info(f"Using prefetched page: {url}")
+        return False
+    driver.get(url)
+    time.sleep(settle)
+    return True
+
+
+class Prefetcher:
+    """Loads the next course's page while the current course is being worked on.
+
+    In 'tab' mode the page is opened in a background tab with window.open(),
+    which returns at once; the runner switches to that tab for the next
+    course. In 'http' mode the page is only requested over a requests session
+    sharing the browser's cookies, which warms Moodle's course caches without
+    opening a tab (for tasks that type into the focused window).
+    """
+
+    def __init__(self, driver, mode="tab"):
+        self.driver = driver
+        self.mode = mode
+        self.handle = None
+        self.url = None
+        self._session = None
+        self._executor = ThreadPoolExecutor(max_workers=1) if mode == "http" else None
+
+    def advance(self, current_url, next_url):
+        """Switches to the tab prefetched for `current_url`, then starts loading `next_url`."""
+        if self.mode == "tab":
+            self._switch(current_url)
+        if next_url is not None:
+            self._start(next_url)
+
+    def _start(self, url):
+        try:
+            if self.mode == "http":
+                if self._session is None:
+                    from moodle_http import session_from_driver
+                    self._session = session_from_driver(self.driver, pool_size=1)
+                self._executor.submit(self._warm, url)
+                return
+            before = set(self.driver.window_handles)
+            self.driver.execute_script("window.open(arguments[0], '_blank');", url)
+            opened = set(self.driver.window_handles) - before
+            self.handle = opened.pop() if opened else None
+            self.url = url
+        except Exception as e:
+            logging.warning(f"Could not prefetch {url} - Error: {e}")
+
+    def _warm(self, url):
+        try:
+            self._session.get(url, timeout=PAGE_LOAD_TIMEOUT)
+        except Exception as e:
+            logging.warning(f"Could not warm {url} over HTTP - Error: {e}")
+
+    def _switch(self, url):
+        handle, self.handle = self.handle, None
+        if handle is None:
+            return False
+        driver = self.driver
+        current = None
+        try:
+            # The browser may have been recycled since the tab was opened
+            if handle not in driver.window_handles:
+                return False
+            current = driver.current_window_handle
+            if self.url != url:
+                driver.switch_to.window(handle)
+                driver.close()
+                driver.switch_to.window(current)
+                return False
+            driver.close()
+            driver.switch_to.window(handle)
+            current = handle
+            start_time = time.time()
+            while driver.execute_script("return document.readyState") != "complete":
+                if time.time() - start_time > PAGE_LOAD_TIMEOUT:
+                    raise TimeoutError(f"Prefetched page did not finish loading: {url}")
+                time.sleep(0.2)
+            _prefetched[driver.session_id] = url
+            return True
+        except Exception as e:
+            logging.warning(f"Could not switch to the prefetched tab for {url} - Error: {e}")
+            try:
+                driver.switch_to.window(current or driver.window_handles[-1])
+            except Exception:
+                pass
+            return False
+
+    def close(self):
+        """Closes a tab that was prefetched but not used, and stops HTTP warming."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        if self.handle is None:
+            return
+        try:
+            current = self.driver.current_window_handle
+            if self.handle in self.driver.window_handles:
+                self.driver.switch_to.window(self.handle)
+                self.driver.close()
+                self.driver.switch_to.window(current)
+        except Exception as e:
+            logging.warning(f"Could not close the prefetched tab - Error: {e}")
+        self.handle = None
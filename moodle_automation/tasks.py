@@ -0,0 +1,182 @@
+import argparse
+import importlib
+import logging
+import os
+from moodle_automation.logs import setup_logging
+
+# Task name -> module that defines it. Modules are imported only when their task is used.
+TASK_MODULES = {
+    "announce": "announcer",
+    "upload_section": "section_uploader",
+    "post_assignment": "assignment_poster",
+    "gradebook_setup": "grade_book_setup",
+    "gradebook_reset": "grade_book_reset",
+    "gradebook_modify": "gradebook_modifier",
+}
+
+TASKS = {}
+
+
+class Task:
+    """A per-course automation that the shared runner drives.
+
+    Subclasses set the class attributes and implement load_inputs() and
+    run_course(). Everything else (logging, login, browser recycling,
+    retries, sharding and the end-of-run summary) is done by run_task().
+
+    - name: key in TASK_MODULES
+    - log_file: file name under logs/
+    - login: 'auto', 'prompt' or 'detect' (see browser.login_function)
+    - target_kind: what its targets are, for course_catalog.resolve_targets()
+    - shard_function: module-level function(driver, course_url, *shard_args(inputs),
+      retries=...) that worker processes can run for --jobs, or None
+    - http_function: module-level function(client, *http_args(inputs)) that does
+      the same work with a gradebook_http.GradebookClient for --http, or None
+
+    With --prefetch, page_url() of the next target is loaded while the current
+    one runs; the task's page loaders use open_page() to pick it up.
+    """
+
+    name = None
+    description = ""
+    log_file = None
+    login = "auto"
+    target_kind = "course"
+    shard_function = None
+    http_function = None
+
+    def add_arguments(self, parser):
+        """Adds task-specific command-line options."""
+
+    def load_inputs(self, args):
+        """Reads the input files. Returns a dict with a 'targets' list, or None if anything is missing."""
+        raise NotImplementedError
+
+    def run_course(self, driver, target, inputs, retries):
+        """Runs the task on one target, putting failed steps on `retries`."""
+        raise NotImplementedError
+
+    def shard_args(self, inputs):
+        return ()
+
+    def http_args(self, inputs):
+        return self.shard_args(inputs)
+
+    def page_url(self, target):
+        """The page a target's work starts on, loaded ahead of time with --prefetch."""
+        return target
+
+    def prefetch_mode(self, inputs):
+        """'tab' to load the next page in a background tab, 'http' to only warm it over HTTP."""
+        return "tab"
+
+
+def register_task(cls):
+    """Class decorator that makes a task available to load_task() and the daemon-style runners."""
+    TASKS[cls.name] = cls()
+    return cls
+
+
+def load_task(name):
+    """Returns the registered task, importing its module on first use."""
+    if name not in TASKS:
+        if name not in TASK_MODULES:
+            raise ValueError(f"Unknown task '{name}'")
+        importlib.import_module(TASK_MODULES[name])
+    return TASKS[name]
+
+
+def run_task(task, argv=None):
+    """Runs a task over all its targets in one logged-in browser, or across --jobs workers."""
+    from browser_recycler import course_done
+    from course_shards import add_shard_arguments, print_result_table, run_sharded
+    from gradebook_http import HTTP_WORKERS, run_http
+    from moodle_automation.browser import login_function, open_browser
+    from moodle_automation.optimize import OPTIMIZE_ENV_VAR
+    from moodle_automation.prefetch import Prefetcher
+    from progress_dashboard import Dashboard, emit, stop_dashboard
+    from retry_queue import RetryQueue
+
+    setup_logging(task.log_file)
+    parser = argparse.ArgumentParser(description=task.description)
+    if task.shard_function:
+        add_shard_arguments(parser)
+    if task.http_function:
+        parser.add_argument("--http", action="store_true",
+                            help="make the changes over HTTP, without a browser")
+        parser.add_argument("--workers", type=int, default=HTTP_WORKERS,
+                            help="courses handled at the same time with --http, each worker with its own login")
+    parser.add_argument("--prefetch", action="store_true",
+                        help="load the next course's page while the current one is being worked on")
+    parser.add_argument("--dashboard", action="store_true",
+                        help="show live progress: course status, current step, courses/minute and ETA")
+    parser.add_argument("--optimize", action="store_true",
+                        help="upload compressed copies of PDFs, Office files and images, without metadata")
+    task.add_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.optimize:
+        # Set in the environment so --jobs workers optimize (from the shared cache) too
+        os.environ[OPTIMIZE_ENV_VAR] = "1"
+
+    inputs = task.load_inputs(args)
+    if not inputs or not inputs.get("targets"):
+        logging.error("Missing required data. Please check your input files.")
+        print("Missing required data. Please check your input files.")
+        return
+
+    if task.http_function and args.http:
+        if args.dashboard:
+            Dashboard(inputs["targets"]).start()
+        try:
+            run_http(TASK_MODULES[task.name], task.http_function, inputs["targets"],
+                     task.http_args(inputs), args.workers)
+        finally:
+            stop_dashboard()
+        logging.info("Script completed.")
+        print("Script completed.")
+        return
+
+    login = login_function(task.login)
+    if login is None:
+        print("Credentials not found. Exiting...")
+        return
+    driver = open_browser(login)
+    if driver is None:
+        logging.error("Exiting script due to failed login.")
+        print("Login failed. Exiting...")
+        return
+
+    if args.dashboard:
+        Dashboard(inputs["targets"]).start()
+    try:
+        if task.shard_function and args.jobs > 1:
+            results = run_sharded(driver, inputs["targets"], TASK_MODULES[task.name],
+                                  task.shard_function, task.shard_args(inputs),
+                                  args.jobs, args.deterministic)
+            print_result_table(results)
+        else:
+            retries = RetryQueue(driver, relogin=lambda: login(driver))
+            targets = inputs["targets"]
+            prefetcher = Prefetcher(driver, task.prefetch_mode(inputs)) if args.prefetch else None
+            for index, target in enumerate(targets):
+                if prefetcher is not None:
+                    next_target = targets[index + 1] if index + 1 < len(targets) else None
+                    prefetcher.advance(task.page_url(target),
+                                       next_target and task.page_url(next_target))
+                emit("course_start", target)
+                task.run_course(driver, target, inputs, retries)
+                course_done(driver, target)
+                emit("course_end", target, value=retries.course_status(target))
+            if prefetcher is not None:
+                prefetcher.close()
+            deferred_courses = dict.fromkeys(entry["course"] for entry in retries.deferred)
+            retries.retry_deferred()
+            for target in deferred_courses:
+                emit("course_end", target, value=retries.course_status(target))
+            retries.summary()
+            driver.memory_report()
+    finally:
+        stop_dashboard()
+        driver.quit()
+        logging.info("Browser closed. Script completed.")
+        print("Browser closed. Script completed.")
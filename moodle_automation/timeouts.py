@@ -0,0 +1,126 @@
+import atexit
+import json
+import logging
+import math
+import os
+import sys
+import threading
+import time
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.support.ui import WebDriverWait
+
+HISTORY_PATH = os.path.join("logs", "latency_history.json")
+MAX_SAMPLES = 500     # Most recent samples kept per wait
+MIN_SAMPLES = 20      # Below this the hard-coded default is used
+PERCENTILE = 99
+MARGIN = 1.5
+MIN_TIMEOUT = 2       # Seconds
+CEILING_FACTOR = 4    # A wait never gets more than 4x its hard-coded default
+SIZE_UNIT_BYTES = 5 * 1024 * 1024  # Upload waits are learned per 5 MB
+
+_history = None  # Wait key -> samples from earlier runs
+_new_samples = {}  # Wait key -> samples from this run, not saved yet
+_lock = threading.Lock()
+
+
+def _wait_key(frame):
+    """Names a wait without a key after its function. Line numbers would change with every edit."""
+    module = os.path.splitext(os.path.basename(frame.f_code.co_filename))[0]
+    return f"{module}.{frame.f_code.co_name}"
+
+
+def _load_history():
+    global _history
+    if _history is None:
+        try:
+            with open(HISTORY_PATH, "r", encoding="utf-8") as f:
+                _history = json.load(f)
+        except (OSError, ValueError):
+            _history = {}
+    return _history
+
+
+def _percentile(samples, percentile):
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(len(ordered) * percentile / 100) - 1)]
+
+
+def _size_units(size_bytes):
+    return max(size_bytes / SIZE_UNIT_BYTES, 1) if size_bytes else 1
+
+
+def step_timeout(key, default, size_bytes=0):
+    """Returns the timeout for a wait: p99 of its history x MARGIN, clamped.
+
+    Until MIN_SAMPLES are recorded the default is used. For uploads pass
+    `size_bytes`; the history is then kept in seconds per 5 MB and the
+    timeout grows with the file.
+    """
+    with _lock:
+        samples = _load_history().get(key, []) + _new_samples.get(key, [])
+    if len(samples) < MIN_SAMPLES:
+        per_unit = default
+    else:
+        per_unit = min(max(_percentile(samples, PERCENTILE) * MARGIN, MIN_TIMEOUT),
+                       default * CEILING_FACTOR)
+    return per_unit * _size_units(size_bytes)
+
+
+def record_latency(key, seconds, size_bytes=0):
+    with _lock:
+        if not _new_samples:
+            atexit.register(save_history)
+        _new_samples.setdefault(key, []).append(round(seconds / _size_units(size_bytes), 3))
+
+
+def save_history(path=HISTORY_PATH):
+    """Merges this run's samples into the history file. Safe to call more than once."""
+    global _history
+    with _lock:
+        if not _new_samples:
+            return
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                history = json.load(f)
+        except (OSError, ValueError):
+            history = {}
+        # Other processes may have saved since this one started, so merge into the file's copy
+        for key, samples in _new_samples.items():
+            history[key] = (history.get(key, []) + samples)[-MAX_SAMPLES:]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(history, f)
+        os.replace(temp_path, path)
+        _history = history
+        _new_samples.clear()
+    logging.info(f"Saved wait latency history to {path}")
+
+
+class AdaptiveWait:
+    """WebDriverWait whose timeout is learned from how long this wait took before.
+
+    Used like WebDriverWait: AdaptiveWait(driver, 10, key="module.step").until(condition).
+    The number is the default until enough history exists and caps the learned
+    timeout at CEILING_FACTOR times it. The key names the wait's history;
+    without one it is the calling function, so give every wait in a function
+    with several waits its own key. A wait that times out is recorded at
+    its timeout, so if more than 1% of waits time out (as at peak hours) the
+    next timeouts grow; a single dead step does not move them.
+    """
+
+    def __init__(self, driver, default, size_bytes=0, key=None):
+        self.driver = driver
+        self.key = key or _wait_key(sys._getframe(1))
+        self.size_bytes = size_bytes
+        self.timeout = step_timeout(self.key, default, size_bytes)
+
+    def until(self, condition):
+        start_time = time.time()
+        try:
+            result = WebDriverWait(self.driver, self.timeout).until(condition)
+        except TimeoutException:
+            record_latency(self.key, self.timeout, self.size_bytes)
+            raise
+        record_latency(self.key, time.time() - start_time, self.size_bytes)
+        return result
@@ -0,0 +1,89 @@
+import logging
+import queue
+import re
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from moodle_automation import CREDS_FILE_PATH
+
+POOL_SIZE = 16
+
+
+def session_from_cookies(cookies, pool_size=POOL_SIZE):
+    """Builds a keep-alive requests session carrying the browser's Moodle cookies."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    for cookie in cookies:
+        session.cookies.set(cookie["name"], cookie["value"],
+                            domain=cookie.get("domain"), path=cookie.get("path", "/"))
+    return session
+
+
+def session_from_driver(driver, pool_size=POOL_SIZE):
+    return session_from_cookies(driver.get_cookies(), pool_size)
+
+
+def login_session(creds_file=CREDS_FILE_PATH, pool_size=POOL_SIZE):
+    """Logs in once in a browser, hands the session cookies to requests and closes the browser."""
+    from moodle_automation import auto_login, read_creds, start_chrome
+
+    email, password = read_creds(creds_file)
+    if not email or not password:
+        logging.error("Missing credentials.")
+        return None
+    driver = start_chrome()
+    try:
+        if not auto_login(driver, email, password):
+            return None
+        return session_from_driver(driver, pool_size)
+    finally:
+        driver.quit()
+
+
+def login_sessions(count, creds_file=CREDS_FILE_PATH, pool_size=POOL_SIZE):
+    """Logs in `count` separate Moodle sessions, in parallel browsers. Returns those that logged in.
+
+    Moodle holds a lock on the session for most of every request, so
+    requests sharing one MoodleSession cookie run one at a time however
+    many threads send them. Concurrent workers each need their own session;
+    see per_thread().
+    """
+    with ThreadPoolExecutor(max_workers=count) as executor:
+        sessions = list(executor.map(lambda _: login_session(creds_file, pool_size), range(count)))
+    return [session for session in sessions if session is not None]
+
+
+def per_thread(items):
+    """Returns a function giving each calling thread its own one of `items`, the same one on every call.
+
+    Meant for a thread pool of at most len(items) workers.
+    """
+    free = queue.Queue()
+    for item in items:
+        free.put(item)
+    local = threading.local()
+
+    def current():
+        if not hasattr(local, "item"):
+            local.item = free.get_nowait()
+        return local.item
+    return current
+
+
+def find_sesskey(html):
+    """Returns the sesskey embedded in a Moodle page (M.cfg), or None."""
+    match = re.search(r'"sesskey":"([^"]+)"', html)
+    return match.group(1) if match else None
+
+
+def is_login_page(response):
+    """True if Moodle redirected the request to a login page (session expired)."""
+    return "/login/" in response.url or "login.microsoftonline.com" in response.url
+
+
+def course_id_from_url(url):
+    match = re.search(r"[?&]id=(\d+)", url)
+    return int(match.group(1)) if match else None
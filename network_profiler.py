@@ -0,0 +1,311 @@
+import atexit
+import itertools
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+
+# Set MOODLE_NETPROFILE=1 to record Chrome's network and page-load events for every page and save.
+NETPROFILE_ENV_VAR = "MOODLE_NETPROFILE"
+RUN_ID = time.strftime("%Y%m%d-%H%M%S")
+HAR_OUTPUT_PATH = os.path.join("logs", f"network_{RUN_ID}.har.json")
+SUMMARY_OUTPUT_PATH = os.path.join("logs", f"network_{RUN_ID}_summary.txt")
+MOODLE_HOST = "moodle.nu.edu.eg"
+TOP_N = 20
+
+_lock = threading.Lock()
+_entries = []  # Finished requests, HAR entry dicts
+_pages = []    # Top-level navigations, HAR page dicts
+_page_ids = itertools.count(1)
+_report_registered = False
+
+
+def enabled():
+    return bool(os.environ.get(NETPROFILE_ENV_VAR))
+
+
+def chrome_options(options=None):
+    """Routes CDP network and page events to the performance log when profiling is on."""
+    if not enabled():
+        return options
+    if options is None:
+        from selenium.webdriver.chrome.options import Options
+        options = Options()
+    options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    return options
+
+
+def endpoint(url):
+    """Groups a URL by Moodle script (course/view.php, lib/ajax/service.php...) or by host."""
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https"):
+        return parsed.scheme or "other"
+    if parsed.hostname != MOODLE_HOST:
+        return parsed.hostname or "other"
+    path = parsed.path.lstrip("/")
+    # Theme and JS bundles put their arguments after the script (styles.php/boost/123/all)
+    match = re.match(r"(.*?\.php)", path)
+    if match:
+        return match.group(1)
+    extension = os.path.splitext(path)[1]
+    return f"static {extension or '/'}"
+
+
+def _ms(value):
+    return round(value, 2) if value is not None and value >= 0 else -1
+
+
+def _har_timings(timing, finished):
+    """Splits a CDP ResourceTiming into HAR timings; `finished` is loadingFinished in seconds."""
+    if not timing:
+        return {"blocked": -1, "dns": -1, "connect": -1, "ssl": -1, "send": 0, "wait": 0, "receive": 0}
+
+    def span(start, end):
+        return timing[end] - timing[start] if timing.get(start, -1) >= 0 else -1
+
+    first = next((timing[key] for key in ("dnsStart", "connectStart", "sendStart")
+                  if timing.get(key, -1) >= 0), 0)
+    receive = -1
+    if finished is not None:
+        receive = finished * 1000 - (timing["requestTime"] * 1000 + timing["receiveHeadersEnd"])
+    return {
+        "blocked": _ms(first),
+        "dns": _ms(span("dnsStart", "dnsEnd")),
+        "connect": _ms(span("connectStart", "connectEnd")),
+        "ssl": _ms(span("sslStart", "sslEnd")),
+        "send": _ms(span("sendStart", "sendEnd")),
+        "wait": _ms(timing["receiveHeadersEnd"] - timing["sendEnd"]),
+        "receive": _ms(max(receive, 0) if finished is not None else -1),
+    }
+
+
+class NetworkRecorder:
+    """Turns one browser's performance log into HAR entries and page breakdowns.
+
+    A page is a main-frame document load. Its time is split into the redirect
+    chain (SSO hops), server TTFB, transfer of the HTML, script time
+    (document received to DOMContentLoaded: parsing and synchronous scripts)
+    and render time (DOMContentLoaded to load: stylesheets, images and
+    deferred work). XHR and fetch calls, such as modal saves, get TTFB and
+    transfer only.
+    """
+
+    def __init__(self):
+        self.requests = {}     # CDP requestId -> request in flight
+        self.main_frame = None
+        self.page = None       # Page whose load events are still pending
+
+    def handle(self, method, params):
+        if method == "Network.requestWillBeSent":
+            self._request_sent(params)
+        elif method == "Network.responseReceived":
+            request = self.requests.get(params["requestId"])
+            if request is not None:
+                request["response"] = params["response"]
+        elif method == "Network.loadingFinished":
+            self._finish(params["requestId"], params["timestamp"], params.get("encodedDataLength", 0))
+        elif method == "Network.loadingFailed":
+            self._finish(params["requestId"], params["timestamp"], 0, params.get("errorText"))
+        elif method == "Page.frameNavigated" and not params["frame"].get("parentId"):
+            self.main_frame = params["frame"]["id"]
+        elif method == "Page.domContentEventFired" and self.page is not None:
+            self.page["_dom_content_loaded"] = params["timestamp"]
+        elif method == "Page.loadEventFired" and self.page is not None:
+            self.page["_load"] = params["timestamp"]
+            self._close_page()
+
+    def _request_sent(self, params):
+        request_id = params["requestId"]
+        previous = self.requests.get(request_id)
+        redirected = previous is not None and bool(params.get("redirectResponse"))
+        if redirected:
+            # The same requestId continues after a redirect; keep the hop as its own entry
+            previous["response"] = params["redirectResponse"]
+            self._add_entry(previous, params["timestamp"], 0)
+        request = {
+            "id": request_id,
+            "url": params["request"]["url"],
+            "method": params["request"]["method"],
+            "type": params.get("type", "Other"),
+            "frame": params.get("frameId"),
+            "started": params["timestamp"],
+            "wall_time": params.get("wallTime", time.time()),
+            "response": None,
+        }
+        self.requests[request_id] = request
+        is_navigation = request["type"] == "Document" and request_id == params.get("loaderId")
+        if is_navigation and self.main_frame in (None, request["frame"]) and not redirected:
+            self._close_page()
+            self.page = {
+                "id": f"page_{next(_page_ids)}",
+                "startedDateTime": datetime.fromtimestamp(request["wall_time"], timezone.utc).isoformat(),
+                "title": request["url"],
+                "_request_id": request_id,
+                "_started": request["started"],
+                "_document": None,
+            }
+
+    def _finish(self, request_id, timestamp, size, error=None):
+        request = self.requests.pop(request_id, None)
+        if request is None:
+            return
+        entry = self._add_entry(request, timestamp, size, error)
+        if self.page is not None and self.page["_request_id"] == request_id:
+            self.page["_document"] = entry
+            self.page["_document_finished"] = timestamp
+            self.page["title"] = request["url"]
+
+    def _add_entry(self, request, timestamp, size, error=None):
+        response = request["response"] or {}
+        timings = _har_timings(response.get("timing"), timestamp)
+        entry = {
+            "pageref": self.page["id"] if self.page is not None else None,
+            "startedDateTime": datetime.fromtimestamp(request["wall_time"], timezone.utc).isoformat(),
+            "time": round((timestamp - request["started"]) * 1000, 2),
+            "request": {"method": request["method"], "url": request["url"]},
+            "response": {"status": response.get("status", 0), "mimeType": response.get("mimeType", ""),
+                         "bodySize": size, "fromCache": bool(response.get("fromDiskCache"))},
+            "timings": timings,
+            "_type": request["type"],
+            "_endpoint": endpoint(request["url"]),
+        }
+        if error:
+            entry["_error"] = error
+        with _lock:
+            _entries.append(entry)
+        return entry
+
+    def _close_page(self):
+        page, self.page = self.page, None
+        if page is None:
+            return
+        document = page.pop("_document")
+        started = page.pop("_started")
+        page.pop("_request_id")
+        finished = page.pop("_document_finished", None)
+        dom_content_loaded = page.pop("_dom_content_loaded", None)
+        load = page.pop("_load", None)
+        page["pageTimings"] = {
+            "onContentLoad": _ms((dom_content_loaded - started) * 1000) if dom_content_loaded else -1,
+            "onLoad": _ms((load - started) * 1000) if load else -1,
+        }
+        if document is not None:
+            with _lock:
+                hops = [entry for entry in _entries if entry["pageref"] == page["id"]
+                        and entry["_type"] == "Document" and 300 <= entry["response"]["status"] < 400]
+            page["_endpoint"] = document["_endpoint"]
+            page["_redirect"] = round(sum(entry["time"] for entry in hops), 2)
+            page["_ttfb"] = document["timings"]["wait"]
+            page["_transfer"] = document["timings"]["receive"]
+            page["_script"] = _ms((dom_content_loaded - finished) * 1000) if dom_content_loaded and finished else -1
+            page["_render"] = _ms((load - dom_content_loaded) * 1000) if load and dom_content_loaded else -1
+        with _lock:
+            _pages.append(page)
+
+    def flush(self):
+        """Closes the current page, e.g. before the browser quits."""
+        self._close_page()
+
+
+def profile_network(driver):
+    """Reads the performance log after every navigation and before the browser quits."""
+    global _report_registered
+    recorder = NetworkRecorder()
+    executor = driver.command_executor
+    original_execute = executor.execute
+
+    def drain():
+        # Calls the wrapped executor so the drain does not recurse into recording_execute. With
+        # MOODLE_PROFILE also set, that is the driver profiler's wrapper, so drains are counted there.
+        try:
+            response = original_execute("getLog", {"sessionId": driver.session_id, "type": "performance"})
+        except Exception as e:
+            logging.warning(f"Could not read the performance log - Error: {e}")
+            return
+        for log_entry in response.get("value") or []:
+            try:
+                message = json.loads(log_entry["message"])["message"]
+                recorder.handle(message["method"], message.get("params", {}))
+            except (KeyError, ValueError) as e:
+                logging.warning(f"Skipped a performance log entry - Error: {e}")
+
+    def recording_execute(command, params):
+        if command == "quit":
+            drain()
+            recorder.flush()
+        result = original_execute(command, params)
+        if command == "get":
+            drain()
+        return result
+
+    executor.execute = recording_execute
+    if not _report_registered:
+        atexit.register(report)
+        _report_registered = True
+    logging.info("Network profiling enabled.")
+    return driver
+
+
+def maybe_profile_network(driver):
+    """Turns on network profiling if the MOODLE_NETPROFILE environment variable is set."""
+    if enabled():
+        profile_network(driver)
+    return driver
+
+
+def _average(values):
+    values = [value for value in values if value >= 0]
+    return sum(values) / len(values) if values else 0
+
+
+def summary_lines(entries, pages, top_n=TOP_N):
+    by_endpoint = defaultdict(list)
+    for entry in entries:
+        by_endpoint[entry["_endpoint"]].append(entry)
+    pages_by_endpoint = defaultdict(list)
+    for page in pages:
+        if "_endpoint" in page:
+            pages_by_endpoint[page["_endpoint"]].append(page)
+
+    lines = [f"Requests: {len(entries)}, pages: {len(pages)}",
+             f"{'Endpoint':<45} {'Reqs':>6} {'Total s':>8} {'TTFB ms':>8} {'Xfer ms':>8}"
+             f" {'Pages':>6} {'Redir ms':>9} {'Script ms':>10} {'Render ms':>10}"]
+    ranked = sorted(by_endpoint.items(), key=lambda item: -sum(entry["time"] for entry in item[1]))
+    for name, group in ranked[:top_n]:
+        group_pages = pages_by_endpoint.get(name, [])
+        line = (f"{name[:45]:<45} {len(group):>6} {sum(entry['time'] for entry in group) / 1000:>8.2f}"
+                f" {_average([entry['timings']['wait'] for entry in group]):>8.1f}"
+                f" {_average([entry['timings']['receive'] for entry in group]):>8.1f}")
+        if group_pages:
+            line += (f" {len(group_pages):>6}"
+                     f" {_average([page['_redirect'] for page in group_pages]):>9.1f}"
+                     f" {_average([page['_script'] for page in group_pages]):>10.1f}"
+                     f" {_average([page['_render'] for page in group_pages]):>10.1f}")
+        lines.append(line)
+    return lines
+
+
+def report(top_n=TOP_N, har_path=HAR_OUTPUT_PATH, summary_path=SUMMARY_OUTPUT_PATH):
+    """Writes the run's HAR-like file and prints the per-endpoint breakdown."""
+    with _lock:
+        entries = list(_entries)
+        pages = list(_pages)
+    if not entries:
+        return
+
+    os.makedirs(os.path.dirname(har_path), exist_ok=True)
+    with open(har_path, 'w', encoding='utf-8') as file:
+        json.dump({"log": {"version": "1.2", "creator": {"name": "moodle-automation", "version": "1.0"},
+                           "pages": pages, "entries": entries}}, file, indent=1)
+
+    text = "\n".join(summary_lines(entries, pages, top_n))
+    print(text)
+    logging.info(f"Network profile:\n{text}")
+    with open(summary_path, 'w', encoding='utf-8') as file:
+        file.write(text + "\n")
+    print(f"Network events written to {har_path}.")
@@ -0,0 +1,153 @@
+import atexit
+import collections
+import logging
+import os
+import re
+import threading
+import time
+from moodle_http import course_id_from_url, is_login_page
+
+# Set MOODLE_PAGE_CACHE=0 to fetch every page from Moodle.
+PAGE_CACHE_ENV_VAR = "MOODLE_PAGE_CACHE"
+TTL_SECONDS = 120                 # How long a page without ETag/Last-Modified is reused
+MAX_BYTES = 64 * 1024 * 1024      # HTML kept across all entries; least recently used go first
+
+_lock = threading.Lock()
+_entries = collections.OrderedDict()  # (session key, url) -> entry dict, least recently used first
+_size = 0
+_stats = collections.Counter()
+_generation = 0        # Bumped by every invalidate()
+_invalidated_at = {}   # Course id or URL -> generation of its last invalidation
+_report_registered = False
+
+
+def enabled():
+    return os.environ.get(PAGE_CACHE_ENV_VAR, "1") != "0"
+
+
+def _session_key(session):
+    # Pages differ per user, and a new login is a new MoodleSession
+    try:
+        return session.cookies.get("MoodleSession") or id(session)
+    except Exception:
+        return id(session)
+
+
+def _parser_key(parse):
+    return "text" if parse is None else f"{parse.__module__}.{parse.__qualname__}"
+
+
+def _page_course_id(url, text):
+    # Forum and module pages are keyed by module id; the course id is in M.cfg
+    match = re.search(r'"courseId":(\d+)', text)
+    return int(match.group(1)) if match else course_id_from_url(url)
+
+
+def _store(key, entry):
+    global _size
+    old = _entries.pop(key, None)
+    if old is not None:
+        _size -= len(old["text"])
+    _entries[key] = entry
+    _size += len(entry["text"])
+    while _size > MAX_BYTES and len(_entries) > 1:
+        _, evicted = _entries.popitem(last=False)
+        _size -= len(evicted["text"])
+        _stats["evictions"] += 1
+
+
+def get_page(session, url, parse=None, timeout=60):
+    """Returns parse(page HTML), or the HTML itself, for a GET of `url`, reusing earlier fetches.
+
+    Pages with an ETag or Last-Modified header are revalidated with a
+    conditional request each time; others are reused for TTL_SECONDS.
+    Parsed results are kept too, so a page is parsed once per parser.
+    Treat them as read-only. Raises if the request fails or the session
+    has expired.
+    """
+    global _report_registered
+    if not _report_registered:
+        atexit.register(report)
+        _report_registered = True
+    if not enabled():
+        text = _get(session, url, {}, timeout).text
+        return text if parse is None else parse(text)
+
+    key = (_session_key(session), url)
+    name = _parser_key(parse)
+    with _lock:
+        generation = _generation
+        entry = _entries.get(key)
+        if entry is not None:
+            _entries.move_to_end(key)
+    if entry is not None and not entry["validators"] and time.time() - entry["fetched"] < TTL_SECONDS:
+        outcome = "hits"
+    elif entry is not None and entry["validators"]:
+        response = _get(session, url, entry["validators"], timeout)
+        outcome = "revalidated" if response.status_code == 304 else "misses"
+        if outcome == "misses":
+            entry = None
+    else:
+        response = _get(session, url, {}, timeout)
+        outcome = "misses"
+        entry = None
+
+    if entry is None:
+        validators = {}
+        if response.headers.get("ETag"):
+            validators["If-None-Match"] = response.headers["ETag"]
+        if response.headers.get("Last-Modified"):
+            validators["If-Modified-Since"] = response.headers["Last-Modified"]
+        entry = {"text": response.text, "validators": validators, "fetched": time.time(),
+                 "course_id": _page_course_id(url, response.text), "parsed": {}}
+    elif outcome == "revalidated":
+        entry["fetched"] = time.time()
+    if name not in entry["parsed"]:
+        entry["parsed"][name] = entry["text"] if parse is None else parse(entry["text"])
+    with _lock:
+        _stats[outcome] += 1
+        # A page fetched while we were changing its course may already be stale
+        if (outcome == "misses" and _invalidated_at.get(entry["course_id"], 0) <= generation
+                and _invalidated_at.get(url, 0) <= generation):
+            _store(key, entry)
+    return entry["parsed"][name]
+
+
+def _get(session, url, headers, timeout):
+    response = session.get(url, headers=headers, timeout=timeout)
+    if response.status_code != 304:
+        response.raise_for_status()
+    if is_login_page(response):
+        raise RuntimeError("Moodle session expired")
+    return response
+
+
+def invalidate(course_id=None, url=None):
+    """Drops the cached pages of a course (after changing it) or of one URL, for every session."""
+    global _generation, _size
+    with _lock:
+        _generation += 1
+        for target in (course_id, url):
+            if target is not None:
+                _invalidated_at[target] = _generation
+        for key in [key for key, entry in _entries.items()
+                    if (course_id is not None and entry["course_id"] == course_id) or key[1] == url]:
+            _size -= len(_entries.pop(key)["text"])
+            _stats["invalidated"] += 1
+
+
+def stats():
+    with _lock:
+        return dict(_stats)
+
+
+def report():
+    counts = stats()
+    lookups = counts.get("hits", 0) + counts.get("revalidated", 0) + counts.get("misses", 0)
+    if not lookups:
+        return
+    line = (f"Page cache: {counts.get('hits', 0)} hit(s), {counts.get('revalidated', 0)} revalidated,"
+            f" {counts.get('misses', 0)} miss(es), {counts.get('invalidated', 0)} invalidated,"
+            f" {counts.get('evictions', 0)} evicted")
+    logging.info(line)
+    print(line)
@@ -0,0 +1,247 @@
+import collections
+import logging
+import math
+import multiprocessing
+import os
+import queue
+import shutil
+import sys
+import threading
+import time
+
+# Seconds between redraws in a terminal, and between status lines when output is not a terminal.
+REFRESH_SECONDS = 1
+HEADLESS_INTERVAL = 30
+STALL_SECONDS = 180      # A course with no step event for this long is flagged
+STEP_WINDOW = 2000       # Latest step durations kept for the p95
+RECENT_COURSES = 5
+FINISHED = ("ok", "failed", "deferred")
+
+_sink = None      # Callable taking one event tuple, or None while no dashboard is running
+_worker = "main"
+_active = None    # The Dashboard of this process
+
+
+def emit(kind, course, step=None, value=None, worker=None):
+    """Sends a progress event. Costs one global check when no dashboard is running.
+
+    kind is 'course_start', 'step_start', 'step_end' (value: (seconds,
+    'ok' or 'failed')) or 'course_end' (value: the course's status).
+    """
+    if _sink is not None:
+        _sink((time.time(), worker if worker is not None else _worker, kind, course, step, value))
+
+
+def expect(count):
+    """Adds courses to the running dashboard's total, for runs that get their courses as they go."""
+    if _active is not None:
+        with _active.lock:
+            _active.total += count
+
+
+def worker_queue():
+    """Returns the queue worker processes send events to, or None without a dashboard."""
+    return _active.worker_queue() if _active is not None else None
+
+
+def attach_worker(events, worker_id):
+    """Sends this worker process's events to the parent's dashboard."""
+    global _sink, _worker
+    if events is None:
+        return
+    _worker = worker_id
+    _sink = events.put_nowait
+    # The parent redraws the dashboard; worker prints would tear it, and they are in the worker log anyway
+    sys.stdout = open(os.devnull, "w")
+
+
+def stop_dashboard():
+    """Stops this process's dashboard, if one is running."""
+    if _active is not None:
+        _active.stop()
+
+
+def _duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    return f"{seconds // 60}m{seconds % 60:02d}s"
+
+
+def _short(course, width):
+    return course if len(course) <= width else "..." + course[-(width - 3):]
+
+
+class _DashboardStdout:
+    """Stands in for sys.stdout so prints appear above the dashboard instead of through it."""
+
+    def __init__(self, dashboard, stream):
+        self._dashboard = dashboard
+        self._stream = stream
+
+    def write(self, text):
+        with self._dashboard.lock:
+            self._dashboard.clear()
+            return self._stream.write(text)
+
+    def flush(self):
+        self._stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+class Dashboard:
+    """A live view of a run: per-course status, current step, courses/minute, p95 step time,
+    errors and ETA.
+
+    Scripts only call emit(); events go into a deque (or, from --jobs workers,
+    a multiprocessing queue) and a background thread folds them in and
+    redraws. In a terminal the view is redrawn in place below the normal
+    output; otherwise a status line is printed every HEADLESS_INTERVAL seconds.
+    """
+
+    def __init__(self, targets, stream=None):
+        self.total = len(targets)
+        self.stream = stream or sys.stdout
+        self.interactive = self.stream.isatty()
+        self.lock = threading.RLock()
+        self.courses = {}  # course -> {"status", "worker", "step", "since"}
+        self.step_times = collections.deque(maxlen=STEP_WINDOW)
+        self.errors = 0
+        self.first_start = None
+        self.finished_order = collections.deque(maxlen=RECENT_COURSES)
+        self._events = collections.deque()
+        self._queue = None
+        self._drawn = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._stdout = None
+
+    def worker_queue(self):
+        if self._queue is None:
+            self._queue = multiprocessing.Queue()
+        return self._queue
+
+    def start(self):
+        global _sink, _active
+        _sink = self._events.append
+        _active = self
+        if self.interactive:
+            if os.name == "nt":
+                os.system("")  # Turns on ANSI escape codes in the Windows console
+            self._stdout = sys.stdout
+            sys.stdout = _DashboardStdout(self, self.stream)
+        self._thread = threading.Thread(target=self._loop, name="dashboard", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops redrawing and prints the final state once."""
+        global _sink, _active
+        _sink = None
+        _active = None
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._drain()
+        with self.lock:
+            self.clear()
+            if self._stdout is not None:
+                sys.stdout = self._stdout
+        text = "\n".join(self.lines())
+        print(text)
+        logging.info(f"Progress:\n{text}")
+
+    def _loop(self):
+        last_line = time.time()
+        while not self._stop.wait(REFRESH_SECONDS):
+            self._drain()
+            if self.interactive:
+                self.draw()
+            elif time.time() - last_line >= HEADLESS_INTERVAL:
+                last_line = time.time()
+                line = self.lines()[0]
+                self.stream.write(line + "\n")
+                self.stream.flush()
+                logging.info(line)
+
+    def _drain(self):
+        while self._events:
+            self.handle(self._events.popleft())
+        while self._queue is not None:
+            try:
+                self.handle(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+    def handle(self, event):
+        timestamp, worker, kind, course, step, value = event
+        row = self.courses.get(course)
+        if row is None:
+            row = self.courses[course] = {"status": "running", "worker": worker, "step": "",
+                                          "since": timestamp}
+        if kind == "course_start":
+            row.update(status="running", worker=worker, step="", since=timestamp)
+            if self.first_start is None:
+                self.first_start = timestamp
+        elif kind == "step_start":
+            row.update(step=step, since=timestamp)
+        elif kind == "step_end":
+            seconds, outcome = value
+            self.step_times.append(seconds)
+            row["since"] = timestamp
+            if outcome == "failed":
+                self.errors += 1
+                row["step"] = f"{step} (failed)"
+        elif kind == "course_end":
+            row.update(status=value, step="", since=timestamp)
+            if course in self.finished_order:
+                self.finished_order.remove(course)
+            self.finished_order.append(course)
+
+    def p95(self):
+        if not self.step_times:
+            return 0
+        ordered = sorted(self.step_times)
+        return ordered[max(0, math.ceil(len(ordered) * 0.95) - 1)]
+
+    def lines(self):
+        now = time.time()
+        counts = collections.Counter(row["status"] for row in self.courses.values())
+        done = sum(counts[status] for status in FINISHED)
+        elapsed = now - self.first_start if self.first_start else 0
+        rate = done / (elapsed / 60) if elapsed > 0 else 0
+        eta = _duration((self.total - done) / rate * 60) if rate and done < self.total else "-"
+        lines = [f"Courses {done}/{self.total} ({counts['ok']} ok, {counts['failed']} failed,"
+                 f" {counts['deferred']} deferred, {counts['running']} running) | {rate:.1f} courses/min"
+                 f" | ETA {eta} | p95 step {self.p95():.1f} s | errors {self.errors}"
+                 f" | elapsed {_duration(elapsed)}"]
+        width = shutil.get_terminal_size((120, 24)).columns
+        course_width = max(20, min(60, width - 50))
+        running = [(course, row) for course, row in self.courses.items() if row["status"] == "running"]
+        if running:
+            lines.append(f"{'Worker':<8} {'Course':<{course_width}} {'Step':<28} {'For':>7}")
+        for course, row in running:
+            idle = now - row["since"]
+            lines.append(f"{row['worker']!s:<8} {_short(course, course_width):<{course_width}}"
+                         f" {row['step'][:28]:<28} {idle:>6.0f}s{'  STALLED?' if idle > STALL_SECONDS else ''}")
+        for course in self.finished_order:
+            row = self.courses[course]
+            if row["status"] in FINISHED:
+                lines.append(f"{row['worker']!s:<8} {_short(course, course_width):<{course_width}} {row['status']}")
+        return [line[:width - 1] if self.interactive else line for line in lines]
+
+    def clear(self):
+        """Erases the drawn dashboard. Call with the lock held."""
+        if self._drawn:
+            self.stream.write(f"\x1b[{self._drawn}F\x1b[J")
+            self._drawn = 0
+
+    def draw(self):
+        lines = self.lines()
+        with self.lock:
+            self.clear()
+            self.stream.write("\n".join(lines) + "\n")
+            self.stream.flush()
+            self._drawn = len(lines)
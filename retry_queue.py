@@ -0,0 +1,195 @@
+import logging
+import time
+from selenium.common.exceptions import (
+    InvalidSessionIdException,
+    NoSuchWindowException,
+    StaleElementReferenceException,
+    TimeoutException,
+)
+from failure_snapshots import dump_failure, record_step
+from progress_dashboard import emit
+
+TRANSIENT = "transient timeout"
+STALE = "stale element"
+SESSION = "session expired"
+PERMANENT = "permanent"
+
+
+class StepValidationError(Exception):
+    """Raised by a step when retrying it cannot help (bad input, missing item, ...)."""
+
+
+def classify_failure(error, driver=None):
+    """Sorts a step failure into one of the retry classes."""
+    if isinstance(error, StepValidationError):
+        return PERMANENT
+    if isinstance(error, (InvalidSessionIdException, NoSuchWindowException)):
+        return SESSION
+    if driver is not None:
+        try:
+            url = driver.current_url
+        except Exception:
+            return SESSION
+        # Moodle sends expired sessions back through the SSO login page
+        if "login" in url:
+            return SESSION
+    if isinstance(error, StaleElementReferenceException):
+        return STALE
+    if isinstance(error, (TimeoutException, TimeoutError)):
+        return TRANSIENT
+    if isinstance(error, (ValueError, KeyError, TypeError)):
+        return PERMANENT
+    return TRANSIENT
+
+
+class RetryQueue:
+    """Collects failed course steps during a run and retries them at the end.
+
+    A step is a function that raises on failure. `prepare` is called before
+    every retry to bring the browser back to the page the step expects.
+    """
+
+    def __init__(self, driver=None, relogin=None, max_attempts=3, base_delay=2):
+        self.driver = driver
+        self.relogin = relogin
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.deferred = []
+        self.failed = []
+        self.relogged_in = False
+
+    def run(self, course_url, step_name, func, *args, prepare=None, depends_on=None):
+        """Runs a step now. On failure the step is deferred and the entry is returned."""
+        if depends_on is not None:
+            return self.defer(course_url, step_name, func, args, prepare,
+                              "waiting on an earlier failed step", depends_on)
+        try:
+            _timed_step(self.driver, course_url, step_name, func, args)
+            return None
+        except Exception as e:
+            return self.defer(course_url, step_name, func, args, prepare, e, depends_on)
+
+    def defer(self, course_url, step_name, func, args, prepare=None, error=None, depends_on=None):
+        """Puts a step on the deferred queue without running it."""
+        if isinstance(error, Exception):
+            failure = classify_failure(error, self.driver)
+        else:
+            failure = TRANSIENT
+        entry = {
+            "course": course_url, "step": step_name, "func": func, "args": args,
+            "prepare": prepare, "failure": failure, "error": str(error),
+            "depends_on": depends_on,
+        }
+        if failure == PERMANENT:
+            self.failed.append(entry)
+            logging.error(f"Step '{step_name}' failed permanently for course: {course_url} - Error: {error}")
+            print(f"Step '{step_name}' failed permanently for course: {course_url} - Error: {error}")
+        else:
+            self.deferred.append(entry)
+            logging.warning(f"Deferred step '{step_name}' for course: {course_url} ({failure}) - Error: {error}")
+            print(f"Deferred step '{step_name}' for course: {course_url} ({failure})")
+        return entry
+
+    def _relogin_once(self):
+        if self.relogged_in or self.relogin is None:
+            return
+        self.relogged_in = True
+        logging.info("Session failure detected. Logging in again.")
+        print("Session failure detected. Logging in again.")
+        if not self.relogin():
+            logging.error("Re-login failed.")
+
+    def retry_deferred(self):
+        """Retries deferred steps in the order they failed, with exponential backoff."""
+        pending, self.deferred = self.deferred, []
+        if not pending:
+            return
+        print(f"Retrying {len(pending)} deferred step(s)...")
+        if any(entry["failure"] == SESSION for entry in pending):
+            self._relogin_once()
+
+        for entry in pending:
+            dependency = entry["depends_on"]
+            if dependency is not None and any(dependency is f for f in self.failed):
+                entry["error"] = "an earlier step it depends on still fails"
+                self.failed.append(entry)
+                continue
+            if not self._retry_entry(entry):
+                self.failed.append(entry)
+
+    def _retry_entry(self, entry):
+        for attempt in range(self.max_attempts):
+            time.sleep(self.base_delay * 2 ** attempt)
+            try:
+                if entry["prepare"] is not None:
+                    entry["prepare"]()
+                _timed_step(self.driver, entry["course"], f"{entry['step']} (retry {attempt + 1})",
+                            entry["func"], entry["args"])
+                logging.info(f"Retry {attempt + 1} of step '{entry['step']}' succeeded for course: {entry['course']}")
+                print(f"Recovered step '{entry['step']}' for course: {entry['course']}")
+                return True
+            except Exception as e:
+                entry["failure"] = classify_failure(e, self.driver)
+                entry["error"] = str(e)
+                logging.warning(f"Retry {attempt + 1} of step '{entry['step']}' failed for course: "
+                                f"{entry['course']} ({entry['failure']}) - Error: {e}")
+                if entry["failure"] == PERMANENT:
+                    return False
+                if entry["failure"] == SESSION:
+                    self._relogin_once()
+        return False
+
+    def course_status(self, course_url):
+        """'failed', 'deferred' or 'ok' for a course, from the steps still on the queues."""
+        if any(entry["course"] == course_url for entry in self.failed):
+            return "failed"
+        if any(entry["course"] == course_url for entry in self.deferred):
+            return "deferred"
+        return "ok"
+
+    def summary(self):
+        """Prints and logs the steps that still failed after retrying."""
+        remaining = self.failed + self.deferred
+        if not remaining:
+            print("All steps completed.")
+            logging.info("All steps completed.")
+            return remaining
+        lines = [f"{len(remaining)} step(s) still failed:"]
+        for entry in remaining:
+            lines.append(f"  {entry['course']} | {entry['step']} | {entry['failure']} | {entry['error']}")
+        report = "\n".join(lines)
+        print(report)
+        logging.error(report)
+        return remaining
+
+
+def _timed_step(driver, course_url, step_name, func, args):
+    """Runs a step, noting it in the snapshot ring and dumping a snapshot if it raises."""
+    if driver is None:
+        driver = next((arg for arg in args if hasattr(arg, "save_screenshot")), None)
+    started = time.time()
+    start_time = time.perf_counter()
+    emit("step_start", course_url, step_name)
+    try:
+        func(*args)
+    except Exception as e:
+        seconds = time.perf_counter() - start_time
+        record_step(course_url, step_name, started, seconds, "failed")
+        emit("step_end", course_url, step_name, (seconds, "failed"))
+        dump_failure(driver, course_url, step_name, e)
+        raise
+    seconds = time.perf_counter() - start_time
+    record_step(course_url, step_name, started, seconds, "ok")
+    emit("step_end", course_url, step_name, (seconds, "ok"))
+
+
+def run_step(retries, course_url, step_name, func, *args, prepare=None, depends_on=None):
+    """Runs a step through the retry queue, or directly (raising on failure) without one.
+
+    Returns the deferred entry if the step failed, otherwise None.
+    """
+    if retries is None:
+        _timed_step(None, course_url, step_name, func, args)
+        return None
+    return retries.run(course_url, step_name, func, *args,
+                       prepare=prepare, depends_on=depends_on)
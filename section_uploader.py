@@ -1,122 +1,79 @@
 import logging
 import os
 import time
-import pyautogui
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from course_catalog import resolve_targets
+from moodle_automation import AdaptiveWait, Task, ensure_edit_mode, get_attachments, open_page, read_file, read_lines, register_task, run_task
+from retry_queue import run_step
 
-logging.basicConfig(filename="logs/moodle_topic_content_uploader_log.txt", level=logging.INFO,
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+CREATE_NEW_SECTION = True  # Set this to False to add the folder to the last existing section
 
-CHROMEDRIVER_PATH = os.path.join(os.getcwd(), 'chromedriver.exe')
 
-
-def read_file(file_path):
-    """Read the content of a file."""
-    try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            return file.read().strip()
-    except FileNotFoundError:
-        logging.error(f"File '{file_path}' not found.")
+def last_section_name(driver):
+    """Returns the name of the course's last section, as shown on the open course page."""
+    sections = driver.find_elements(By.CSS_SELECTOR, "li[id^='section-']")
+    if not sections:
         return None
-
-
-def read_lines(file_path):
-    """Read multiple lines from a file."""
-    try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            return [line.strip() for line in file.readlines()]
-    except FileNotFoundError:
-        logging.error(f"File '{file_path}' not found.")
-        return []
-
-
-def get_content_files(content_dir):
-    """Get all content files from a directory."""
-    try:
-        files = os.listdir(content_dir)
-        if not files:
-            logging.info("No content found. Skipping content upload.")
-            return []
-        return [os.path.abspath(os.path.join(content_dir, f)) for f in files]
-    except FileNotFoundError:
-        logging.error(f"Content folder '{content_dir}' not found.")
-        return []
-
-
-def login_to_moodle(driver):
-    """Open Moodle and prompt user to log in manually."""
-    driver.get("https://moodle.nu.edu.eg/")
-    input("Please log in to Moodle, then press Enter to continue...")
-    logging.info("User logged in manually.")
-    print("User logged in manually.")
-
-
-def enable_edit_mode(driver, course_url):
-    """Enable edit mode in Moodle if not already enabled."""
+    return sections[-1].get_attribute("data-sectionname") or sections[-1].get_attribute("aria-label")
+
+
+def click_add_section(driver, course_url):
+    """Click 'Add section' at the end of the open course."""
+    add_section_button = AdaptiveWait(driver, 10, key="section_uploader.add_section").until(
+        EC.element_to_be_clickable((By.CSS_SELECTOR, "a.btn.add-section"))
+    )
+    add_section_button.click()
+    logging.info(f"Clicked 'Add section' button on course: {course_url}")
+    time.sleep(3)
+
+
+def rename_last_section(driver, course_url, topic_name):
+    """Rename the last section using pyautogui."""
+    # pyautogui needs a desktop session, so it is only imported when a section is renamed
+    import pyautogui
+    edit_section_links = AdaptiveWait(driver, 10, key="section_uploader.edit_section_name").until(
+        EC.presence_of_all_elements_located(
+            (By.XPATH, "//a[@title='Edit section name']"))
+    )
+    last_edit_section_link = edit_section_links[-1]
+    last_edit_section_link.click()
+    logging.info(
+        f"Clicked 'Edit section name' on the last section of course: {course_url}")
+
+    time.sleep(2)
+    pyautogui.write(topic_name, interval=0.05)
+    pyautogui.press('enter')
+    logging.info(
+        f"Renamed last section to '{topic_name}' on course: {course_url}")
+
+
+def add_section(driver, course_url, topic_name=None, added=None):
+    """Add a new section and rename it using pyautogui.
+
+    `added` is a list shared between attempts; once 'Add section' was clicked,
+    later attempts only rename, so a failed rename does not leave empty sections.
+    """
     try:
         start_time = time.time()
-        driver.get(course_url)
-        time.sleep(3)
-        edit_mode_checkbox = WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located(
-                (By.XPATH, "//input[@type='checkbox' and contains(@id, 'editingswitch')]"))
-        )
-        if not edit_mode_checkbox.is_selected():
-            edit_mode_checkbox.click()
-            logging.info(f"Enabled edit mode on course: {course_url}")
-            print(
-                f"Enabled edit mode on course: {course_url} (Time taken: {time.time() - start_time:.2f} seconds)")
-        else:
-            logging.info(f"Edit mode already enabled on course: {course_url}")
-            print(
-                f"Edit mode already enabled on course: {course_url} (Time taken: {time.time() - start_time:.2f} seconds)")
-    except Exception as e:
-        logging.error(
-            f"Failed to enable edit mode on course: {course_url} - Error: {e}")
-
-
-def add_section(driver, course_url):
-    """Add a new section and rename it using pyautogui."""
-    try:
-        start_time = time.time()
-        add_section_button = WebDriverWait(driver, 10).until(
-            EC.element_to_be_clickable((By.CSS_SELECTOR, "a.btn.add-section"))
-        )
-        add_section_button.click()
-        logging.info(f"Clicked 'Add section' button on course: {course_url}")
-        time.sleep(3)
-
-        # Rename the last section
-        edit_section_links = WebDriverWait(driver, 10).until(
-            EC.presence_of_all_elements_located(
-                (By.XPATH, "//a[@title='Edit section name']"))
-        )
-        last_edit_section_link = edit_section_links[-1]
-        last_edit_section_link.click()
-        logging.info(
-            f"Clicked 'Edit section name' on the last section of course: {course_url}")
-
-        time.sleep(2)
-        pyautogui.write(TOPIC_NAME, interval=0.05)
-        pyautogui.press('enter')
-        logging.info(
-            f"Renamed last section to '{TOPIC_NAME}' on course: {course_url}")
+        if not added:
+            click_add_section(driver, course_url)
+            if added is not None:
+                added.append(course_url)
+        rename_last_section(driver, course_url, topic_name)
         print(
-            f"Renamed section to '{TOPIC_NAME}' (Time taken: {time.time() - start_time:.2f} seconds)")
+            f"Renamed section to '{topic_name}' (Time taken: {time.time() - start_time:.2f} seconds)")
     except Exception as e:
         logging.error(
             f"Failed to create or rename section on course: {course_url} - Error: {e}")
+        raise
 
 
 def click_add_activity_or_resource(driver, course_url):
     """Click 'Add an activity or resource' in the last section."""
     try:
         start_time = time.time()
-        add_content_buttons = WebDriverWait(driver, 10).until(
+        add_content_buttons = AdaptiveWait(driver, 10, key="section_uploader.add_content").until(
             EC.presence_of_all_elements_located(
                 (By.XPATH, "//button[@data-action='open-chooser']"))
         )
@@ -130,13 +87,14 @@ def click_add_activity_or_resource(driver, course_url):
     except Exception as e:
         logging.error(
             f"Failed to click 'Add an activity or resource' on course: {course_url} - Error: {e}")
+        raise
 
 
 def add_folder_activity(driver, course_url):
     """Add a folder activity in the last section."""
     try:
         start_time = time.time()
-        folder_option = WebDriverWait(driver, 10).until(
+        folder_option = AdaptiveWait(driver, 10, key="section_uploader.folder_option").until(
             EC.element_to_be_clickable(
                 (By.XPATH, "//div[contains(@class, 'modicon_folder')]"))
         )
@@ -148,13 +106,14 @@ def add_folder_activity(driver, course_url):
     except Exception as e:
         logging.error(
             f"Failed to click 'Add Folder' on course: {course_url} - Error: {e}")
+        raise
 
 
 def enter_folder_name(driver, course_url, folder_name):
     """Enter the name of the folder to be created."""
     try:
         start_time = time.time()
-        folder_name_input = WebDriverWait(driver, 10).until(
+        folder_name_input = AdaptiveWait(driver, 10, key="section_uploader.folder_name").until(
             EC.presence_of_element_located((By.ID, "id_name"))
         )
         folder_name_input.send_keys(folder_name)
@@ -165,6 +124,7 @@ def enter_folder_name(driver, course_url, folder_name):
     except Exception as e:
         logging.error(
             f"Failed to enter folder name on course: {course_url} - Error: {e}")
+        raise
 
 
 def upload_files(driver, content_files, course_url):
@@ -176,7 +136,7 @@ def upload_files(driver, content_files, course_url):
             print(f"Attempting to upload content: {content}")
 
             # Click "Add..." button
-            add_file_button = WebDriverWait(driver, 10).until(
+            add_file_button = AdaptiveWait(driver, 10, key="section_uploader.add_file").until(
                 EC.element_to_be_clickable(
                     (By.CSS_SELECTOR, "a.btn.btn-secondary"))
             )
@@ -186,7 +146,7 @@ def upload_files(driver, content_files, course_url):
                 f"Clicked 'Add...' button to open file upload dialog (Time taken: {time.time() - start_time:.2f} seconds)")
 
             # Wait for the file input to appear
-            file_input = WebDriverWait(driver, 10).until(
+            file_input = AdaptiveWait(driver, 10, key="section_uploader.file_input").until(
                 EC.presence_of_element_located(
                     (By.CSS_SELECTOR, 'input[type="file"]'))
             )
@@ -196,7 +156,8 @@ def upload_files(driver, content_files, course_url):
                 f"Uploaded content: {content} (Time taken: {time.time() - start_time:.2f} seconds)")
 
             # Wait for the file to finish uploading
-            WebDriverWait(driver, 60).until(
+            AdaptiveWait(driver, 60, size_bytes=os.path.getsize(content),
+                         key="section_uploader.file_upload").until(
                 EC.invisibility_of_element_located(
                     (By.CLASS_NAME, "dndupload-uploadinprogress"))
             )
@@ -205,7 +166,7 @@ def upload_files(driver, content_files, course_url):
                 f"File upload finished: {content} (Time taken: {time.time() - start_time:.2f} seconds)")
 
             # Click "Upload this file" button
-            upload_button = WebDriverWait(driver, 10).until(
+            upload_button = AdaptiveWait(driver, 10, key="section_uploader.upload_button").until(
                 EC.element_to_be_clickable(
                     (By.CSS_SELECTOR, 'button.fp-upload-btn'))
             )
@@ -216,7 +177,7 @@ def upload_files(driver, content_files, course_url):
                 f"Clicked 'Upload this file' for {content} on course: {course_url} (Time taken: {time.time() - start_time:.2f} seconds)")
 
             # Wait for the upload process to fully complete and ensure the dialog is closed
-            WebDriverWait(driver, 30).until(
+            AdaptiveWait(driver, 30, key="section_uploader.picker_closed").until(
                 EC.invisibility_of_element_located(
                     (By.CLASS_NAME, "yui3-widget-mask"))
             )
@@ -225,7 +186,7 @@ def upload_files(driver, content_files, course_url):
                 f"Upload dialog closed for {content} (Time taken: {time.time() - start_time:.2f} seconds)")
 
             # Now that the file is uploaded, wait for the "Add..." button to reappear for the next file
-            WebDriverWait(driver, 10).until(
+            AdaptiveWait(driver, 10, key="section_uploader.add_file_after_upload").until(
                 EC.element_to_be_clickable(
                     (By.CSS_SELECTOR, "a.btn.btn-secondary"))
             )
@@ -238,14 +199,14 @@ def upload_files(driver, content_files, course_url):
                 f"Failed to upload content on course: {course_url} - Error: {e}")
             print(
                 f"Failed to upload content on course: {course_url} - Error: {e}")
-            continue
+            raise
 
 
 def save_and_return_to_course(driver, course_url):
     """Save the folder and return to the course page."""
     try:
         start_time = time.time()
-        save_button = WebDriverWait(driver, 10).until(
+        save_button = AdaptiveWait(driver, 10, key="section_uploader.save").until(
             EC.element_to_be_clickable((By.ID, "id_submitbutton2"))
         )
         save_button.click()
@@ -256,15 +217,11 @@ def save_and_return_to_course(driver, course_url):
     except Exception as e:
         logging.error(
             f"Failed to save folder on course: {course_url} - Error: {e}")
+        raise
 
 
-def process_course(driver, course_url, create_new_section, folder_name, content_files):
-    """Process each course by uploading content."""
-    enable_edit_mode(driver, course_url)
-
-    if create_new_section:
-        add_section(driver, course_url)
-
+def add_folder(driver, course_url, folder_name, content_files):
+    """Add a folder with the content files to the last section of the open course."""
     click_add_activity_or_resource(driver, course_url)
     add_folder_activity(driver, course_url)
     enter_folder_name(driver, course_url, folder_name)
@@ -272,47 +229,71 @@ def process_course(driver, course_url, create_new_section, folder_name, content_
     save_and_return_to_course(driver, course_url)
 
 
-def main():
-    """Main function to execute the script."""
-    CREATE_NEW_SECTION = True  # Set this to True if you want to create a new section
-
-    # File paths
-    course_links_file = "section/links.txt"
-    topic_name_file = "section/name.txt"
-    folder_name_file = "section/folder_name.txt"
-    content_dir = "section/content"
-
-    # Read data from files
-    COURSE_LINKS = read_lines(course_links_file)
-    global TOPIC_NAME
-    TOPIC_NAME = read_file(topic_name_file)
-    FOLDER_NAME = read_file(folder_name_file)
-    content_files = get_content_files(content_dir)
-
-    # Ensure required data is present
-    if not COURSE_LINKS or not TOPIC_NAME or not FOLDER_NAME or not content_files:
-        logging.error("Missing required data. Please check your input files.")
-        print("Missing required data. Please check your input files.")
-        return
-
-    # Set up WebDriver
-    service = Service(executable_path=CHROMEDRIVER_PATH)
-    driver = webdriver.Chrome(service=service)
-    driver.maximize_window()
-
-    # Log in to Moodle
-    login_to_moodle(driver)
-
-    # Process each course link
-    for course_url in COURSE_LINKS:
-        process_course(driver, course_url, CREATE_NEW_SECTION,
-                       FOLDER_NAME, content_files)
+def process_course(driver, course_url, create_new_section, folder_name, content_files, topic_name=None, retries=None):
+    """Process each course by uploading content."""
+    def reopen():
+        open_page(driver, course_url)
+        ensure_edit_mode(driver)
 
-    # Close the browser once all content is uploaded
-    driver.quit()
-    logging.info("Browser closed. Script completed.")
-    print("Browser closed. Script completed.")
+    section_step = None
+    if create_new_section:
+        added = []
+
+        def open_and_add_section():
+            # Retries must not add another empty section: reuse the one added by an earlier attempt
+            reopen()
+            if last_section_name(driver) == topic_name:
+                logging.info(f"Section '{topic_name}' already exists on course: {course_url}")
+                return
+            add_section(driver, course_url, topic_name, added)
+        section_step = run_step(retries, course_url, "add section", open_and_add_section)
+    else:
+        try:
+            reopen()
+        except Exception as e:
+            if retries is None:
+                raise
+            retries.defer(course_url, "add folder", add_folder,
+                          (driver, course_url, folder_name, content_files), reopen, e)
+            return
+
+    # The folder goes into the last section, so it waits for a failed new section
+    run_step(retries, course_url, "add folder", add_folder, driver, course_url,
+             folder_name, content_files, prepare=reopen, depends_on=section_step)
+
+
+@register_task
+class SectionUploadTask(Task):
+    name = "upload_section"
+    description = "Add a section with a folder of content files to Moodle courses."
+    log_file = "moodle_topic_content_uploader_log.txt"
+    login = "prompt"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--no-new-section", dest="create_new_section", action="store_false",
+                            default=CREATE_NEW_SECTION,
+                            help="add the folder to the last existing section instead")
+
+    def load_inputs(self, args):
+        inputs = {
+            "targets": resolve_targets(read_lines("section/links.txt"), self.target_kind),
+            "topic_name": read_file("section/name.txt"),
+            "folder_name": read_file("section/folder_name.txt"),
+            "content_files": get_attachments("section/content"),
+            "create_new_section": args.create_new_section,
+        }
+        if not inputs["topic_name"] or not inputs["folder_name"] or not inputs["content_files"]:
+            return None
+        return inputs
+
+    def prefetch_mode(self, inputs):
+        # Renaming a new section types into the focused window, so no tabs are opened
+        return "http" if inputs["create_new_section"] else "tab"
+
+    def run_course(self, driver, course_url, inputs, retries):
+        process_course(driver, course_url, inputs["create_new_section"], inputs["folder_name"],
+                       inputs["content_files"], inputs["topic_name"], retries)
 
 
 if __name__ == "__main__":
-    main()
+    run_task(SectionUploadTask())
@@ -0,0 +1,178 @@
+import argparse
+import asyncio
+import logging
+import threading
+from functools import partial
+from selenium.webdriver.chrome.options import Options
+from browser_recycler import RecyclingDriver, course_done
+from daemon import load_job_inputs
+from moodle_automation import load_task, login_function, open_browser, setup_logging, start_chrome
+from progress_dashboard import Dashboard, emit, stop_dashboard
+from retry_queue import RetryQueue
+
+DEBUGGING_PORT = 9222
+
+# Every tab is driven by its own lightweight chromedriver session attached to
+# the same Chrome over its DevTools port. The tabs share one profile, so one
+# login (and one cookie jar) serves all of them, while WebDriver commands for
+# different tabs can run at the same time.
+#
+# Each tab is a RecyclingDriver: it is checked after every course, and closed
+# and opened again after browser_recycler.MAX_COURSES courses, which frees its
+# renderer, or at once if it died. A tab that died because Chrome itself crashed first
+# restarts the shared browser, which logs in again.
+
+
+def launch_browser(port=DEBUGGING_PORT):
+    """Starts the single Chrome instance that all tabs are opened in."""
+    options = Options()
+    options.add_argument(f"--remote-debugging-port={port}")
+    return start_chrome(options)
+
+
+def attach_tab(port=DEBUGGING_PORT):
+    """Attaches a new WebDriver session to the running Chrome and opens its own tab."""
+    options = Options()
+    options.debugger_address = f"127.0.0.1:{port}"
+    driver = start_chrome(options, maximize=False)
+    driver.switch_to.new_window('tab')
+    return driver
+
+
+def detach_tab(driver):
+    """Closes the tab and ends its session without closing the browser."""
+    try:
+        driver.close()
+    except Exception as e:
+        logging.warning(f"Failed to close tab - Error: {e}")
+    # Sessions attached through debugger_address leave the browser running
+    driver.quit()
+
+
+async def open_tabs(browser, login, count, port=DEBUGGING_PORT):
+    """Opens `count` recycling tabs and returns them in a queue that caps concurrent use."""
+    revive_lock = threading.Lock()
+
+    def start_tab():
+        # The first tab to find Chrome gone restarts it; the others attach to the new one
+        with revive_lock:
+            browser.revive()
+        return attach_tab(port)
+
+    drivers = await asyncio.gather(
+        *(asyncio.to_thread(RecyclingDriver, start_tab, login, stop_browser=detach_tab)
+          for _ in range(count)))
+    tabs = asyncio.Queue()
+    for driver in drivers:
+        tabs.put_nowait(driver)
+    logging.info(f"Opened {count} tab(s) on port {port}.")
+    return tabs
+
+
+async def close_tabs(tabs):
+    drivers = []
+    while not tabs.empty():
+        drivers.append(tabs.get_nowait())
+    await asyncio.gather(*(asyncio.to_thread(detach_tab, d) for d in drivers))
+
+
+def tab_scoped(func):
+    """Turns a function taking a driver into a coroutine that runs in a free tab.
+
+    The returned coroutine takes the tab queue in place of the driver and waits
+    for a tab when all of them are busy.
+    """
+    async def run_in_tab(tabs, *args, **kwargs):
+        driver = await tabs.get()
+        try:
+            return await asyncio.to_thread(func, driver, *args, **kwargs)
+        finally:
+            await asyncio.to_thread(course_done, driver)
+            tabs.put_nowait(driver)
+    run_in_tab.__name__ = func.__name__
+    run_in_tab.__doc__ = func.__doc__
+    return run_in_tab
+
+
+def run_target(driver, task, target, inputs, login):
+    """Runs a task on one target and retries its failed steps in the same tab. Returns those that still fail."""
+    retries = RetryQueue(driver, relogin=lambda: login(driver))
+    emit("course_start", target, worker=threading.current_thread().name)
+    try:
+        task.run_course(driver, target, inputs, retries)
+        retries.retry_deferred()
+    except Exception:
+        emit("course_end", target, value="failed")
+        raise
+    emit("course_end", target, value=retries.course_status(target))
+    return retries.failed
+
+
+def tab_inputs(task):
+    """Reads the task's inputs the way its script does."""
+    # Section renaming types into the focused tab, so the folder goes into the last existing section
+    options = {"create_new_section": False} if task.name == "upload_section" else {}
+    return load_job_inputs(task, {"options": options})
+
+
+async def run(task_name, tab_count, port, dashboard=False):
+    task = load_task(task_name)
+    inputs = tab_inputs(task)
+    if not inputs or not inputs.get("targets"):
+        logging.error("Missing required data. Please check your input files.")
+        print("Missing required data. Please check your input files.")
+        return
+    login = login_function("auto")
+    if login is None:
+        print("Missing credentials. Exiting script.")
+        return
+
+    browser = await asyncio.to_thread(open_browser, login, partial(launch_browser, port))
+    if browser is None:
+        print("Automatic login failed. Exiting...")
+        return
+    if dashboard:
+        Dashboard(inputs["targets"]).start()
+    try:
+        tabs = await open_tabs(browser, login, tab_count, port)
+        try:
+            in_tab = tab_scoped(run_target)
+            results = await asyncio.gather(
+                *(in_tab(tabs, task, target, inputs, login) for target in inputs["targets"]),
+                return_exceptions=True)
+            # One summary of the steps that still failed in any tab
+            report = RetryQueue()
+            for target, result in zip(inputs["targets"], results):
+                if isinstance(result, Exception):
+                    logging.error(f"Tab job failed for {target} - Error: {result}")
+                    print(f"Tab job failed for {target} - Error: {result}")
+                else:
+                    report.failed.extend(result)
+            report.summary()
+        finally:
+            await close_tabs(tabs)
+    finally:
+        stop_dashboard()
+        browser.quit()
+        logging.info("Browser closed. Script completed.")
+        print("Browser closed. Script completed.")
+
+
+def main():
+    setup_logging("tab_engine_log.txt")
+    parser = argparse.ArgumentParser(
+        description="Run a per-course task in several tabs of one logged-in browser.")
+    parser.add_argument("task", choices=[
+        "announce", "upload_section", "post_assignment", "gradebook_modify"])
+    parser.add_argument("--tabs", type=int, default=4,
+                        help="maximum number of tabs working at the same time")
+    parser.add_argument("--port", type=int, default=DEBUGGING_PORT,
+                        help="Chrome remote debugging port")
+    parser.add_argument("--dashboard", action="store_true",
+                        help="show live progress: course status, current step, courses/minute and ETA")
+    args = parser.parse_args()
+    asyncio.run(run(args.task, args.tabs, args.port, args.dashboard))
+
+
+if __name__ == "__main__":
+    main()
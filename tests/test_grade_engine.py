@@ -0,0 +1,41 @@
+import os
+import pytest
+
+np = pytest.importorskip("numpy")
+import grade_engine
+
+EXPORT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "grade_export.csv")
+# Quizzes use simple weighted mean, the course total is Natural and Bonus only adds extra credit
+STRUCTURE = {
+    "Quizzes": {"weight": 10, "quiz1": 10, "quiz2": 20},
+    "Bonus": {"weight": 0, "bonus": 5},
+    "Final": 20,
+}
+
+
+def load():
+    book = grade_engine.Gradebook(STRUCTURE, extra_credit={"Bonus"})
+    students, grades, moodle_totals = grade_engine.load_exports([EXPORT_PATH], book)
+    return book, students, grades, moodle_totals
+
+
+def test_export_is_read_with_moodle_totals():
+    book, students, grades, moodle_totals = load()
+    assert [student["Email address"] for student in students][:2] == ["amira@nu.edu.eg", "omar@nu.edu.eg"]
+    assert grades.shape == (5, 4)
+    assert np.isnan(grades[1, book.aliases["quiz2"]])
+    assert set(moodle_totals) == {"Quizzes total", "Bonus total", "Course total"}
+
+
+def test_computed_totals_match_moodle():
+    book, students, grades, moodle_totals = load()
+    category_totals, course_totals, course_maxes = grade_engine.compute_totals(book, grades)
+    assert grade_engine.check_against_moodle(book, category_totals, course_totals, moodle_totals) == 0
+    # Bonus points are capped at the course maximum, which leaves out the empty Final
+    assert list(course_maxes[:4]) == [30, 30, 30, 10]
+
+
+def test_counting_empty_grades_as_zero_differs_from_moodle():
+    book, students, grades, moodle_totals = load()
+    category_totals, course_totals, _ = grade_engine.compute_totals(book, grades, exclude_empty=False)
+    assert grade_engine.check_against_moodle(book, category_totals, course_totals, moodle_totals) > 0
@@ -0,0 +1,180 @@
+import multiprocessing
+import sqlite3
+import threading
+import time
+import urllib.request
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import lease_queue
+
+LEASE = 1  # Seconds; short so an abandoned lease expires during the test
+
+
+def claim_and_finish(db_path, worker_id, results):
+    connection = lease_queue.connect(db_path)
+    while True:
+        job = lease_queue.claim(connection, worker_id, LEASE)
+        if job is None:
+            if lease_queue.remaining_jobs(connection) == 0:
+                break
+            time.sleep(0.1)
+            continue
+        time.sleep(0.05)
+        lease_queue.finish(connection, job["job_id"], worker_id, "done", duration=0.05)
+        results.put((worker_id, job["job_id"]))
+    connection.close()
+
+
+def claim_and_visit(db_path, worker_id, results):
+    """Like a worker's run_claimed_job, but the "course" is a request to the stub server."""
+    connection = lease_queue.connect(db_path)
+    while True:
+        job = lease_queue.claim(connection, worker_id, LEASE)
+        if job is None:
+            if lease_queue.remaining_jobs(connection) == 0:
+                break
+            time.sleep(0.1)
+            continue
+        with urllib.request.urlopen(job["target"], timeout=10) as response:
+            status = "done" if response.status == 200 else "failed"
+        lease_queue.finish(connection, job["job_id"], worker_id, status, duration=0.05)
+        results.put((worker_id, job["job_id"]))
+    connection.close()
+
+
+def claim_and_crash(db_path, worker_id, claimed):
+    connection = lease_queue.connect(db_path)
+    claimed.put(lease_queue.claim(connection, worker_id, LEASE)["job_id"])
+    # Exits without finishing or heartbeating, like a worker whose browser died
+
+
+class StubCourse(BaseHTTPRequestHandler):
+    """Counts the course pages requested by the workers."""
+
+    visits = Counter()
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with self.lock:
+            self.visits[self.path] += 1
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    StubCourse.visits = Counter()
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), StubCourse)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def jobs(db_path):
+    connection = sqlite3.connect(db_path)
+    rows = connection.execute("SELECT job_id, status, worker, attempts FROM jobs ORDER BY job_id").fetchall()
+    connection.close()
+    return rows
+
+
+def test_workers_share_the_queue_and_reclaim_an_expired_lease(tmp_path):
+    db_path = str(tmp_path / "queue.db")
+    lease_queue.enqueue("gradebook_reset", [f"https://moodle/course/view.php?id={n}" for n in range(12)],
+                        db_path=db_path)
+    context = multiprocessing.get_context("spawn")
+    claimed, results = context.Queue(), context.Queue()
+
+    crasher = context.Process(target=claim_and_crash, args=(db_path, "crasher", claimed))
+    crasher.start()
+    crasher.join(30)
+    abandoned = claimed.get(timeout=5)
+
+    workers = [context.Process(target=claim_and_finish, args=(db_path, f"worker{n}", results))
+               for n in (1, 2)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(60)
+        assert worker.exitcode == 0
+
+    finished = [results.get(timeout=5) for _ in range(12)]
+    assert sorted(job_id for _, job_id in finished) == list(range(1, 13))
+    assert {worker for worker, _ in finished} == {"worker1", "worker2"}
+    rows = jobs(db_path)
+    assert all(status == "done" for _, status, _, _ in rows)
+    job_id, _, worker, attempts = rows[abandoned - 1]
+    assert worker != "crasher" and attempts == 2
+
+
+def test_each_job_reaches_the_server_once(tmp_path, server):
+    db_path = str(tmp_path / "queue.db")
+    paths = [f"/course/view.php?id={n}" for n in range(12)]
+    lease_queue.enqueue("gradebook_reset", [server + path for path in paths], db_path=db_path)
+    context = multiprocessing.get_context("spawn")
+    claimed, results = context.Queue(), context.Queue()
+
+    crasher = context.Process(target=claim_and_crash, args=(db_path, "crasher", claimed))
+    crasher.start()
+    crasher.join(30)
+    abandoned = claimed.get(timeout=5)
+
+    workers = [context.Process(target=claim_and_visit, args=(db_path, f"worker{n}", results))
+               for n in (1, 2, 3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(60)
+        assert worker.exitcode == 0
+
+    finished = [results.get(timeout=5) for _ in range(12)]
+    assert sorted(job_id for _, job_id in finished) == list(range(1, 13))
+    assert StubCourse.visits == Counter(paths)
+    rows = jobs(db_path)
+    assert all(status == "done" for _, status, _, _ in rows)
+    assert rows[abandoned - 1][2] != "crasher" and rows[abandoned - 1][3] == 2
+
+
+def test_heartbeat_keeps_the_lease(tmp_path):
+    db_path = str(tmp_path / "queue.db")
+    lease_queue.enqueue("gradebook_reset", ["https://moodle/course/view.php?id=1"], db_path=db_path)
+    owner, other = lease_queue.connect(db_path), lease_queue.connect(db_path)
+    job = lease_queue.claim(owner, "owner", LEASE)
+    heartbeat = lease_queue.Heartbeat(db_path, job["job_id"], "owner", LEASE)
+    heartbeat.start()
+    time.sleep(LEASE * 2.5)
+    assert lease_queue.claim(other, "other", LEASE) is None
+    heartbeat.stop()
+    lease_queue.finish(owner, job["job_id"], "owner", "done")
+    assert jobs(db_path)[0][1:] == ("done", "owner", 1)
+
+
+def test_lost_lease_drops_the_late_result(tmp_path):
+    db_path = str(tmp_path / "queue.db")
+    lease_queue.enqueue("gradebook_reset", ["https://moodle/course/view.php?id=1"], db_path=db_path)
+    connection = lease_queue.connect(db_path)
+    first = lease_queue.claim(connection, "slow", LEASE)
+    time.sleep(LEASE + 0.2)
+    second = lease_queue.claim(connection, "fast", LEASE)
+    assert second["job_id"] == first["job_id"]
+    assert not lease_queue.renew_lease(connection, first["job_id"], "slow", LEASE)
+    lease_queue.finish(connection, first["job_id"], "slow", "failed", "too late")
+    lease_queue.finish(connection, second["job_id"], "fast", "done")
+    assert jobs(db_path)[0][1:] == ("done", "fast", 2)
+
+
+def test_job_fails_after_max_attempts(tmp_path):
+    db_path = str(tmp_path / "queue.db")
+    lease_queue.enqueue("gradebook_reset", ["https://moodle/course/view.php?id=1"], db_path=db_path)
+    connection = lease_queue.connect(db_path)
+    for attempt in range(lease_queue.MAX_ATTEMPTS):
+        assert lease_queue.claim(connection, f"worker{attempt}", 0.1) is not None
+        time.sleep(0.2)
+    assert lease_queue.claim(connection, "last", LEASE) is None
+    assert jobs(db_path)[0][1] == "failed"
@@ -0,0 +1,130 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import pytest
+
+requests = pytest.importorskip("requests")
+pytest.importorskip("selenium")  # moodle_ajax takes MOODLE_URL from the browser module
+from moodle_ajax import AjaxBatcher, AjaxError
+
+
+class StubService(BaseHTTPRequestHandler):
+    """Answers lib/ajax/service.php like Moodle: calls run in order and the first exception ends the batch."""
+
+    batches = []
+
+    def do_POST(self):
+        query = parse_qs(urlparse(self.path).query)
+        calls = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.batches.append([call["methodname"] for call in calls])
+        if query["sesskey"] == ["bad"]:
+            results = {"error": "Invalid sesskey", "errorcode": "invalidsesskey"}
+        else:
+            results = []
+            for call in calls:
+                if call["methodname"] == "fail":
+                    results.append({"error": True, "exception": {"message": "Boom", "errorcode": "boom"}})
+                    break
+                results.append({"error": False, "data": call["args"]["value"] * 2})
+        body = json.dumps(results).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    StubService.batches = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), StubService)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def batcher(server, sesskey="key", **options):
+    return AjaxBatcher(requests.Session(), sesskey, base_url=server, **options)
+
+
+def test_calls_within_the_window_share_a_request(server):
+    ajax = batcher(server, window=0.3)
+    results = [None] * 10
+
+    def run(n):
+        results[n] = ajax.call("double", {"value": n})
+
+    threads = [threading.Thread(target=run, args=(n,)) for n in range(10)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.01)
+    for thread in threads:
+        thread.join()
+    ajax.close()
+    assert results == [n * 2 for n in range(10)]
+    assert len(StubService.batches) == 1
+    assert ajax.stats() == "10 web service call(s) in 1 request(s)"
+
+
+def test_map_shares_requests_without_a_window(server):
+    ajax = batcher(server, window=0)
+    assert ajax.map("double", [{"value": n} for n in range(10)]) == [n * 2 for n in range(10)]
+    ajax.close()
+    assert len(StubService.batches) == 1
+
+
+def test_batches_respect_the_call_cap(server):
+    ajax = batcher(server, max_calls=3, window=0.2)
+    assert ajax.map("double", [{"value": n} for n in range(7)]) == [n * 2 for n in range(7)]
+    ajax.close()
+    assert sorted(len(batch) for batch in StubService.batches) == [1, 3, 3]
+
+
+def test_batches_respect_the_byte_cap(server):
+    # Each encoded argument set is 14 bytes ({"value": 10}), so two fit in 30
+    ajax = batcher(server, max_bytes=30, window=0.2)
+    assert ajax.map("double", [{"value": n} for n in range(10, 15)]) == [n * 2 for n in range(10, 15)]
+    ajax.close()
+    assert sorted(len(batch) for batch in StubService.batches) == [1, 2, 2]
+
+
+def test_calls_after_a_failed_call_are_requeued(server):
+    ajax = batcher(server, window=0.2)
+    futures = [ajax.submit("double", {"value": 1}), ajax.submit("fail", {"value": 2}),
+               ajax.submit("double", {"value": 3}), ajax.submit("double", {"value": 4})]
+    assert futures[0].result(timeout=5) == 2
+    with pytest.raises(AjaxError) as error:
+        futures[1].result(timeout=5)
+    assert error.value.errorcode == "boom"
+    assert [future.result(timeout=5) for future in futures[2:]] == [6, 8]
+    ajax.close()
+    assert StubService.batches == [["double", "fail", "double", "double"], ["double", "double"]]
+
+
+def test_a_whole_batch_error_fails_every_call(server):
+    ajax = batcher(server, sesskey="bad", window=0.2)
+    futures = [ajax.submit("double", {"value": n}) for n in range(3)]
+    for future in futures:
+        with pytest.raises(AjaxError) as error:
+            future.result(timeout=5)
+        assert error.value.errorcode == "invalidsesskey"
+    ajax.close()
+    assert len(StubService.batches) == 1
+
+
+def test_close_sends_calls_requeued_by_the_last_batch(server):
+    ajax = batcher(server, window=10)
+    futures = [ajax.submit("fail", {"value": 1}), ajax.submit("double", {"value": 2}),
+               ajax.submit("double", {"value": 3})]
+    # Closing ends the window at once; the requeued calls arrive after the collector has stopped
+    ajax.close()
+    assert all(future.done() for future in futures)
+    assert [future.result() for future in futures[1:]] == [4, 6]
+    assert StubService.batches == [["fail", "double", "double"], ["double", "double"]]
@@ -0,0 +1,192 @@
+import argparse
+import csv
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from course_catalog import resolve_targets
+from moodle_automation import read_file, read_json, read_lines, setup_logging
+from moodle_http import course_id_from_url, login_sessions, per_thread
+from page_cache import get_page
+
+FETCH_WORKERS = 4   # Each worker logs in its own session
+MATRIX_PATH = os.path.join("logs", "verification_matrix.csv")
+CHECKS = ("announce", "section", "folder", "assignment", "gradebook", "rename")
+
+
+class PageTextParser(HTMLParser):
+    """Collects the visible text nodes of a page, stripped, for exact name matching."""
+
+    def __init__(self):
+        super().__init__()
+        self.texts = set()
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style"):
+            self._skip += 1
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style") and self._skip:
+            self._skip -= 1
+
+    def handle_data(self, data):
+        text = " ".join(data.split())
+        if text and not self._skip:
+            self.texts.add(text)
+
+
+def announcement_subjects(batch_dir="input/announcements", subject_file="input/subject.txt"):
+    try:
+        folders = sorted(os.listdir(batch_dir))
+    except FileNotFoundError:
+        folders = []
+    subjects = [read_file(os.path.join(batch_dir, folder, "subject.txt")) for folder in folders]
+    subjects = [subject for subject in subjects if subject]
+    return subjects or [s for s in [read_file(subject_file)] if s]
+
+
+def gradebook_names(structure):
+    names = []
+    for name, value in structure.items():
+        names.append(name)
+        if isinstance(value, dict):
+            names.extend(item for item in value if item != "weight")
+    return names
+
+
+def expected_outcomes(checks):
+    """Returns {check: (target urls, [(name, should_exist)])} from the scripts' input files."""
+    outcomes = {}
+    if "announce" in checks:
+        outcomes["announce"] = (resolve_targets(read_lines("input/links.txt"), "forum"),
+                                [(subject, True) for subject in announcement_subjects()])
+    section_courses = resolve_targets(read_lines("section/links.txt"), "course")
+    if "section" in checks:
+        outcomes["section"] = (section_courses, [(read_file("section/name.txt"), True)])
+    if "folder" in checks:
+        outcomes["folder"] = (section_courses, [(read_file("section/folder_name.txt"), True)])
+    if "assignment" in checks:
+        config = read_json("assignments/conf.json")
+        outcomes["assignment"] = (resolve_targets(config.get("courses", []), "course"),
+                                  [(config.get("assignment_name", ""), True)])
+    if "gradebook" in checks:
+        outcomes["gradebook"] = (resolve_targets(read_lines("grade_book/links.txt"), "gradebook"),
+                                 [(name, True) for name in gradebook_names(read_json("grade_book/gradebook.json"))])
+    if "rename" in checks:
+        config = read_json("grade_book/modify.json")
+        renames = [(old, new) for category in ("Tutorials", "Labs")
+                   for old, new in config.get(category, {}).items()]
+        outcomes["rename"] = (resolve_targets(config.get("courses", []), "gradebook"),
+                              [(new, True) for _, new in renames] + [(old, False) for old, _ in renames])
+    # Drop checks whose input files are missing
+    return {check: (targets, [(name, exists) for name, exists in expected if name])
+            for check, (targets, expected) in outcomes.items() if targets}
+
+
+def parse_page(html):
+    # Forum pages are keyed by module id; the course id is in M.cfg
+    match = re.search(r'"courseId":(\d+)', html)
+    parser = PageTextParser()
+    parser.feed(html)
+    return int(match.group(1)) if match else None, parser.texts
+
+
+def fetch_page(session, url):
+    """Returns (course id, set of page texts) for one target, or raises."""
+    course_id, texts = get_page(session, url, parse_page, timeout=30)
+    return course_id or course_id_from_url(url), texts
+
+
+def verify(sessions, outcomes):
+    """Fetches every target page once, one worker per session, and checks all outcomes against it.
+
+    Returns {course_id: {check: (passed, detail)}}.
+    """
+    urls = sorted({url for targets, _ in outcomes.values() for url in targets})
+    # Moodle serves one request per session at a time, so threads sharing a login would fetch one by one
+    session_for = per_thread(sessions)
+
+    def fetch(url):
+        try:
+            return url, fetch_page(session_for(), url), None
+        except Exception as e:
+            return url, None, e
+
+    with ThreadPoolExecutor(max_workers=len(sessions)) as executor:
+        pages = {url: (page, error) for url, page, error in executor.map(fetch, urls)}
+
+    matrix = {}
+    for check, (targets, expected) in outcomes.items():
+        for url in targets:
+            page, error = pages[url]
+            if error is not None:
+                course = course_id_from_url(url)
+                matrix.setdefault(course, {})[check] = (False, f"could not fetch {url}: {error}")
+                continue
+            course, texts = page
+            missing = [name for name, exists in expected if exists and name not in texts]
+            leftover = [name for name, exists in expected if not exists and name in texts]
+            detail = "; ".join(part for part in (
+                f"missing: {', '.join(missing)}" if missing else "",
+                f"still present: {', '.join(leftover)}" if leftover else "") if part)
+            matrix.setdefault(course, {})[check] = (not missing and not leftover, detail)
+    return matrix
+
+
+def write_matrix(matrix, checks, output_path=MATRIX_PATH):
+    """Prints the pass/fail matrix and writes it, with failure details, as CSV."""
+    lines = [f"{'Course':<8} " + " ".join(f"{check:<10}" for check in checks)]
+    for course in sorted(matrix, key=str):
+        cells = [matrix[course].get(check) for check in checks]
+        lines.append(f"{course!s:<8} " + " ".join(
+            f"{'-' if cell is None else 'pass' if cell[0] else 'FAIL':<10}" for cell in cells))
+    table = "\n".join(lines)
+    print(table)
+    logging.info(f"Verification matrix:\n{table}")
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["course"] + [c for check in checks for c in (check, f"{check}_detail")])
+        for course in sorted(matrix, key=str):
+            row = [course]
+            for check in checks:
+                cell = matrix[course].get(check)
+                row += ["" if cell is None else "pass" if cell[0] else "fail",
+                        "" if cell is None else cell[1]]
+            writer.writerow(row)
+    print(f"Verification matrix written to {output_path}.")
+
+
+def main():
+    setup_logging("verifier_log.txt")
+    parser = argparse.ArgumentParser(
+        description="Check over HTTP that the last run's announcements, folders, assignments and gradebook changes landed.")
+    parser.add_argument("checks", nargs="*",
+                        help=f"checks to run (default: every check with input files): {', '.join(CHECKS)}")
+    args = parser.parse_args()
+    unknown = sorted(set(args.checks) - set(CHECKS))
+    if unknown:
+        parser.error(f"unknown check(s): {', '.join(unknown)}")
+
+    outcomes = expected_outcomes(args.checks or CHECKS)
+    if not outcomes:
+        print("Nothing to verify. Exiting.")
+        return
+    sessions = login_sessions(FETCH_WORKERS)
+    if not sessions:
+        print("Login failed. Exiting.")
+        return
+    start_time = time.time()
+    matrix = verify(sessions, outcomes)
+    write_matrix(matrix, [check for check in CHECKS if check in outcomes])
+    failed = sum(1 for row in matrix.values() for passed, _ in row.values() if not passed)
+    print(f"Verified {len(matrix)} course(s) in {time.time() - start_time:.2f} seconds, "
+          f"{failed} failed check(s).")
+
+
+if __name__ == "__main__":
+    main()